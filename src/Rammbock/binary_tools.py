@@ -45,6 +45,8 @@ LONGLONG = struct.Struct('>Q')
 def to_bin(string_value):
     if string_value in (None, ''):
         return ''
+    if isinstance(string_value, bytearray):
+        return str(string_value)
     string_value = str(string_value)
     if string_value.startswith('0x'):
         return _hex_to_bin(string_value)
@@ -75,6 +77,60 @@ def to_bin_of_length(length, string_value):
     return bin.rjust(length, '\x00')
 
 
+def _get_uint_codecs(byte_order):
+    """Returns struct and amount of zero padding for each integer width up to
+    8 bytes. Odd widths like 3 or 5 bytes are padded to the next native
+    width."""
+    codecs = {}
+    for length in range(1, 9):
+        size, format = [(size, format) for size, format
+                        in ((1, 'B'), (2, 'H'), (4, 'I'), (8, 'Q'))
+                        if size >= length][0]
+        codecs[length] = (struct.Struct(byte_order + format), size - length)
+    return codecs
+
+_UINT_CODECS = {False: _get_uint_codecs('>'), True: _get_uint_codecs('<')}
+
+
+def bin_to_int(binary, little_endian=False):
+    codec = _UINT_CODECS[little_endian].get(len(binary))
+    if codec:
+        struct_, padding = codec
+        padding = '\x00' * padding
+        return struct_.unpack(binary + padding if little_endian
+                              else padding + binary)[0]
+    if not binary:
+        return 0
+    return int(to_hex(binary[::-1] if little_endian else binary), 16)
+
+
+def int_to_bin_of_length(length, integer, little_endian=False):
+    if integer < 0:
+        raise AssertionError('Negative value %s can not be encoded as unsigned'
+                             % integer)
+    if integer >> (length * 8):
+        raise AssertionError('Too long binary value %s (max length %d)'
+                             % (integer, length))
+    codec = _UINT_CODECS[little_endian].get(length)
+    if codec:
+        struct_, padding = codec
+        binary = struct_.pack(integer)
+        return binary[:length] if little_endian else binary[padding:]
+    binary = binascii.unhexlify(('%x' % integer).rjust(length * 2, '0'))
+    return binary[::-1] if little_endian else binary
+
+
+def to_integer(value):
+    """Converts integers and their decimal, hex and binary string
+    presentations to integer. Byte arrays are converted as big endian
+    binary."""
+    if isinstance(value, (int, long)):
+        return value
+    if isinstance(value, bytearray):
+        return bin_to_int(str(value))
+    return to_int(str(value).replace(' ', '').rstrip('L'))
+
+
 def to_hex(binary):
     return binascii.hexlify(binary)
 
@@ -94,26 +150,48 @@ def to_bin_str_from_int_string(length, value):
     return to_binary_string_of_length(length, to_bin(value))[2:]
 
 
+# TBCD stores two digits per byte, the first digit in the low nibble. A high
+# nibble of 0xf is a filler that ends an odd length value.
+_TBCD_FILLER = 0xf0
+_TBCD_DIGITS = tuple(str(byte & 0x0f) if byte >= _TBCD_FILLER
+                     else str(byte & 0x0f) + str(byte >> 4)
+                     for byte in range(256))
+_TBCD_BYTES = dict((first + second, chr(int(second) << 4 | int(first)))
+                   for first in '0123456789' for second in '0123456789')
+_TBCD_BYTES.update((digit, chr(_TBCD_FILLER | int(digit)))
+                   for digit in '0123456789')
+
+
 def to_tbcd_value(binary):
-    bin_str, value = to_binary_string_of_length(len(to_hex(binary)) *
-                                                4, binary), ""
-    for index in range(2, len(bin_str), 8):
-        if int(bin_str[index:index + 4], 2) == 15:
-            return value + str(int(bin_str[index + 4: index + 8], 2))
-        value += "%s%s" % (int(bin_str[index + 4:index + 8], 2),
-                           int(bin_str[index: index + 4], 2))
-    return value
+    digits = []
+    for byte in bytearray(binary):
+        digits.append(_TBCD_DIGITS[byte])
+        if byte >= _TBCD_FILLER:
+            break
+    return ''.join(digits)
 
 
 def to_tbcd_binary(tbcd_string):
-    value, index = "0b", 0
-    while index <= len(tbcd_string) - 2:
-        value += to_bin_str_from_int_string(4, tbcd_string[index + 1]) +\
-            to_bin_str_from_int_string(4, tbcd_string[index])
-        index += 2
-    return to_bin(value if index == len(tbcd_string)
-                  else value + to_bin_str_from_int_string(4, 15) +
-                  to_bin_str_from_int_string(4, tbcd_string[index]))
+    try:
+        return ''.join(_TBCD_BYTES[tbcd_string[index:index + 2]]
+                       for index in xrange(0, len(tbcd_string), 2))
+    except KeyError:
+        raise ValueError('Invalid TBCD value %s' % tbcd_string)
+
+
+def with_tbcd_filler(binary):
+    """Replaces the last digit of TBCD encoded `binary` with the filler."""
+    if not binary:
+        return binary
+    return binary[:-1] + chr(_TBCD_FILLER | ord(binary[-1]) & 0x0f)
+
+
+def tbcd_length(binary):
+    """Returns the number of digits in TBCD encoded `binary`."""
+    for index, byte in enumerate(bytearray(binary)):
+        if byte >= _TBCD_FILLER:
+            return index * 2 + 1
+    return len(binary) * 2
 
 
 def to_twos_comp(val, bits):
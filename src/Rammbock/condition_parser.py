@@ -1,71 +1,100 @@
+import operator
+import re
+
+from Rammbock.binary_tools import to_int
+
+
 class ConditionParser(object):
+    """Condition compiled once to a function of the message fields.
+
+    Conditions combined with `&&` and `||` are evaluated from left to right
+    and the evaluation stops as soon as the result is known.
+    """
 
     def __init__(self, condition):
-        import re
+        self.condition = condition
         logicals = re.split('(&&|\|\|)', condition)
-        self.conditions = self._get_individual_conditions(logicals)
-
-    def _get_individual_conditions(self, logicals):
-        conditions = []
-        for element in logicals:
-            if element in ('&&', '||'):
-                conditions.append(element)
-            else:
-                conditions.append(ExpressionEvaluator(element))
-        return conditions
-
-    def evaluate(self, msg_fields):
-        status = True
-        operator = '&&'
-        for condition in self.conditions:
-            if condition in ('&&', '||'):
-                operator = condition
-            else:
-                evaluated = condition.evaluate(msg_fields)
-                if operator == '&&':
-                    status = status and evaluated
-                else:
-                    status = status or evaluated
-        return status
+        self.evaluators = [ExpressionEvaluator(expression) for expression in logicals[::2]]
+        self.evaluate = self._compile(logicals[1::2])
+
+    def __getstate__(self):
+        return self.condition
+
+    def __setstate__(self, condition):
+        self.__init__(condition)
+
+    def _compile(self, operators):
+        evaluate = self.evaluators[0].evaluate
+        for logical, evaluator in zip(operators, self.evaluators[1:]):
+            evaluate = self._combine(logical, evaluate, evaluator.evaluate)
+        return evaluate
+
+    @property
+    def paths(self):
+        """Names of the fields used in the condition split to parts."""
+        return [evaluator.path for evaluator in self.evaluators]
+
+    def _combine(self, logical, first, second):
+        if logical == '&&':
+            return lambda msg_fields: first(msg_fields) and second(msg_fields)
+        return lambda msg_fields: first(msg_fields) or second(msg_fields)
 
 
 class ExpressionEvaluator(object):
+    """Single comparison `name [& mask] <operator> value`.
+
+    Supported operators are `==`, `!=`, `<`, `>`, `<=` and `>=`. Values can
+    also be tested for membership with `name in (value1, value2, ...)`. A
+    masked value without an operator, e.g. `flags & 0x80`, is true when any
+    of the masked bits are set.
+    """
+
+    _expression = re.compile(r'^\s*(?P<name>[^\s&=!<>()]+)\s*'
+                             r'(?:&\s*(?P<mask>[^\s=!<>()]+)\s*)?'
+                             r'(?:(?P<operator>==|!=|<=|>=|<|>)\s*(?P<value>\S+)'
+                             r'|in\s*\((?P<values>[^()]*)\))?\s*$')
+    _operators = {'==': operator.eq, '!=': operator.ne,
+                  '<': operator.lt, '>': operator.gt,
+                  '<=': operator.le, '>=': operator.ge}
 
     def __init__(self, condition):
-        if '==' in condition:
-            self.name, self.value = self._parse('==', condition)
-
-            def evaluate(msg_fields):
-                return self._get_field(msg_fields) == self.value
-            self.evaluate = evaluate
-        elif '!=' in condition:
-            self.name, self.value = self._parse('!=', condition)
-
-            def evaluate(msg_fields):
-                return self._get_field(msg_fields) != self.value
-            self.evaluate = evaluate
-        else:
+        match = self._expression.match(condition)
+        if not match or not (match.group('operator') or match.group('values') or
+                             match.group('mask')):
             raise IllegalConditionException('Unsupported operation: %s' % condition)
+        self.name = match.group('name')
+        self.path = tuple(self.name.split('.'))
+        self.evaluate = self._compile(match)
+
+    def _compile(self, match):
+        get_value = self._get_field
+        if match.group('mask'):
+            mask = self._parse_value(match.group('mask'))
 
-    def _parse(self, operator, condition):
-        cond = condition.partition(operator)
-        name = cond[0].strip()
-        if not name:
-            raise IllegalConditionException('Illegal condition: %s' % condition)
-        value = self._parse_value(cond[2].strip())
-        return name, value
+            def get_value(msg_fields):
+                return self._get_field(msg_fields) & mask
+        if match.group('operator'):
+            compare = self._operators[match.group('operator')]
+            value = self._parse_value(match.group('value'))
+            return lambda msg_fields: compare(get_value(msg_fields), value)
+        if match.group('values') is not None:
+            values = frozenset(self._parse_value(value.strip())
+                               for value in match.group('values').split(','))
+            return lambda msg_fields: get_value(msg_fields) in values
+        return lambda msg_fields: get_value(msg_fields) != 0
 
     def _parse_value(self, value):
         try:
-            return int(value)
-        except:
+            return to_int(value)
+        except Exception:
             raise IllegalConditionException('Expected integer, unsupported value given: %s' % value)
 
     def _get_field(self, elem):
-        for part in self.name.split('.'):
-            if part not in elem:
-                raise IllegalConditionException('Given name condition: %s not found in message fields' % self.name)
-            elem = elem[part]
+        try:
+            for part in self.path:
+                elem = elem[part]
+        except KeyError:
+            raise IllegalConditionException('Given name condition: %s not found in message fields' % self.name)
         return elem.int
 
 
@@ -13,11 +13,17 @@
 #  limitations under the License.
 
 from __future__ import with_statement
-import copy
+import cPickle as pickle
+import hashlib
+import os
+import tempfile
+from collections import MutableMapping, OrderedDict
 from contextlib import contextmanager
 from .logger import logger
 from .synchronization import SynchronizedType
-from .templates.containers import BagTemplate, CaseTemplate
+from .templates.containers import BagTemplate, CaseTemplate, TLVTemplate, \
+    TLVElementTemplate
+from .templates.validators import Expectations
 from .message import _StructuredElement
 from .networking import (TCPServer, TCPClient, UDPServer, UDPClient, SCTPServer,
                          SCTPClient, _NamedCache)
@@ -27,6 +33,9 @@ from .templates import (Protocol, UInt, Int, PDU, MessageTemplate, Char, Binary,
                         BinaryContainerTemplate, ConditionalTemplate,
                         TBCDContainerTemplate)
 from .binary_tools import to_0xhex, to_bin
+from .definitions import DefinitionLoader
+from .prepared import PreparedMessage, PreparedExpectation, import_function
+from .version import VERSION
 
 
 class RammbockCore(object):
@@ -48,6 +57,8 @@ class RammbockCore(object):
         self._field_values = {}
         self._message_sequence = MessageSequence()
         self._message_templates = {}
+        self._types = {}
+        self._encoded_messages = _EncodedMessageCache()
         self.reset_handler_messages()
 
     @property
@@ -157,17 +168,30 @@ class RammbockCore(object):
         for server in self._servers:
             server.empty()
 
-    def new_protocol(self, protocol_name):
+    def new_protocol(self, protocol_name, terminator=None):
         """Start defining a new protocol template.
 
         All messages sent and received from a connection that uses a protocol
         have to conform to this protocol template.
+
+        Messages of a protocol with a `terminator` are framed by it instead of
+        their lengths: the terminator is sent after every message, and received
+        data is split to messages at the terminator. The header fields are
+        decoded from the beginning of the frame and the PDU is the rest of the
+        frame, so its length is given as `*`. The terminator must not occur
+        inside the messages.
+
+        Examples:
+        | New Protocol | LineProtocol | terminator=0x0d0a |
+        | Chars | 4 | command |
+        | PDU | * |
+        | End Protocol |
         """
         if self._protocol_in_progress:
             raise Exception('Can not start a new protocol definition in middle of old.')
         if protocol_name in self._protocols:
             raise Exception('Protocol %s already defined' % protocol_name)
-        self._init_new_message_stack(Protocol(protocol_name, library=self))
+        self._init_new_message_stack(Protocol(protocol_name, library=self, terminator=terminator))
         self._protocol_in_progress = True
 
     def end_protocol(self):
@@ -456,6 +480,7 @@ class RammbockCore(object):
         template = self._get_message_template()
         if not unlocked:
             template.set_as_saved()
+        template.precompute_values(self._field_values)
         self._message_templates[name] = (template, self._field_values)
 
     def load_template(self, name, *parameters):
@@ -479,9 +504,28 @@ class RammbockCore(object):
         | Load Copy Of Template | MyMessage | header_field:value |
         """
         template, fields, header_fields = self._set_templates_fields_and_header_fields(name, parameters)
-        copy_of_template = copy.deepcopy(template)
-        copy_of_fields = copy.deepcopy(fields)
-        self._init_new_message_stack(copy_of_template, copy_of_fields, header_fields)
+        self._init_new_message_stack(template.copy(), _FieldValues(fields), header_fields)
+
+    def get_template(self, name):
+        """Returns the message template saved with `Save template` for use
+        from Python code, for example in handler functions.
+
+        The template encodes and validates messages with field values given
+        as dicts of native values, and the network nodes given to handlers
+        send and receive messages with it. Values set with `Value` before
+        saving the template are used as defaults. Using the template does
+        not change the template loaded to the library.
+
+        Example:
+        | def respond_to_sample(rammbock, msg, client):
+        |     template = rammbock.get_template('sample response')
+        |     client.send_message(template, {'status': 0, 'pair': {'first': 2}})
+        |     reply = client.receive_message(template, expect={'status': 1}, timeout=5)
+        """
+        if name not in self._message_templates:
+            raise AssertionError("Template '%s' not saved" % name)
+        template, fields = self._message_templates[name]
+        return template.with_defaults(fields)
 
     def _set_templates_fields_and_header_fields(self, name, parameters):
         configs, fields, header_fields = self._parse_parameters(parameters)
@@ -489,6 +533,105 @@ class RammbockCore(object):
         template, fields = self._message_templates[name]
         return template, fields, header_fields
 
+    def load_definitions(self, path):
+        """Define protocols and message templates from a JSON or YAML file.
+
+        The file contains a list of `protocols` and a list of `messages`.
+        Every field is given with its `type`, the name of the keyword defining
+        the field, and the arguments of that keyword. Structs, unions,
+        conditionals and containers have their fields in `fields`, and
+        arrays, bag cases and TLV elements have their single field in `field`.
+        Messages are saved as templates with their `name`, or `template` if
+        given, and can be used with `Load Template`. Shared types for `Use Type`
+        are defined in a list of `types`. YAML files require PyYAML.
+
+        Example file:
+        | {"protocols": [{"name": "Example", "fields": [
+        |      {"type": "u8", "name": "msgId"},
+        |      {"type": "u8", "name": "length"},
+        |      {"type": "pdu", "length": "length-2"}]}],
+        |  "messages": [{"name": "Request", "protocol": "Example",
+        |      "header": {"msgId": 5}, "values": {"items[0]": 1},
+        |      "fields": [{"type": "u8", "name": "count"},
+        |                 {"type": "array", "size": "count", "name": "items",
+        |                  "field": {"type": "u16"}}]}]}
+
+        Examples:
+        | Load Definitions | ${CURDIR}/protocols.json |
+        | Load Template | Request |
+        """
+        DefinitionLoader(self).load(path)
+
+    def save_templates_to_cache(self, path, *sources):
+        """Save defined protocols, types and saved message templates to a cache file.
+
+        The cache is keyed by a hash of the contents of the given `sources`,
+        the files containing the keywords that define the templates, and of
+        the Rammbock library itself. Load the cache with `Load templates from
+        cache`.
+
+        The cache file is a Python pickle, and loading it can run arbitrary
+        code. Save it to a directory that only trusted users can write to,
+        not to a shared temporary directory.
+
+        Examples:
+        | Save Templates To Cache | ${OUTPUT DIR}/templates.cache | ${CURDIR}/protocols.robot |
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        handle, temp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(handle, 'wb') as cache:
+                pickle.dump(self._definitions_hash(sources), cache, pickle.HIGHEST_PROTOCOL)
+                pickle.dump((self._protocols, self._message_templates, self._types),
+                            cache, pickle.HIGHEST_PROTOCOL)
+        except:
+            os.remove(temp_path)
+            raise
+        self._replace_file(temp_path, path)
+
+    def load_templates_from_cache(self, path, *sources):
+        """Load protocols and message templates saved with `Save templates to cache`.
+
+        Returns `True` if the templates were loaded and `False` if the cache
+        file does not exist or the contents of the `sources` have changed
+        after the cache was saved. Loaded templates replace ones defined with
+        the same names.
+
+        The cache file is a Python pickle, and loading it can run arbitrary
+        code. Load only cache files saved by trusted test runs to a directory
+        that only trusted users can write to.
+
+        Examples:
+        | ${loaded}= | Load Templates From Cache | ${OUTPUT DIR}/templates.cache | ${CURDIR}/protocols.robot |
+        | Run Keyword Unless | ${loaded} | Define Templates |
+        """
+        if not os.path.isfile(path):
+            return False
+        with open(path, 'rb') as cache:
+            if pickle.load(cache) != self._definitions_hash(sources):
+                return False
+            protocols, message_templates, types = pickle.load(cache)
+        for protocol in protocols.values():
+            protocol.library = self
+        self._protocols.update(protocols)
+        self._message_templates.update(message_templates)
+        self._types.update(types)
+        return True
+
+    def _definitions_hash(self, sources):
+        digest = hashlib.sha1(_library_digest())
+        for source in sources:
+            with open(source, 'rb') as definitions:
+                digest.update(definitions.read())
+        return digest.hexdigest()
+
+    def _replace_file(self, source, target):
+        try:
+            os.rename(source, target)
+        except OSError:
+            os.remove(target)
+            os.rename(source, target)
+
     def get_message(self, *parameters):
         """Get encoded message.
 
@@ -545,8 +688,117 @@ class RammbockCore(object):
 
     def _send_message(self, callback, parameters):
         configs, message_fields, header_fields = self._get_parameters_with_defaults(parameters)
-        msg = self._encode_message(message_fields, header_fields)
-        callback(msg._raw, label=self._current_container.name, **configs)
+        key = self._encoded_messages.key(self._get_message_template(), message_fields, header_fields)
+        cached = self._encoded_messages.get(key)
+        if cached is None:
+            msg = self._encode_message(message_fields, header_fields)
+            cached = msg, msg._raw
+            self._encoded_messages.put(key, cached)
+        else:
+            logger.debug('Using cached encoding of %s' % repr(cached[0]))
+        callback(cached[1], label=self._current_container.name, **configs)
+
+    def set_encoded_message_cache_size(self, size):
+        """Sets the number of encoded messages cached for sending.
+
+        Sending the same template with the same field values again uses the
+        cached bytes instead of encoding the message again. The least
+        recently sent messages are dropped when the cache is full. Size 0
+        disables the cache. The default size is 128.
+
+        A message sent from the cache is logged at debug level as the cached
+        message it was encoded from, with a note that the cache was used.
+
+        Examples:
+        | Set Encoded Message Cache Size | 1000 |
+        """
+        self._encoded_messages.resize(int(size))
+
+    def get_encoded_message_cache_statistics(self):
+        """Returns a dictionary with the `hits`, `misses` and current `size`
+        of the encoded message cache. See `Set Encoded Message Cache Size`.
+
+        Examples:
+        | ${stats}= | Get Encoded Message Cache Statistics |
+        | Should Be Equal As Integers | ${stats['hits']} | 99 |
+        """
+        return self._encoded_messages.statistics
+
+    def prepare_message(self, *parameters):
+        """Encodes the message defined with `New Message` once and returns it
+        for sending repeatedly with `Client Sends Prepared Message` and
+        `Server Sends Prepared Message`.
+
+        Each send patches only the bytes of the variable fields of the
+        prepared message instead of encoding the whole message again.
+        Variable fields must have a static length, and neither other fields
+        nor conditions may depend on their value.
+
+        Optional parameters:
+        - `variables` comma separated names of the variable fields. Header fields are named with header:field_name.
+        - `increment` comma separated names of uint fields whose value is incremented by one after each send.
+        - `generators` comma separated field names and functions separated with colon. The function is given as `module.function` and called without arguments before each send to get the value of the field.
+        - message field values separated with colon and other parameters of the send keywords, like in `Client Sends Message`.
+
+        Examples:
+        | ${msg}= | Prepare Message | header:seq:1 | increment=header:seq | variables=session |
+        | ${msg}= | Prepare Message | generators=timestamp:my_module.now | name=Client1 |
+        """
+        configs, message_fields, header_fields = self._get_parameters_with_defaults(parameters)
+        variables = self._split_names(configs.pop('variables', ''))
+        increments = self._split_names(configs.pop('increment', ''))
+        generators = [self._name_and_value(':', item)
+                      for item in self._split_names(configs.pop('generators', ''))]
+        prepared = PreparedMessage(self._get_message_template(), dict(message_fields),
+                                   dict(header_fields), label=self._current_container.name,
+                                   configs=configs)
+        for name in variables:
+            prepared.variable(name)
+        for name in increments:
+            prepared.increment(name)
+        for name, function in generators:
+            prepared.variable(name, import_function(function))
+        return prepared
+
+    def _split_names(self, names):
+        return [name.strip() for name in names.split(',') if name.strip()]
+
+    def client_sends_prepared_message(self, prepared, *parameters):
+        """Sends a message prepared with `Prepare Message`.
+
+        Optional parameters are field values separated with colon and client
+        `name` separated with equals. Values of variable fields are patched
+        to the prepared message, other field values encode the message
+        again.
+
+        Examples:
+        | Client Sends Prepared Message | ${msg} |
+        | Client Sends Prepared Message | ${msg} | session:0x42 | name=Client1 |
+        """
+        self._send_prepared_message(self.client_sends_binary, prepared, parameters)
+
+    def server_sends_prepared_message(self, prepared, *parameters):
+        """Sends a message prepared with `Prepare Message`.
+
+        Optional parameters are field values separated with colon and server
+        `name` and `connection` alias separated with equals. Values of
+        variable fields are patched to the prepared message, other field
+        values encode the message again.
+
+        Examples:
+        | Server Sends Prepared Message | ${msg} |
+        | Server Sends Prepared Message | ${msg} | session:0x42 | connection=my_connection |
+        """
+        self._send_prepared_message(self.server_sends_binary, prepared, parameters)
+
+    def _send_prepared_message(self, callback, prepared, parameters):
+        configs, message_fields, header_fields = self._parse_parameters(parameters)
+        message_fields.update(('header:%s' % name, value) for name, value in header_fields.items())
+        if configs:
+            configs = dict(prepared.configs, **configs)
+        else:
+            configs = prepared.configs
+        callback(prepared.encode(message_fields), label=prepared.label, **configs)
 
     def client_receives_message(self, *parameters):
         """Receive a message with template defined using `New Message` and
@@ -559,6 +811,8 @@ class RammbockCore(object):
         - `name` the client name (default is the latest used) example: `name=Client 1`
         - `timeout` for receiving message. example: `timeout=0.1`
         - `latest` if set to True, get latest message from buffer instead first. Default is False. Example: `latest=True`
+        - `fail_fast` if set to True, validation stops at the first mismatching field. Default is False. Example: `fail_fast=True`
+        - `validate_on_decode` if set to True, fields are validated while the message is decoded and decoding stops at the first mismatching field. Default is False. Example: `validate_on_decode=True`
         -  message field values for validation separated with colon. example: `some_field:0xaf05`
 
         Examples:
@@ -566,8 +820,7 @@ class RammbockCore(object):
         | ${msg} = | Client receives message | name=Client1 | timeout=5 |
         | ${msg} = | Client receives message | message_field:(0|1) |
         """
-        with self._receive(self._clients, *parameters) as (msg, message_fields, header_fields):
-            self._validate_message(msg, message_fields, header_fields)
+        with self._receive(self._clients, parameters, validate=True) as msg:
             return msg
 
     def client_receives_without_validation(self, *parameters):
@@ -585,7 +838,7 @@ class RammbockCore(object):
         | ${msg} = | Client receives without validation |
         | ${msg} = | Client receives without validation | name=Client1 | timeout=5 |
         """
-        with self._receive(self._clients, *parameters) as (msg, _, _):
+        with self._receive(self._clients, parameters) as msg:
             return msg
 
     def server_receives_message(self, *parameters):
@@ -600,6 +853,8 @@ class RammbockCore(object):
         - `connection` alias. example: `connection=connection 1`
         - `timeout` for receiving message. example: `timeout=0.1`
         - `latest` if set to True, get latest message from buffer instead first. Default is False. Example: `latest=True`
+        - `fail_fast` if set to True, validation stops at the first mismatching field. Default is False. Example: `fail_fast=True`
+        - `validate_on_decode` if set to True, fields are validated while the message is decoded and decoding stops at the first mismatching field. Default is False. Example: `validate_on_decode=True`
         -  message field values for validation separated with colon. example: `some_field:0xaf05`
 
         Optional parameters are server `name`, `connection` alias and
@@ -611,8 +866,7 @@ class RammbockCore(object):
         | ${msg} = | Server receives message | name=Server1 | alias=my_connection | timeout=5 |
         | ${msg} = | Server receives message | message_field:(0|1) |
         """
-        with self._receive(self._servers, *parameters) as (msg, message_fields, header_fields):
-            self._validate_message(msg, message_fields, header_fields)
+        with self._receive(self._servers, parameters, validate=True) as msg:
             return msg
 
     def server_receives_without_validation(self, *parameters):
@@ -631,40 +885,123 @@ class RammbockCore(object):
         | ${msg} = | Server receives without validation |
         | ${msg} = | Server receives without validation | name=Server1 | alias=my_connection | timeout=5 |
         """
-        with self._receive(self._servers, *parameters) as (msg, _, _):
+        with self._receive(self._servers, parameters) as msg:
             return msg
 
     def validate_message(self, msg, *parameters):
         """Validates given message using template defined with `New Message` and
         field values given as optional arguments.
 
+        Validation stops at the first mismatching field if `fail_fast` is
+        set to True.
+
         Examples:
         | Validate message | ${msg} |
         | Validate message | ${msg} | status:0 |
+        | Validate message | ${msg} | fail_fast=True | status:0 |
         """
-        _, message_fields, header_fields = self._get_parameters_with_defaults(parameters)
-        self._validate_message(msg, message_fields, header_fields)
+        configs, message_fields, header_fields = self._get_parameters_with_defaults(parameters)
+        self._validate_message(msg, message_fields, header_fields,
+                               self._pop_boolean(configs, 'fail_fast'))
 
-    def _validate_message(self, msg, message_fields, header_fields):
-        errors = self._get_message_template().validate(msg, message_fields, header_fields)
+    def _validate_message(self, msg, message_fields, header_fields, fail_fast=False):
+        errors = self._get_message_template().validate(msg, message_fields, header_fields,
+                                                       fail_fast=fail_fast)
+        self._raise_validation_errors(msg, errors)
+
+    def _raise_validation_errors(self, msg, errors):
         if errors:
             logger.info("Validation failed for %s" % repr(msg))
             logger.info('\n'.join(errors))
             raise AssertionError(errors[0])
 
-    @contextmanager
-    def _receive(self, nodes, *parameters):
+    def prepare_expectation(self, *parameters):
+        """Returns the message template defined with `New Message` and the
+        expected field values for receiving messages repeatedly with `Client
+        Receives With Prepared Expectation` and `Server Receives With
+        Prepared Expectation`.
+
+        The parameters are parsed and the default values of the template
+        merged only once. Parameters are the same as with `Client Receives
+        Message` and `Server Receives Message`.
+
+        Examples:
+        | ${expected}= | Prepare Expectation | status:0 | timeout=5 |
+        """
+        configs, message_fields, header_fields = self._get_parameters_with_defaults(parameters)
+        return PreparedExpectation(self._get_message_template(), dict(message_fields),
+                                   dict(header_fields), label=self._current_container.name,
+                                   configs=configs)
+
+    def client_receives_with_prepared_expectation(self, prepared, *parameters):
+        """Receives and validates a message expected with `Prepare Expectation`.
+
+        Optional parameters are field values and parameters of `Client
+        Receives Message` overriding the prepared ones.
+
+        Examples:
+        | ${msg}= | Client Receives With Prepared Expectation | ${expected} |
+        | ${msg}= | Client Receives With Prepared Expectation | ${expected} | sequence:2 |
+        """
+        with self._receive_with_prepared_expectation(self._clients, prepared, parameters) as msg:
+            return msg
+
+    def server_receives_with_prepared_expectation(self, prepared, *parameters):
+        """Receives and validates a message expected with `Prepare Expectation`.
+
+        Optional parameters are field values and parameters of `Server
+        Receives Message` overriding the prepared ones.
+
+        Examples:
+        | ${msg}= | Server Receives With Prepared Expectation | ${expected} |
+        | ${msg}= | Server Receives With Prepared Expectation | ${expected} | sequence:2 |
+        """
+        with self._receive_with_prepared_expectation(self._servers, prepared, parameters) as msg:
+            return msg
+
+    def _receive_with_prepared_expectation(self, nodes, prepared, parameters):
+        configs, message_fields, header_fields = self._parse_parameters(parameters)
+        return self._receive_message(nodes, prepared.template, prepared.label,
+                                     dict(prepared.configs, **configs),
+                                     self._override(prepared.message_fields, message_fields),
+                                     self._override(prepared.header_fields, header_fields),
+                                     validate=True)
+
+    def _override(self, values, overrides):
+        return dict(values, **overrides) if overrides else values
+
+    def _receive(self, nodes, parameters, validate=False):
         configs, message_fields, header_fields = self._get_parameters_with_defaults(parameters)
+        return self._receive_message(nodes, self._get_message_template(),
+                                     self._current_container.name, configs,
+                                     message_fields, header_fields, validate)
+
+    @contextmanager
+    def _receive_message(self, nodes, template, label, configs, message_fields,
+                         header_fields, validate=False):
         node, name = nodes.get_with_name(configs.pop('name', None))
-        msg = node.get_message(self._get_message_template(), **configs)
+        fail_fast = self._pop_boolean(configs, 'fail_fast')
+        expectations = None
+        if self._pop_boolean(configs, 'validate_on_decode') and validate:
+            expectations = Expectations(message_fields, header_fields)
+            configs['expectations'] = expectations
+        msg = node.get_message(template, **configs)
         try:
-            yield msg, message_fields, header_fields
-            self._register_receive(node, self._current_container.name, name)
+            if expectations is not None:
+                self._raise_validation_errors(msg, expectations.errors)
+            elif validate:
+                self._raise_validation_errors(msg, template.validate(msg, message_fields, header_fields,
+                                                                     fail_fast=fail_fast))
+            yield msg
+            self._register_receive(node, label, name)
             logger.debug("Received %s" % repr(msg))
         except AssertionError, e:
-            self._register_receive(node, self._current_container.name, name, error=e.args[0])
+            self._register_receive(node, label, name, error=e.args[0])
             raise e
 
+    def _pop_boolean(self, configs, name, default=False):
+        return str(configs.pop(name, default)).lower() not in ('false', 'no', '')
+
     def uint(self, length, name, value=None, align=None):
         """Add an unsigned integer to template.
 
@@ -851,6 +1188,10 @@ class RammbockCore(object):
         elements are matched in order that the cases are given, the elements dont
         need to arrive in the same order as the cases are.
 
+        Cases whose first field has a fixed value, like the AVP code in the
+        example below, are indexed by that value when the bag is ended. Only the
+        cases that can match the received value are then tried.
+
 
         This example would match int value 42 0-1 times and in value 1 0-2 times.
         For example 1, 42, 1 would match, as would 1, 1:
@@ -881,6 +1222,7 @@ class RammbockCore(object):
         """Ends a bag started with `Start Bag`.
         """
         bag = self._message_stack.pop()
+        bag.build_index()
         self._add_field(bag)
 
     def _start_bag_case(self, size):
@@ -890,6 +1232,140 @@ class RammbockCore(object):
         case = self._message_stack.pop()
         self._add_field(case)
 
+    def start_tlv(self, name, *parameters):
+        """Starts a type-length-value container of elements defined with `TLV Element`.
+
+        Each element is a tag followed by a length and the value of the element.
+        Optional configuration parameters are:
+        - `tag`: width of the tag in bytes, default 1.
+        - `length`: width of the length in bytes, default 1.
+        - `inclusive`: whether the length includes the tag and length fields,
+          default true. Use `inclusive=false` when the length covers only the value.
+        - `align`: elements are padded to this many bytes. Padding is not
+          included in the length.
+
+        Values of fields like flags between the length and the actual value
+        are defined as part of the element value. On receiving, the TLV
+        container consumes all remaining data, so wrap it in a struct with
+        `length` if other fields follow it. Elements with unknown tags are
+        decoded as raw bytes named by their tag.
+
+        When sending, all elements are encoded in the order they are defined
+        unless the elements are listed with the name of the container, e.g.
+        `options:hostName,address,address`. Repeated elements are named
+        `address[1]`, `address[2]` and so on.
+
+        Received elements can be accessed by name, e.g. `${msg.options.hostName}`,
+        and with the tag in Python code, e.g. `msg.options[12]`. All the
+        elements with the same tag are returned by `msg.options.all(12)`.
+
+        Example:
+        | Start TLV | options | tag=1 | length=1 | inclusive=true |
+        | TLV Element | 12 | Chars | * | hostName |
+        | TLV Element | 50 | u32 | address |
+        | End TLV |
+        """
+        configs, _, _ = self._parse_parameters(parameters)
+        self._message_stack.append(TLVTemplate(name, self._current_container,
+                                               tag_width=configs.get('tag', 1),
+                                               length_width=configs.get('length', 1),
+                                               inclusive=self._pop_boolean(configs, 'inclusive', True),
+                                               align=configs.get('align')))
+
+    def end_tlv(self):
+        """Ends a TLV container started with `Start TLV`.
+        """
+        tlv = self._message_stack.pop()
+        self._add_field(tlv)
+
+    def _start_tlv_element(self, tag):
+        self._message_stack.append(TLVElementTemplate(tag, self._current_container))
+
+    def _end_tlv_element(self):
+        element = self._message_stack.pop()
+        self._add_field(element)
+
+    def new_struct_type(self, type, *parameters):
+        """Defines a named struct type that can be used in many templates with `Use Type`.
+
+        The type is defined like a struct with `New Struct` and ended with
+        `End Struct Type`. All the uses of the type share the same fields,
+        so the type is built and its field values are precomputed only once.
+        Lengths of the fields of a type can only refer to other fields of the
+        type. Optional parameters are default values of the fields and the
+        `length` and `align` of the struct.
+
+        Examples:
+        | New Struct Type | AVPHeader |
+        | u32 | code |
+        | u8 | flags |
+        | u24 | length |
+        | End Struct Type |
+        | New message | Request | Diameter |
+        | Use Type | AVPHeader | sessionId | code:263 |
+        """
+        configs, parameters, _ = self._parse_parameters(parameters)
+        self._start_type(StructTemplate(type, type, None, parameters,
+                                        length=configs.get('length'),
+                                        align=configs.get('align')))
+
+    def end_struct_type(self):
+        """Ends a struct type started with `New Struct Type`."""
+        self._end_type()
+
+    def new_union_type(self, type):
+        """Defines a named union type that can be used in many templates with `Use Type`.
+
+        The type is defined like a union with `New Union` and ended with
+        `End Union Type`.
+        """
+        self._start_type(UnionTemplate(type, type, None))
+
+    def end_union_type(self):
+        """Ends a union type started with `New Union Type`."""
+        self._end_type()
+
+    def start_bag_type(self, type):
+        """Defines a named bag type that can be used in many templates with `Use Type`.
+
+        The type is defined like a bag with `Start Bag` and ended with
+        `End Bag Type`. The cases of the bag are indexed only once.
+        """
+        self._start_type(BagTemplate(type, None))
+
+    def end_bag_type(self):
+        """Ends a bag type started with `Start Bag Type`."""
+        self._message_stack[-1].build_index()
+        self._end_type()
+
+    def _start_type(self, template):
+        if template.name in self._types:
+            raise Exception('Type %s already defined' % template.name)
+        self._message_stack.append(template)
+
+    def _end_type(self):
+        template = self._message_stack.pop()
+        self._types[template.name] = template
+
+    def use_type(self, type, name, *parameters):
+        """Adds a field `name` of a type defined with `New Struct Type`,
+        `New Union Type` or `Start Bag Type` to template.
+
+        Struct types accept the same optional parameters as `New Struct`:
+        default values of the fields and the `length` and `align` of the
+        struct. These override the values given when the type was defined.
+
+        Examples:
+        | Use Type | AVPHeader | header |
+        | Use Type | AVPHeader | header | code:264 | length=8 |
+        """
+        if type not in self._types:
+            raise AssertionError("Type '%s' not defined" % type)
+        configs, parameters, _ = self._parse_parameters(parameters)
+        self._add_field(self._types[type].use_as(name, self._current_container, parameters,
+                                                 length=configs.get('length'),
+                                                 align=configs.get('align')))
+
     def pdu(self, length):
         """Defines the message in protocol template.
 
@@ -950,8 +1426,8 @@ class RammbockCore(object):
             self._field_values[name] = value
 
     def _struct_fields_as_values(self, name, value):
-        for field_name in value._fields:
-            self.value('%s.%s' % (name, field_name), value._fields[field_name])
+        for field_name, field in zip(value._index.names, value._children):
+            self.value('%s.%s' % (name, field_name), field)
 
     def _parse_parameters(self, parameters):
         configs, fields = [], []
@@ -1000,6 +1476,9 @@ class RammbockCore(object):
         """Defines a 'condition' when conditional element of 'name' exists if `condition` is true.
 
         `condition` can contain multiple conditions combined together using Logical Expressions(&&,||).
+        Fields can be compared to integers with `==`, `!=`, `<`, `>`, `<=` and
+        `>=`, tested for membership with `in (value1, value2)` and masked with
+        `&`. A masked field without comparison is true if any masked bit is set.
 
         Example:
         | Conditional | mycondition == 1 | foo |
@@ -1009,6 +1488,10 @@ class RammbockCore(object):
         | Conditional | condition1 == 1 && condition2 != 2 | bar |
         | u8   | myelement | 8 |
         | End condtional |
+
+        | Conditional | flags & 0x80 && type in (1, 2, 5) | baz |
+        | u8   | myelement | 8 |
+        | End conditional |
         """
         self._message_stack.append(ConditionalTemplate(condition, name, self._current_container))
 
@@ -1070,3 +1553,109 @@ class RammbockCore(object):
         | Switch Server | server |
         """
         self._servers.set_current(name)
+
+
+class _FieldValues(MutableMapping):
+    """Field values of a loaded copy of a template. Only the values set
+    after loading are stored here, other values are read from the values
+    saved with the template."""
+
+    def __init__(self, saved):
+        self._saved = saved
+        self._values = {}
+
+    def __getitem__(self, name):
+        if name in self._values:
+            return self._values[name]
+        return self._saved[name]
+
+    def __setitem__(self, name, value):
+        self._values[name] = value
+
+    def __delitem__(self, name):
+        del self._values[name]
+
+    def __contains__(self, name):
+        return name in self._values or name in self._saved
+
+    def __iter__(self):
+        for name in self._values:
+            yield name
+        for name in self._saved:
+            if name not in self._values:
+                yield name
+
+    def __len__(self):
+        return len(self._values) + len([name for name in self._saved
+                                        if name not in self._values])
+
+
+_library_digest_value = None
+
+
+def _library_digest():
+    """Returns a hash of the version and the sources of Rammbock. Pickled
+    templates depend on the classes of the library, so caches saved with
+    other sources are not loaded."""
+    global _library_digest_value
+    if _library_digest_value is None:
+        digest = hashlib.sha1(VERSION)
+        root = os.path.dirname(os.path.abspath(__file__))
+        for directory, dirnames, filenames in sorted(os.walk(root)):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.endswith('.py'):
+                    with open(os.path.join(directory, filename), 'rb') as source:
+                        digest.update(source.read())
+        _library_digest_value = digest.hexdigest()
+    return _library_digest_value
+
+
+class _EncodedMessageCache(object):
+    """Least recently used cache of encoded messages keyed by the template
+    and the field values. Fields are only ever added to templates, so the
+    number of fields of the template tells whether it has changed."""
+
+    def __init__(self, size=128):
+        self._size = size
+        self._messages = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, template, message_fields, header_fields):
+        if not self._size:
+            return None
+        try:
+            return (template, len(template._fields),
+                    frozenset(template.header_parameters.items()),
+                    frozenset(message_fields.items()), frozenset(header_fields.items()))
+        except TypeError:
+            return None
+
+    def get(self, key):
+        if key is None:
+            return None
+        encoded = self._messages.pop(key, None)
+        if encoded is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._messages[key] = encoded
+        return encoded
+
+    def put(self, key, encoded):
+        if key is None:
+            return
+        self._messages[key] = encoded
+        while len(self._messages) > self._size:
+            self._messages.popitem(last=False)
+
+    def resize(self, size):
+        self._size = size
+        while len(self._messages) > size:
+            self._messages.popitem(last=False)
+
+    @property
+    def statistics(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._messages)}
@@ -0,0 +1,205 @@
+#  Copyright 2014 Nokia Siemens Networks Oyj
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from __future__ import with_statement
+import json
+import re
+
+
+class DefinitionLoader(object):
+    """Defines protocols and message templates from declarative definitions.
+
+    The definitions are a mapping with a list of `protocols` and a list of
+    `messages`. Each field is a mapping with the `type` of the field and the
+    arguments of the keyword defining that field, for example
+    `{"type": "uint", "length": 2, "name": "foo", "value": 42}`. Containers
+    have their contents in `fields`, and lists, bag cases and TLV elements
+    in a single `field`. The type of a struct or union is given in
+    `type_name` and defaults to its name.
+
+    Shared struct, union and bag types are defined in the list of `types`
+    with their `type_name`, and used in fields of type `use`, for example
+    `{"type": "use", "type_name": "Pair", "name": "pair"}`.
+    """
+
+    _integer = re.compile(r'([ui])(8|16|24|32|40|64|128)\Z')
+
+    def __init__(self, library):
+        self._library = library
+        self._containers = {'struct': self._struct,
+                            'container': self._container,
+                            'union': self._union,
+                            'list': self._list,
+                            'array': self._list,
+                            'bag': self._bag,
+                            'tlv': self._tlv,
+                            'conditional': self._conditional,
+                            'binary_container': self._binary_container,
+                            'tbcd_container': self._tbcd_container,
+                            'use': self._use}
+
+    def load(self, path):
+        with open(path) as source:
+            if path.lower().endswith(('.yaml', '.yml')):
+                definitions = self._load_yaml(source)
+            else:
+                definitions = json.load(source)
+        self.define(definitions)
+
+    def _load_yaml(self, source):
+        try:
+            import yaml
+        except ImportError:
+            raise Exception('Loading YAML definitions requires PyYAML to be installed.')
+        return yaml.safe_load(source)
+
+    def define(self, definitions):
+        definitions = _to_str(definitions)
+        for type in definitions.get('types', []):
+            self._define_type(type)
+        for protocol in definitions.get('protocols', []):
+            self._define_protocol(protocol)
+        for message in definitions.get('messages', []):
+            self._define_message(message)
+
+    def _define_protocol(self, protocol):
+        self._library.new_protocol(protocol['name'], protocol.get('terminator'))
+        self._add_fields(protocol['fields'])
+        self._library.end_protocol()
+
+    def _define_type(self, type):
+        kind, name = type['type'], type['type_name']
+        if kind == 'struct':
+            self._library.new_struct_type(name, *self._struct_parameters(
+                type.get('values'), type.get('length'), type.get('align')))
+            self._add_fields(type['fields'])
+            self._library.end_struct_type()
+        elif kind == 'union':
+            self._library.new_union_type(name)
+            self._add_fields(type['fields'])
+            self._library.end_union_type()
+        elif kind == 'bag':
+            self._library.start_bag_type(name)
+            self._add_cases(type['cases'])
+            self._library.end_bag_type()
+        else:
+            raise AssertionError("Unknown type '%s' of type definition '%s'" % (kind, name))
+
+    def _define_message(self, message):
+        header = ['header:%s:%s' % item for item in message.get('header', {}).items()]
+        self._library.new_message(message['name'], message.get('protocol'), *header)
+        self._add_fields(message['fields'])
+        for name, value in message.get('values', {}).items():
+            self._library.value(name, value)
+        self._library.save_template(message.get('template', message['name']),
+                                    message.get('unlocked', False))
+
+    def _add_fields(self, fields):
+        for field in fields:
+            self._add_field(dict(field))
+
+    def _add_field(self, field):
+        type = field.pop('type')
+        if type in self._containers:
+            self._containers[type](**field)
+            return
+        match = self._integer.match(type)
+        if match:
+            type = 'uint' if match.group(1) == 'u' else 'int'
+            field['length'] = int(match.group(2)) / 8
+        if type not in ('uint', 'int', 'chars', 'bin', 'tbcd', 'pdu'):
+            raise AssertionError("Unknown field type '%s' in definitions" % type)
+        getattr(self._library, type)(**field)
+
+    def _struct(self, name, fields, type_name=None, length=None, align=None, values=None):
+        self._library.new_struct(type_name or name, name,
+                                 *self._struct_parameters(values, length, align))
+        self._add_fields(fields)
+        self._library.end_struct()
+
+    def _struct_parameters(self, values, length, align):
+        parameters = ['%s:%s' % item for item in (values or {}).items()]
+        if length is not None:
+            parameters.append('length=%s' % length)
+        if align is not None:
+            parameters.append('align=%s' % align)
+        return parameters
+
+    def _use(self, type_name, name, length=None, align=None, values=None):
+        self._library.use_type(type_name, name,
+                               *self._struct_parameters(values, length, align))
+
+    def _container(self, name, length, fields):
+        self._struct(name, fields, type_name='Container', length=length)
+
+    def _union(self, name, fields, type_name=None):
+        self._library.new_union(type_name or name, name)
+        self._add_fields(fields)
+        self._library.end_union()
+
+    def _list(self, size, name, field):
+        self._library._new_list(size, name)
+        self._add_field(dict(field, name=''))
+        self._library._end_list()
+
+    def _bag(self, name, cases):
+        self._library.start_bag(name)
+        self._add_cases(cases)
+        self._library.end_bag()
+
+    def _add_cases(self, cases):
+        for case in cases:
+            self._library._start_bag_case(case['size'])
+            self._add_field(dict(case['field']))
+            self._library._end_bag_case()
+
+    def _tlv(self, name, elements, tag=1, length=1, inclusive=True, align=None):
+        parameters = ['tag=%s' % tag, 'length=%s' % length, 'inclusive=%s' % inclusive]
+        if align is not None:
+            parameters.append('align=%s' % align)
+        self._library.start_tlv(name, *parameters)
+        for element in elements:
+            self._library._start_tlv_element(element['tag'])
+            self._add_field(dict(element['field']))
+            self._library._end_tlv_element()
+        self._library.end_tlv()
+
+    def _conditional(self, condition, name, fields):
+        self._library.conditional(condition, name)
+        self._add_fields(fields)
+        self._library.end_conditional()
+
+    def _binary_container(self, name, fields):
+        self._library.new_binary_container(name)
+        self._add_fields(fields)
+        self._library.end_binary_container()
+
+    def _tbcd_container(self, name, fields):
+        self._library.new_tbcd_container(name)
+        self._add_fields(fields)
+        self._library.end_tbcd_container()
+
+
+def _to_str(value):
+    """Converts the strings and numbers of parsed definitions to the byte
+    strings Robot Framework would pass to the keywords."""
+    if isinstance(value, dict):
+        return dict((_to_str(key), _to_str(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return [_to_str(item) for item in value]
+    if isinstance(value, unicode):
+        return value.encode('UTF-8')
+    if isinstance(value, (int, long, float)) and not isinstance(value, bool):
+        return str(value)
+    return value
@@ -12,52 +12,161 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+from collections import OrderedDict
 from math import ceil
-from .binary_tools import to_0xhex, to_binary_string_of_length, \
-    to_bin_of_length, to_tbcd_value, to_tbcd_binary, from_twos_comp
-from .ordered_dict import OrderedDict
+import threading
+
+from .binary_tools import to_0xhex, to_binary_string_of_length, to_bin, \
+    to_tbcd_value, to_tbcd_binary, from_twos_comp, bin_to_int, \
+    int_to_bin_of_length, tbcd_length
+
+
+def intern_name(name):
+    try:
+        return intern(str(name))
+    except UnicodeError:
+        return name
+
+
+def _to_key(name):
+    return str(name) if isinstance(name, (int, long)) else name
+
+
+def _index_of(elements, element):
+    for index, item in enumerate(elements):
+        if item is element:
+            return index
+    raise ValueError(element)
+
+
+class NameIndex(object):
+    """Names of the children of message elements and their positions.
+
+    One index is shared by all the elements created from the same template.
+    Elements store only the list of their children and use
+    `names[:len(children)]` of the index, so a shared index is never modified
+    except for appending names to the end.
+    """
+    __slots__ = ('names', 'positions', '_prefixed')
+    _extend_lock = threading.Lock()
+
+    def __init__(self, names=()):
+        self.names = [intern_name(name) for name in names]
+        self.positions = dict((name, index) for index, name in enumerate(self.names))
+        self._prefixed = {}
+
+    def with_prefix(self, name):
+        if name not in self._prefixed:
+            self._prefixed[name] = NameIndex([name] + self.names)
+        return self._prefixed[name]
+
+    def extend_to(self, count):
+        with self._extend_lock:
+            for index in range(len(self.names), count):
+                name = intern_name(index)
+                self.names.append(name)
+                self.positions[name] = index
+
+    def put(self, position, name):
+        """Sets `name` at `position` and drops the names after it. Only
+        for indexes that are not shared between elements."""
+        for stale in self.names[position:]:
+            del self.positions[stale]
+        del self.names[position:]
+        name = intern_name(name)
+        self.names.append(name)
+        self.positions[name] = position
+
+
+EMPTY_INDEX = NameIndex()
+LIST_INDEX = NameIndex(range(64))
 
 
 class _StructuredElement(object):
 
+    __slots__ = ('_name', '_parent', '_index', '_children', '_cached_length')
     _type = None
 
-    def __init__(self, name):
+    def __init__(self, name, index=None):
         self._name = name
-        self._fields = OrderedDict()
         self._parent = None
+        self._index = index or EMPTY_INDEX
+        self._children = []
+        self._cached_length = None
 
     def __setitem__(self, name, child):
-        self._fields[unicode(name)] = child
+        name = _to_key(name)
+        position = self._index.positions.get(name)
+        if position is None or position > len(self._children):
+            position = self._add_name(name)
+        if position == len(self._children):
+            self._children.append(child)
+        else:
+            self._children[position] = child
         child._parent = self
+        self._invalidate_length()
+
+    def _add_name(self, name):
+        names = self._index.names[:len(self._children)]
+        self._index = NameIndex(names + [name])
+        return len(names)
 
     def __getitem__(self, name):
-        return self._fields[unicode(name)]
+        position = self._index.positions.get(_to_key(name))
+        if position is None or position >= len(self._children):
+            raise KeyError(name)
+        return self._children[position]
 
     def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
         return self[name]
 
     def __delitem__(self, name):
-        name = unicode(name)
-        item = self._fields[name]
-        del self._fields[name]
+        name = _to_key(name)
+        item = self[name]
+        position = self._index.positions[name]
+        if position == len(self._children) - 1:
+            # Only names[:len(children)] of the index are used, so removing
+            # the last child keeps the index valid.
+            self._children.pop()
+        else:
+            names = self._index.names[:len(self._children)]
+            del names[position]
+            del self._children[position]
+            self._index = NameIndex(names)
         item._parent = None
+        self._invalidate_length()
+
+    def _invalidate_length(self):
+        # Calculating the length of an element caches the lengths of all its
+        # children. An element without cached length can therefore not have
+        # ancestors with cached length, and invalidation can stop there.
+        element = self
+        while element is not None and element._cached_length is not None:
+            element._cached_length = None
+            element = element._parent
 
     def __str__(self):
         return self._get_name()
 
     def __repr__(self):
         result = '%s\n' % str(self._get_name())
-        for field in self._fields.values():
+        for field in self._children:
             result += self._format_indented('%s' % repr(field))
         return result
 
     def __contains__(self, key):
-        return unicode(key) in self._fields
+        position = self._index.positions.get(_to_key(key))
+        return position is not None and position < len(self._children)
 
     def _format_indented(self, text):
         return ''.join(['  %s\n' % line for line in text.splitlines()])
 
+    @property
+    def _fields(self):
+        return OrderedDict(zip(self._index.names, self._children))
+
     @property
     def _raw(self):
         return self._get_raw_bytes()
@@ -66,10 +175,24 @@ class _StructuredElement(object):
         return '%s %s' % (self._type, self._name)
 
     def _get_raw_bytes(self):
-        return ''.join((field._raw for field in self._fields.values()))
+        # The buffer is allocated once with the final size and zero filled,
+        # so alignment and padding need not be written separately.
+        buffer = bytearray(len(self))
+        self._write(buffer, 0)
+        return str(buffer)
+
+    def _write(self, buffer, offset):
+        for field in self._children:
+            field._write(buffer, offset)
+            offset += len(field)
 
     def __len__(self):
-        return sum(len(field) for field in self._fields.values())
+        if self._cached_length is None:
+            self._cached_length = self._calculate_length()
+        return self._cached_length
+
+    def _calculate_length(self):
+        return sum(len(field) for field in self._children)
 
     def __nonzero__(self):
         return True
@@ -83,19 +206,25 @@ class _StructuredElement(object):
 
 class List(_StructuredElement):
 
-    _type = 'List'
+    __slots__ = ('_type',)
 
     def __init__(self, name, type_name):
-        self._name, self._type = name, type_name
-        self._fields = OrderedDict()
-        self._parent = None
+        _StructuredElement.__init__(self, name, LIST_INDEX)
+        self._type = type_name
+
+    def _add_name(self, name):
+        position = len(self._children)
+        if self._index is LIST_INDEX and name == str(position):
+            LIST_INDEX.extend_to(position + 1)
+            return position
+        return _StructuredElement._add_name(self, name)
 
     def _get_name(self):
         return '%s %s[]' % (self._type, self._name)
 
     @property
     def len(self):
-        return len(self._fields)
+        return len(self._children)
 
     def add(self, value):
         self[self.len] = value
@@ -103,137 +232,263 @@ class List(_StructuredElement):
 
 class Bag(_StructuredElement):
 
+    __slots__ = ()
     _type = 'Bag'
 
-    def __init__(self, name):
-        self._name = name
-        self._fields = OrderedDict()
-        self._parent = None
-
     @property
     def len(self):
-        return sum(field.len for field in self._fields.values())
+        return sum(field.len for field in self._children)
 
 
 class Struct(_StructuredElement):
 
-    _type = 'Struct'
+    __slots__ = ('_type', '_align')
 
-    def __init__(self, name, type_name, align=1):
-        self._name = name
+    def __init__(self, name, type_name, align=1, index=None):
+        _StructuredElement.__init__(self, name, index)
         self._type = type_name
-        self._fields = OrderedDict()
-        self._parent = None
         self._align = align
 
-    def __len__(self):
-        result = sum(len(field) for field in self._fields.values())
+    def _calculate_length(self):
+        result = sum(len(field) for field in self._children)
         return self._get_aligned(result)
 
     def _get_aligned(self, length):
         return length + (self._align - length % self._align) % self._align
 
-    def _get_raw_bytes(self):
-        result = ''.join((field._raw for field in self._fields.values()))
-        return result.ljust(self._get_aligned(len(result)), '\x00')
-
 
 class Union(_StructuredElement):
 
+    __slots__ = ('_length',)
     _type = 'Union'
 
-    def __init__(self, name, length):
+    def __init__(self, name, length, index=None):
         self._length = length
-        _StructuredElement.__init__(self, name)
+        _StructuredElement.__init__(self, name, index)
 
-    def _get_raw_bytes(self):
-        max_raw = ''
-        for field in self._fields.values():
-            if len(field._raw) > len(max_raw):
-                max_raw = field._raw
-        return max_raw.ljust(self._length, '\x00')
+    def _calculate_length(self):
+        return max([self._length] + [len(field) for field in self._children])
 
-    def __len__(self):
-        return self._length
+    def _write(self, buffer, offset):
+        longest = None
+        for field in self._children:
+            if longest is None or len(field) > len(longest):
+                longest = field
+        if longest is not None:
+            longest._write(buffer, offset)
 
 
 class BinaryContainer(_StructuredElement):
 
+    __slots__ = ('_little_endian',)
     _type = 'BinaryContainer'
 
-    def __init__(self, name, little_endian=False):
+    def __init__(self, name, little_endian=False, index=None):
         self._little_endian = little_endian
-        _StructuredElement.__init__(self, name)
+        _StructuredElement.__init__(self, name, index)
 
     def _binlength(self):
-        return sum(field.binlength for field in self._fields.values())
+        return sum(field.binlength for field in self._children)
 
-    def __len__(self):
+    def _calculate_length(self):
         return self._binlength() / 8
 
-    def _get_raw_bytes(self):
-        # TODO: faster implementation...
-        result = to_bin_of_length(len(self), ' '.join((field.bin for field in self._fields.values())))
-        if self._little_endian:
-            return result[::-1]
-        return result
+    def _write(self, buffer, offset):
+        buffer[offset:offset + len(self)] = self._pack()
+
+    def _pack(self):
+        value = 0
+        for field in self._children:
+            field_value = int(field)
+            if field_value >> field.binlength:
+                raise AssertionError('Too long binary value %s for %s (max length %d bits)'
+                                     % (field_value, field._get_recursive_name(), field.binlength))
+            value = (value << field.binlength) | field_value
+        return int_to_bin_of_length(len(self), value, self._little_endian)
 
 
 class TBCDContainer(BinaryContainer):
 
+    __slots__ = ()
     _type = 'TBCDContainer'
 
-    def _get_raw_bytes(self):
-        return to_tbcd_binary("".join(field.tbcd for field in self._fields.values()))
+    def _pack(self):
+        fields = self._children
+        # Fields with even number of digits fill whole bytes and can be
+        # concatenated as such.
+        if all(tbcd_length(field._value) % 2 == 0 for field in fields[:-1]):
+            return ''.join(field._value for field in fields)
+        return to_tbcd_binary("".join(field.tbcd for field in fields))
+
+    def _calculate_length(self):
+        return int(ceil(sum(tbcd_length(field._value) for field in self._children) / 2.0))
+
+
+class TLV(_StructuredElement):
+    """Type-length-value elements with their tags and lengths.
+
+    Values are children of the container. The tag and length header of each
+    element and the padding after it are written when the container is
+    serialized. Integer keys look up the first element with that tag.
+    """
+
+    __slots__ = ('_header', '_tag_width', '_length_width', '_inclusive',
+                 '_align', '_little_endian', '_tags', '_by_tag')
+    _type = 'TLV'
+
+    def __init__(self, name, tag_width=1, length_width=1, inclusive=True,
+                 align=1, little_endian=False):
+        _StructuredElement.__init__(self, name, NameIndex())
+        self._tag_width = tag_width
+        self._length_width = length_width
+        self._header = tag_width + length_width
+        self._inclusive = inclusive
+        self._align = align
+        self._little_endian = little_endian
+        self._tags = []
+        self._by_tag = {}
+
+    def add(self, tag, name, value):
+        _StructuredElement.__setitem__(self, name, value)
+        self._tags.append(tag)
+        self._by_tag.setdefault(tag, []).append(value)
+
+    def __setitem__(self, name, value):
+        """Replaces the element `name`, or the first element with tag `name`
+        if it is an integer. The element keeps its tag. New elements are
+        added with `add`."""
+        old = self[name]
+        position = _index_of(self._children, old)
+        values = self._by_tag[self._tags[position]]
+        values[_index_of(values, old)] = value
+        _StructuredElement.__setitem__(self, self._index.names[position], value)
+
+    def _add_name(self, name):
+        # Elements of a TLV have no template, so its index is never shared
+        # and names are added in place.
+        position = len(self._children)
+        self._index.put(position, name)
+        return position
 
-    def __len__(self):
-        return int(ceil(sum(len(field.tbcd) for field in self._fields.values()) / 2.0))
+    def __getitem__(self, name):
+        if isinstance(name, (int, long)):
+            return self.all(name)[0]
+        return _StructuredElement.__getitem__(self, name)
+
+    def __contains__(self, key):
+        if isinstance(key, (int, long)):
+            return key in self._by_tag
+        return _StructuredElement.__contains__(self, key)
+
+    def __delitem__(self, name):
+        position = self._index.names.index(_to_key(name))
+        tag = self._tags.pop(position)
+        self._by_tag[tag].remove(self[name])
+        if not self._by_tag[tag]:
+            del self._by_tag[tag]
+        _StructuredElement.__delitem__(self, name)
+
+    def all(self, tag):
+        """Returns all the elements with `tag` in the order they appear."""
+        try:
+            return self._by_tag[tag]
+        except KeyError:
+            raise KeyError(tag)
+
+    @property
+    def tags(self):
+        return list(self._tags)
+
+    @property
+    def len(self):
+        return len(self._children)
+
+    def _element_length(self, value):
+        length = self._header + len(value)
+        return length + (self._align - length % self._align) % self._align
+
+    def _calculate_length(self):
+        return sum(self._element_length(value) for value in self._children)
+
+    def _write(self, buffer, offset):
+        for tag, value in zip(self._tags, self._children):
+            length = len(value) + (self._header if self._inclusive else 0)
+            header = int_to_bin_of_length(self._tag_width, tag, self._little_endian) + \
+                int_to_bin_of_length(self._length_width, length, self._little_endian)
+            buffer[offset:offset + self._header] = header
+            value._write(buffer, offset + self._header)
+            offset += self._element_length(value)
 
 
 class Conditional(_StructuredElement):
 
+    __slots__ = ('exists',)
     _type = 'Conditional'
 
-    def __init__(self, name, exists=False):
-        self._name = name
+    def __init__(self, name, exists=False, index=None):
+        _StructuredElement.__init__(self, name, index)
         self.exists = exists
-        self._fields = OrderedDict()
-        self._parent = None
 
 
-class Message(_StructuredElement):
+class _Framed(_StructuredElement):
+    """Element sent as a whole message, possibly followed by the terminator
+    of its protocol. The terminator is not one of the fields."""
 
+    __slots__ = ('_trailer',)
+
+    def __init__(self, name, index=None):
+        _StructuredElement.__init__(self, name, index)
+        self._trailer = None
+
+    def _add_trailer(self, trailer):
+        self._trailer = trailer
+        trailer._parent = self
+        self._invalidate_length()
+
+    def _calculate_length(self):
+        length = _StructuredElement._calculate_length(self)
+        return length + len(self._trailer) if self._trailer else length
+
+    def _write(self, buffer, offset):
+        _StructuredElement._write(self, buffer, offset)
+        if self._trailer:
+            self._trailer._write(buffer, offset + len(self) - len(self._trailer))
+
+
+class Message(_Framed):
+
+    __slots__ = ()
     _type = 'Message'
 
     def _add_header(self, header):
-        new = OrderedDict({'_header': header})
-        new.update(self._fields)
-        self._fields = new
+        self._index = self._index.with_prefix('_header')
+        self._children.insert(0, header)
+        self._invalidate_length()
 
     def _get_recursive_name(self):
         return ''
 
 
-class Header(_StructuredElement):
+class Header(_Framed):
 
+    __slots__ = ()
     _type = 'Header'
 
 
 class Field(object):
 
+    __slots__ = ('_type', '_name', '_original_value', '_value', '_length',
+                 '_little_endian', '_parent', '_int_value')
+
     def __init__(self, type, name, value, aligned_len=None, little_endian=False):
         self._type = type
         self._name = name
         self._original_value = value
-        self._length = aligned_len or len(value)
+        self._value = value[::-1] if little_endian else value
+        self._length = max(aligned_len or 0, len(value))
         self._little_endian = little_endian
         self._parent = None
-
-    @property
-    def _value(self):
-        return self._original_value[::-1] if self._little_endian else self._original_value
-    # TODO: If needed, original value and raw value can be precalculated
-    # in __init__
+        self._int_value = None
 
     @property
     def name(self):
@@ -246,7 +501,9 @@ class Field(object):
         return int(self)
 
     def __int__(self):
-        return int(to_0xhex(self._value), 16)
+        if self._int_value is None:
+            self._int_value = bin_to_int(self._original_value, self._little_endian)
+        return self._int_value
 
     @property
     def uint(self):
@@ -293,6 +550,10 @@ class Field(object):
     def _raw(self):
         return self._original_value.ljust(self._length, '\x00')
 
+    def _write(self, buffer, offset):
+        value = self._original_value
+        buffer[offset:offset + len(value)] = value
+
     def __str__(self):
         return str(self.__getattribute__(self._type))
 
@@ -312,20 +573,42 @@ class Field(object):
 
 class BinaryField(Field):
 
+    __slots__ = ('_binlength', '_bytes')
     _type = 'bin'
 
     def __init__(self, length, name, value, aligned_len=None, little_endian=False):
         self._name = name
-        self._original_value = value
         self._binlength = int(length)
         self._length = int(ceil(self._binlength / 8.0))
         self._parent = None
         self._little_endian = False
         if little_endian:
             raise AssertionError('Internal error. Binary fields should always be big endian, the containers only are little endian')
+        # Decoded binary fields are created from the integer value sliced
+        # from their container, encoded ones from bytes. The other
+        # representation is calculated only when needed.
+        if isinstance(value, (int, long)):
+            self._int_value, self._bytes = value, None
+        else:
+            self._int_value, self._bytes = None, value
+
+    @property
+    def _original_value(self):
+        if self._bytes is None:
+            self._bytes = to_bin(self._int_value)
+        return self._bytes
+
+    @property
+    def _value(self):
+        return self._original_value
+
+    def __int__(self):
+        if self._int_value is None:
+            self._int_value = bin_to_int(self._bytes)
+        return self._int_value
 
     def _bin(self):
-        return to_binary_string_of_length(self._binlength, self._value)
+        return '0b' + bin(int(self))[2:].zfill(self._binlength)
 
     @property
     def binlength(self):
@@ -13,7 +13,7 @@
 #  limitations under the License.
 from __future__ import with_statement
 import subprocess
-from .ordered_dict import OrderedDict
+from collections import OrderedDict
 from .logger import logger
 
 
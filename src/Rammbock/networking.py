@@ -86,15 +86,32 @@ class _NetworkNode(_WithTimeouts):
             return None
         return self._protocol.get_message_stream(BufferedStream(self, self._default_timeout))
 
-    def get_message(self, message_template, timeout=None, header_filter=None, latest=None):
+    def get_message(self, message_template, timeout=None, header_filter=None, latest=None, expectations=None):
         if not self._protocol:
             raise AssertionError('Can not receive messages without protocol. Initialize network node with "protocol=<protocl name>"')
         if self._protocol != message_template._protocol:
             raise AssertionError('Template protocol does not match network node protocol %s!=%s' % (self.protocol_name, message_template._protocol.name))
-        return self._get_from_stream(message_template, self._message_stream, timeout=timeout, header_filter=header_filter, latest=latest)
-
-    def _get_from_stream(self, message_template, stream, timeout, header_filter, latest):
-        return stream.get(message_template, timeout=timeout, header_filter=header_filter, latest=latest)
+        return self._get_from_stream(message_template, self._message_stream, timeout=timeout, header_filter=header_filter,
+                                     latest=latest, expectations=expectations)
+
+    def send_message(self, message_template, fields=None, header=None, alias=None):
+        """Encodes `message_template` with the field values in dict `fields`
+        and header field values in dict `header` and sends it."""
+        self.send(message_template.encode(fields, header)._raw, alias=alias)
+
+    def receive_message(self, message_template, expect=None, expect_header=None, **options):
+        """Receives a message with `message_template` and validates it against
+        the field values in dicts `expect` and `expect_header`. Other options
+        like `timeout` and `header_filter` are passed to `get_message`."""
+        msg = self.get_message(message_template, **options)
+        errors = message_template.validate(msg, expect, expect_header)
+        if errors:
+            raise AssertionError(errors[0])
+        return msg
+
+    def _get_from_stream(self, message_template, stream, timeout, header_filter, latest, expectations=None):
+        return stream.get(message_template, timeout=timeout, header_filter=header_filter, latest=latest,
+                          expectations=expectations)
 
     def log_send(self, binary, ip, port):
         logger.debug("Send %d bytes: %s to %s:%s over %s" % (len(binary), to_hex(binary), ip, port, self._transport_layer_name))
@@ -277,9 +294,10 @@ class StreamServer(_Server):
     def close_connection(self, alias=None):
         raise Exception("Not yet implemented")
 
-    def get_message(self, message_template, timeout=None, alias=None, header_filter=None):
+    def get_message(self, message_template, timeout=None, alias=None, header_filter=None, expectations=None):
         connection = self._connections.get(alias)
-        return connection.get_message(message_template, timeout=timeout, header_filter=header_filter)
+        return connection.get_message(message_template, timeout=timeout, header_filter=header_filter,
+                                      expectations=expectations)
 
     def empty(self):
         for connection in self._connections:
@@ -398,32 +416,30 @@ class BufferedStream(_WithTimeouts):
         self._buffer = ''
         self._default_timeout = default_timeout
 
-    def read(self, size, timeout=None):
-        result = ''
-        timeout = float(timeout if timeout else self._default_timeout)
-        cutoff = time.time() + timeout
-        while time.time() < cutoff:
-            result += self._get(size - len(result))
-            if self._size_full(result, size):
-                return result
-            self._fill_buffer(timeout)
-        raise AssertionError('Timeout %fs exceeded.' % timeout)
+    @property
+    def buffered(self):
+        return self._buffer
 
-    def _size_full(self, result, size):
-        return len(result) == size or (size == -1 and len(result))
+    def consume(self, size):
+        self._buffer = self._buffer[size:]
 
-    def return_data(self, data):
-        if data:
-            self._buffer = data + self._buffer
+    def read_frame(self, framer, timeout=None):
+        """Returns the next message completed by `framer`, or None if no
+        message is completed within `timeout`."""
+        message = framer.next(self)
+        timeout = float(timeout if timeout else self._default_timeout)
+        cutoff = time.time() + timeout
+        while message is None and time.time() < cutoff:
+            if self._receive(max(cutoff - time.time(), 0)):
+                message = framer.next(self)
+        return message
 
-    def _get(self, size):
-        if size == -1:
-            size = len(self._buffer)
-        if not self._buffer:
-            return ''
-        result = self._buffer[:size]
-        self._buffer = self._buffer[size:]
-        return result
+    def _receive(self, timeout):
+        try:
+            self._fill_buffer(timeout)
+        except socket.timeout:
+            return False
+        return True
 
     def _fill_buffer(self, timeout):
         self._buffer += self._connection.receive(timeout=timeout)
@@ -0,0 +1,174 @@
+#  Copyright 2014 Nokia Siemens Networks Oyj
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from .binary_tools import bin_to_int
+from .message import Union, BinaryContainer, TLV
+from .templates.parameters import split_name
+from .templates.primitives import _TemplateField
+
+
+class PreparedMessage(object):
+    """Message encoded once and sent repeatedly with only its variable
+    fields changed.
+
+    The byte offset and width of each variable field are recorded from the
+    encoded message, and each send patches just those slots in a reused
+    buffer. Variable fields must have a static length, and neither other
+    fields nor conditions may depend on their value. A variable field keeps
+    its latest value until it is given again.
+
+    Sending with values for other fields encodes the whole message again
+    with the prepared values.
+    """
+
+    def __init__(self, template, message_fields, header_fields, label=None, configs=None):
+        self._template = template
+        self._message_fields = message_fields
+        self._header_fields = header_fields
+        self._message = template.encode(message_fields, header_fields)
+        self._buffer = bytearray(self._message._raw)
+        self._slots = {}
+        self.label = label
+        self.configs = configs or {}
+
+    def variable(self, name, generator=None):
+        """Makes field `name` variable. Header fields are named with
+        `header:name`. The optional `generator` is called without arguments
+        before each send to get the value of the field."""
+        if name not in self._slots:
+            self._slots[name] = _Slot(name, *self._find(name))
+        self._slots[name].generator = generator
+
+    def increment(self, name, step=1):
+        """Makes field `name` variable and increments its value by `step`
+        after each send, starting from the prepared value."""
+        self.variable(name)
+        slot = self._slots[name]
+        slot.generator = _Increment(slot.current, step, slot.width)
+
+    def _find(self, name):
+        template, element = self._template, self._message
+        if name.startswith('header:'):
+            name = name.partition(':')[-1]
+            template, element = template._protocol, element._header
+        field = template._get_template_field(name)
+        if not isinstance(field, _TemplateField):
+            raise AssertionError("Variable field '%s' is not a primitive field" % name)
+        if not field.length.static or field.referenced_later or field.referenced_by_condition:
+            raise AssertionError("Variable field '%s' must have a static length "
+                                 "and must not be referenced by other fields "
+                                 "or conditions" % name)
+        for part in split_name(name):
+            element = element[part]
+        return field, element, self._offset(element, name)
+
+    def _offset(self, element, name):
+        offset = 0
+        while element._parent is not None:
+            parent = element._parent
+            if isinstance(parent, (Union, BinaryContainer, TLV)):
+                raise AssertionError("Variable field '%s' can not be inside %s" % (name, parent._type))
+            for child in parent._children:
+                if child is element:
+                    break
+                offset += len(child)
+            element = parent
+        return offset
+
+    def encode(self, values=None):
+        """Patches the variable fields with the given `values` or the values
+        of their generators and returns the message bytes."""
+        values = values or {}
+        if any(name not in self._slots for name in values):
+            return self._encode_again(values)
+        for name, slot in self._slots.items():
+            if name in values:
+                slot.patch(self._buffer, values[name])
+            elif slot.generator:
+                slot.patch(self._buffer, slot.generator())
+        return str(self._buffer)
+
+    def _encode_again(self, values):
+        message_fields = dict(self._message_fields)
+        header_fields = dict(self._header_fields)
+        values = dict(values)
+        for name, slot in self._slots.items():
+            if name in values:
+                continue
+            if slot.generator:
+                values[name] = slot.generator()
+            elif slot.value is not None:
+                values[name] = slot.value
+        for name, value in values.items():
+            if name.startswith('header:'):
+                header_fields[name.partition(':')[-1]] = value
+            else:
+                message_fields[name] = value
+        return self._template.encode(message_fields, header_fields)._raw
+
+
+class PreparedExpectation(object):
+    """Template, expected field values and receive parameters of a message
+    to receive repeatedly."""
+
+    def __init__(self, template, message_fields, header_fields, label=None, configs=None):
+        self.template = template
+        self.message_fields = message_fields
+        self.header_fields = header_fields
+        self.label = label
+        self.configs = configs or {}
+
+
+class _Slot(object):
+
+    def __init__(self, name, field, element, offset):
+        self.name = name
+        self.generator = None
+        self.value = None
+        self._field = field
+        self._parent = element._parent
+        self._little_endian = element._little_endian
+        self._offset = offset
+        self.width = len(element._original_value)
+        self.current = bin_to_int(element._original_value, element._little_endian) \
+            if field.type == 'uint' else None
+
+    def patch(self, buffer, value):
+        binary = self._field._encode_precomputed(value, self._parent, little_endian=self._little_endian)[0]
+        if len(binary) != self.width:
+            raise AssertionError("Value '%s' of variable field '%s' does not fit in %d bytes" %
+                                 (value, self.name, self.width))
+        buffer[self._offset:self._offset + self.width] = binary
+        self.value = value
+
+
+class _Increment(object):
+
+    def __init__(self, start, step, width):
+        if start is None:
+            raise AssertionError('Only uint fields can be incremented')
+        self._value = start
+        self._step = int(step)
+        self._modulo = 2 ** (8 * width)
+
+    def __call__(self):
+        value = self._value
+        self._value = (value + self._step) % self._modulo
+        return value
+
+
+def import_function(name):
+    """Imports function `name` given as `module.function`."""
+    module, _, function = name.rpartition('.')
+    return getattr(__import__(module, fromlist=[function]), function)
@@ -161,6 +161,22 @@ class Rammbock(RammbockCore):
         BuiltIn().run_keyword(kw, *parameters)
         self._end_bag_case()
 
+    def tlv_element(self, tag, kw, *parameters):
+        """An element with `tag` inside a TLV container started with `Start TLV`.
+
+        The value of the element is defined by the keyword `kw` executed with
+        the optional extra parameters.
+
+        Examples:
+        | Start TLV | attributes | tag=1 | length=1 |
+        | TLV Element | 1 | Chars | * | userName |
+        | TLV Element | 4 | u32 | nasAddress |
+        | End TLV |
+        """
+        self._start_tlv_element(tag)
+        BuiltIn().run_keyword(kw, *parameters)
+        self._end_tlv_element()
+
     def embed_seqdiag_sequence(self):
         """Create a message sequence diagram png file to output folder and embed the image to log file.
 
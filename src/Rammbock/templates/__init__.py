@@ -13,5 +13,6 @@
 #  limitations under the License.
 
 from containers import Protocol, MessageTemplate, StructTemplate, ListTemplate, \
-    UnionTemplate, BinaryContainerTemplate, ConditionalTemplate, TBCDContainerTemplate
+    UnionTemplate, BinaryContainerTemplate, ConditionalTemplate, TBCDContainerTemplate, \
+    TLVTemplate, TLVElementTemplate
 from primitives import UInt, Int, Char, PDU, Binary, Length, TBCD
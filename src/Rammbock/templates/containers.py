@@ -13,16 +13,18 @@
 #  limitations under the License.
 
 from math import ceil
-import re
+import copy
 
 from Rammbock.message import (Field, Union, Message, Header, List, Struct,
                               BinaryContainer, BinaryField, TBCDContainer,
-                              Conditional, Bag)
+                              Conditional, Bag, TLV, NameIndex)
 from message_stream import MessageStream
-from primitives import Length, Binary, TBCD, BagSize
-from Rammbock.ordered_dict import OrderedDict
-from Rammbock.binary_tools import (to_binary_string_of_length, to_bin,
-                                   to_tbcd_value, to_tbcd_binary)
+from primitives import Length, Binary, TBCD, BagSize, _TemplateField
+from validators import ValidationFailed, raise_if_failed
+from parameters import Parameters, as_parameters
+from collections import OrderedDict
+from Rammbock.binary_tools import (bin_to_int, to_bin, to_int, to_0xhex, to_tbcd_value,
+                                   to_tbcd_binary, with_tbcd_filler)
 from Rammbock.condition_parser import ConditionParser
 from Rammbock.logger import logger
 
@@ -34,15 +36,48 @@ class _Template(object):
         self._fields = OrderedDict()
         self.name = name
         self._saved = False
+        self._name_index = NameIndex()
+
+    @property
+    def name_index(self):
+        """Index of field names shared by all the messages created from this
+        template. Fields are only ever added to templates, so the index is
+        up to date as long as it has the same number of names."""
+        if len(self._name_index.names) != len(self._fields):
+            self._name_index = NameIndex(self._fields.keys())
+        return self._name_index
 
     def _pretty_print_fields(self, fields):
-        return ', '.join('%s:%s' % (key, value) for key, value in fields.items())
+        return ', '.join('%s:%s' % (key, value) for key, value in fields)
 
     def _mark_referenced_field(self, field):
-        ref_field = self._get_field_recursive(field.length.field)
+        ref_field, depth, slots = self._resolve_reference(field.length.field_parts)
         if not ref_field:
             raise AssertionError('Length field %s unknown' % field.length.field)
         ref_field.referenced_later = True
+        field.length.resolve(depth, slots)
+
+    def _resolve_reference(self, parts):
+        """Finds the field referred to with name `parts` from this template
+        or its ancestors. Returns the field, the number of levels up where it
+        was found and its `(name, position)` slots starting from that level."""
+        template, depth = self, 0
+        while template is not None:
+            slots = template._get_slots(parts)
+            if slots:
+                return slots[-1][2], depth, tuple(slot[:2] for slot in slots)
+            template, depth = template.parent, depth + 1
+        return None, None, None
+
+    def _get_slots(self, parts):
+        template, slots = self, []
+        for part in parts:
+            fields = getattr(template, '_fields', None)
+            if fields is None or part not in fields:
+                return None
+            template = fields[part]
+            slots.append((part, fields.keys().index(part), template))
+        return slots
 
     def add(self, field):
         if field.type == 'pdu':
@@ -51,42 +86,48 @@ class _Template(object):
             raise AssertionError("Duplicate field '%s' in '%s'" % (field.name, self._get_recursive_name()))
         if field.has_length and field.length.has_references:
             self._mark_referenced_field(field)
+        self._precompute_default(field)
         self._fields[field.name] = field
 
+    def _precompute_default(self, field):
+        if isinstance(field, _TemplateField):
+            field.precompute_value(field.default_value)
+
+    def precompute_values(self, values):
+        """Precomputes template level `values` given with dotted field names.
+        Names not referring to a primitive field are ignored."""
+        for name, value in values.items():
+            field = self._get_template_field(name)
+            if isinstance(field, _TemplateField):
+                field.precompute_value(value)
+
+    def _get_template_field(self, name):
+        field = self
+        for part in name.split('.'):
+            fields = getattr(field, '_fields', None)
+            if fields is None or part not in fields:
+                return None
+            field = fields[part]
+        return field
+
     def _handle_pdu_field(self, field):
         raise AssertionError('PDU field not allowed')
 
     def _get_field(self, field_name):
         return self._fields.get(field_name)
 
-    def _get_struct_field(self, field_name):
-        name_split = field_name.split('.', 1)
-        struct_field = self._get_field(name_split[0])
-        if len(name_split) == 1:
-            return struct_field
-        else:
-            return struct_field._get_struct_field(name_split[1])
-
-    def _get_field_recursive(self, field_name):
-        field = self._get_struct_field(field_name)
-        if field:
-            return field
-        else:
-            return self.parent._get_field_recursive(field_name) \
-                if self.parent else None
-
     def _check_params_empty(self, message_fields, name):
-        for key in message_fields.keys():
-            if key.startswith('*'):
-                message_fields.pop(key)
-        if message_fields:
+        unknown = [(key, value) for key, value in as_parameters(message_fields).unused()
+                   if not key.startswith('*')]
+        if unknown:
             raise AssertionError("Unknown fields in '%s': %s" %
-                                 (self._get_recursive_name(), self._pretty_print_fields(message_fields)))
+                                 (self._get_recursive_name(), self._pretty_print_fields(unknown)))
 
     def _get_recursive_name(self):
         return (self.parent._get_recursive_name() + "." if self.parent else '') + self.name
 
     def _encode_fields(self, struct, params, little_endian=False):
+        params = as_parameters(params)
         for field in self._fields.values():
             encoded = field.encode(params, struct, little_endian=little_endian)
             # TODO: clean away this ugly hack that makes it possible to skip PDU
@@ -95,31 +136,67 @@ class _Template(object):
                 struct[field.name] = encoded
         self._check_params_empty(params, self.name)
 
-    def decode(self, data, parent=None, name=None, little_endian=False):
+    def decode(self, data, parent=None, name=None, little_endian=False, expected=None):
+        """Decodes `data` to a message element. If `expected` field values
+        are given, fields are validated as soon as they are decoded and
+        `ValidationFailed` is raised on the first mismatch."""
         message = self._get_struct(name, parent)
+        self._decode_fields(message, data, little_endian, expected)
+        return message
+
+    def _decode_fields(self, message, data, little_endian=False, expected=None):
+        if expected is not None:
+            expected = as_parameters(expected)
         data_index = 0
         for field in self._fields.values():
-            message[field.name] = field.decode(data[data_index:], message, little_endian=little_endian)
-            data_index += len(message[field.name])
-        return message
+            decoded = self._decode_field(field, data[data_index:], message, little_endian, expected)
+            data_index += len(decoded)
+        self._check_expected_empty(expected)
+
+    def _decode_field(self, field, data, message, little_endian=False, expected=None, name=None):
+        if expected is None or isinstance(field, _TemplateField):
+            decoded = field.decode(data, message, name=name, little_endian=little_endian)
+        else:
+            decoded = field.decode(data, message, name=name, little_endian=little_endian, expected=expected)
+        message[name or field.name] = decoded
+        if expected is not None and isinstance(field, _TemplateField):
+            raise_if_failed(field.validate(message, expected, name))
+        return decoded
+
+    def _check_expected_empty(self, expected, name=None):
+        if expected is None:
+            return
+        try:
+            self._check_params_empty(expected, name or self.name)
+        except AssertionError as e:
+            raise ValidationFailed([e.args[0]])
 
-    def validate(self, message, message_fields):
+    def validate(self, message, message_fields, fail_fast=False):
+        message_fields = as_parameters(message_fields)
         errors = []
         for field in self._fields.values():
-            errors += field.validate(message, message_fields)
+            errors += field.validate(message, message_fields, fail_fast=fail_fast)
+            if errors and fail_fast:
+                return errors
         self._check_params_empty(message_fields, self.name)
         return errors
 
     def _get_params_sub_tree(self, params, name=None):
-        result = {'*': params['*']} if '*' in params else {}
-        name = name or self.name
-        for key in params.keys():
-            prefix, _, ending = key.partition('.')
-            if prefix == name:
-                result[ending] = params.pop(key)
-            elif prefix == '*' and ending:
-                result[ending] = params[key]
-        return result
+        return as_parameters(params).subtree(name or self.name)
+
+    def use_as(self, name, parent, parameters=None, length=None, align=None):
+        """Returns a template of this named type used as field `name` of
+        `parent`. The fields and their precomputed values are shared with
+        this template and all the other uses of the type."""
+        if parameters or length or align:
+            raise AssertionError("Parameters are not supported for type '%s'" % self.name)
+        return self._use_as(name, parent)
+
+    def _use_as(self, name, parent):
+        template = copy.copy(self)
+        template.name = name
+        template.parent = parent
+        return template
 
     def _get_struct(self, name, parent):
         return None
@@ -132,24 +209,36 @@ class _Template(object):
 # TODO: Refactor the pdu to use the same dynamic length strategy as structs in encoding
 class Protocol(_Template):
 
-    def __init__(self, name, little_endian=False, library=None):
+    def __init__(self, name, little_endian=False, library=None, terminator=None):
         _Template.__init__(self, name, None)
         self.pdu = None
         self.little_endian = little_endian
         self.library = library
+        self.terminator = to_bin(terminator)
+        self._header_length = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['library'] = None
+        return state
 
     def header_length(self):
+        if self._header_length is None:
+            self._header_length = self._get_header_length()
+        return self._header_length
+
+    def _get_header_length(self):
         try:
             return sum(field.get_static_length() for field in self._fields.values() if field.type != 'pdu')
         except IndexError:
             return -1
 
     def encode(self, message, header_params):
-        header_params = header_params.copy()
-        header = Header(self.name)
+        header_params = Parameters(header_params)
+        header = Header(self.name, self.name_index)
         self._encode_fields(header, header_params, little_endian=self.little_endian)
         if self.pdu_length:
-            self.pdu_length.find_length_and_set_if_necessary(header, len(message._get_raw_bytes()), little_endian=self.little_endian)
+            self.pdu_length.find_length_and_set_if_necessary(header, len(message))
         return header
 
     def _handle_pdu_field(self, field):
@@ -165,93 +254,197 @@ class Protocol(_Template):
         if self.pdu:
             raise AssertionError('Fields after PDU not supported.')
         _Template.add(self, field)
+        self._header_length = None
 
     # TODO: fields after the pdu
-    def _extract_values_from_data(self, data, header, values):
+    def decode_header(self, data):
+        """Decodes the header from the beginning of `data`. Returns the
+        header and its length in bytes, or None and 0 if `data` does not yet
+        contain the whole header."""
+        static_length = self.header_length()
+        if len(data) < static_length:
+            return None, 0
+        header = Header(self.name, self.name_index)
         data_index = 0
-        for field in values:
-            if field is not self.pdu:
-                header[field.name] = field.decode(data[data_index:], header, little_endian=self.little_endian)
-                data_index += len(header[field.name])
-        return data[data_index:]
-
-    def read(self, stream, timeout=None):
-        # TODO: use all data if length cannot be obtained. Return amount of data
-        # used to stream
-        data = stream.read(self.header_length(), timeout=timeout)
-        header = Header(self.name)
-        unused_data = self._extract_values_from_data(data, header, self._fields.values())
-        stream.return_data(unused_data)
-        pdu_bytes = None
-        if self.pdu:
-            if self.pdu_length.static:
-                length = self.pdu_length.value
-            else:
-                length = self.pdu_length.calc_value(header[self.pdu_length.field].int)
-            # TODO: we need a timeout?
-            pdu_bytes = stream.read(length)
-        return header, pdu_bytes
+        for field in self._fields.values():
+            if field is self.pdu:
+                continue
+            if static_length == -1 and isinstance(field, _TemplateField):
+                if not field.is_complete(data[data_index:]):
+                    return None, 0
+                _, length = field.length.decode_lengths(header, len(data) - data_index)
+                if data_index + length > len(data):
+                    return None, 0
+            decoded = field.decode(data[data_index:], header, little_endian=self.little_endian)
+            header[field.name] = decoded
+            data_index += len(decoded)
+        return header, data_index
+
+    def decode_frame(self, frame):
+        """Decodes the header of a message framed by the terminator. The rest
+        of the frame is the PDU."""
+        header, length = self.decode_header(frame)
+        if header is None:
+            raise AssertionError("Frame %s is too short for the header of protocol '%s'"
+                                 % (to_0xhex(frame), self.name))
+        return header, frame[length:] if self.pdu else None
+
+    def terminate(self, message):
+        """Adds the terminator of this protocol after the encoded `message`."""
+        if self.terminator:
+            message._add_trailer(Field('bytes', 'terminator', self.terminator))
+        return message
+
+    def pdu_bytes_length(self, header):
+        """Returns the length of the PDU following `header` or None if the
+        protocol has no PDU."""
+        if not self.pdu:
+            return None
+        if self.pdu_length.static:
+            return self.pdu_length.value
+        return self.pdu_length.calc_value(header[self.pdu_length.field].int)
 
     def get_message_stream(self, buffered_stream):
         return MessageStream(buffered_stream, self)
 
 
 class MessageTemplate(_Template):
+    """Template of a message.
+
+    Messages can be encoded and validated directly with field values given
+    as dicts, for example `template.encode({'foo': 1, 'pair': {'first': 2}})`.
+    Values can be strings like in keyword arguments, integers or byte arrays.
+    """
 
     type = 'Message'
+    default_values = {}
 
     def __init__(self, message_name, protocol, header_params):
         _Template.__init__(self, message_name, None)
         self._protocol = protocol
         self.header_parameters = header_params
+        self._fields_owner = self
+        self._fields_shared = False
+
+    def copy(self):
+        """Returns a copy of this template sharing the fields with it. The
+        fields are copied only when fields are added to either template."""
+        template = copy.copy(self)
+        self._fields_shared = template._fields_shared = True
+        return template
+
+    def with_defaults(self, values):
+        """Returns a copy of this template encoding and validating messages
+        with default field `values`."""
+        template = self.copy()
+        template.default_values = dict(values)
+        return template
+
+    def _parameters(self, values):
+        parameters = Parameters(self.default_values)
+        for name, value in (values or {}).items():
+            parameters.set(name, value)
+        return parameters
+
+    def add(self, field):
+        if self._fields_shared:
+            self._copy_fields()
+        _Template.add(self, field)
+
+    def _copy_fields(self):
+        # Shared templates refer to the message template they were
+        # originally added to as their parent.
+        memo = {id(self._fields_owner): self, id(self._protocol): self._protocol}
+        self._fields = copy.deepcopy(self._fields, memo)
+        self._fields_owner = self
+        self._fields_shared = False
 
     def decode(self, data, parent=None, name=None, little_endian=False):
         msg = _Template.decode(self, data, parent, name, little_endian)
         self.check_message_lengths(msg, data)
         return msg
 
+    def decode_and_validate(self, data, header, expectations):
+        """Decodes the message following `header` and validates it in the
+        same pass. Decoding stops at the first validation error, which is
+        stored to `expectations.errors`."""
+        validation_params = self.header_parameters.copy()
+        if self.only_header:
+            validation_params.update(self.default_values)
+            validation_params.update(expectations.message_fields)
+            expectations.errors = self._protocol.validate(header, validation_params, fail_fast=True)
+            return header
+        validation_params.update(expectations.header_fields)
+        expectations.errors = self._protocol.validate(header, validation_params, fail_fast=True)
+        if expectations.errors:
+            msg = self._get_struct(self.name, header)
+        else:
+            msg = self._decode_expected(data, header, expectations)
+        msg._add_header(header)
+        return msg
+
+    def _decode_expected(self, data, header, expectations):
+        msg = self._get_struct(self.name, header)
+        try:
+            self._decode_fields(msg, data, expected=self._parameters(expectations.message_fields))
+        except ValidationFailed as e:
+            expectations.errors = e.errors
+            return msg
+        self.check_message_lengths(msg, data)
+        return msg
+
     def check_message_lengths(self, msg, data):
         if len(msg) < len(data):
             raise AssertionError('Received \'%s\', message too long. Expected %s but got %s' % (self.name, len(msg), len(data)))
 
-    def encode(self, message_params, header_params, little_endian=False):
-        message_params = message_params.copy()
+    def encode(self, message_params=None, header_params=None, little_endian=False):
         if self.only_header:
-            parameters = self._headers(message_params)
-            return self._protocol.encode(None, parameters)
-        msg = Message(self.name)
-        self._encode_fields(msg, message_params, little_endian=little_endian)
+            parameters = self._headers(self.default_values)
+            parameters.update(message_params or {})
+            return self._protocol.terminate(self._protocol.encode(None, parameters))
+        msg = Message(self.name, self.name_index)
+        self._encode_fields(msg, self._parameters(message_params), little_endian=little_endian)
         if self._protocol:
             header = self._protocol.encode(msg, self._headers(header_params))
             msg._add_header(header)
+            self._protocol.terminate(msg)
         return msg
 
     def _headers(self, header_params):
         result = {}
         result.update(self.header_parameters)
-        result.update(header_params)
+        result.update(header_params or {})
         return result
 
     def _get_struct(self, name, parent=None):
-        return Message(self.name)
+        return Message(self.name, self.name_index)
 
-    def validate(self, message, message_fields, header_fields):
+    def validate(self, message, message_fields=None, header_fields=None, fail_fast=False):
         validation_params = self.header_parameters.copy()
         if self.only_header:
-            return self._validate_with_header_only(message, message_fields, validation_params)
-        return self._validate_with_header_and_messagebody(message, message_fields, header_fields, validation_params)
+            validation_params.update(self.default_values)
+            return self._validate_with_header_only(message, message_fields or {}, validation_params, fail_fast)
+        return self._validate_with_header_and_messagebody(message, self._parameters(message_fields),
+                                                          header_fields or {}, validation_params, fail_fast)
 
-    def _validate_with_header_only(self, message, message_fields, validation_params):
+    def _validate_with_header_only(self, message, message_fields, validation_params, fail_fast=False):
         validation_params.update(message_fields)
-        return self._protocol.validate(message, validation_params)
+        return self._protocol.validate(message, validation_params, fail_fast=fail_fast)
 
-    def _validate_with_header_and_messagebody(self, message, message_fields, header_fields, validation_params):
+    def _validate_with_header_and_messagebody(self, message, message_fields, header_fields, validation_params, fail_fast=False):
         validation_params.update(header_fields)
-        return self._protocol.validate(message._header, validation_params) + _Template.validate(self, message, message_fields)
+        errors = self._protocol.validate(message._header, validation_params, fail_fast=fail_fast)
+        if errors and fail_fast:
+            return errors
+        return errors + _Template.validate(self, message, message_fields, fail_fast=fail_fast)
 
     def set_as_saved(self):
         self._saved = True
 
+    def precompute_values(self, values):
+        _Template.precompute_values(self, values)
+        self._protocol.precompute_values(self.header_parameters)
+
     @property
     def only_header(self):
         return not bool(self._protocol.pdu)
@@ -264,11 +457,25 @@ class StructTemplate(_Template):
     def __init__(self, type, name, parent, parameters=None, length=None, align=None):
         self._parameters = parameters or {}
         self.type = type
+        self._length_definition = length
         if length:
             self._set_length(length)
         self._align = int(align or 1)
         _Template.__init__(self, name, parent)
 
+    def use_as(self, name, parent, parameters=None, length=None, align=None):
+        template = self._use_as(name, parent)
+        values = dict(self._parameters)
+        values.update(parameters or {})
+        template._parameters = dict(('%s.%s' % (name, key), value)
+                                    for key, value in values.items())
+        length = length or self._length_definition
+        if length:
+            template._set_length(length)
+        if align:
+            template._align = int(align)
+        return template
+
     def _set_length(self, length):
         self.has_length = True
         self.length = Length(length)
@@ -276,15 +483,21 @@ class StructTemplate(_Template):
     def get_static_length(self):
         return sum(field.get_static_length() for field in self._fields.values())
 
-    def decode(self, data, parent=None, name=None, little_endian=False):
+    def decode(self, data, parent=None, name=None, little_endian=False, expected=None):
         if self.has_length:
             length = self.length.decode(parent)
             data = data[:length]
-        return _Template.decode(self, data, parent, name, little_endian)
+        if expected is None:
+            return _Template.decode(self, data, parent, name, little_endian)
+        expected = self._add_struct_params(expected)
+        struct = _Template.decode(self, data, parent, name, little_endian,
+                                  self._get_params_sub_tree(expected, name))
+        raise_if_failed(self._validate_length(struct))
+        return struct
 
     def encode(self, message_params, parent=None, name=None, little_endian=False):
         struct = self._get_struct(name, parent)
-        self._add_struct_params(message_params)
+        message_params = self._add_struct_params(message_params)
         self._encode_fields(struct,
                             self._get_params_sub_tree(message_params, name),
                             little_endian=little_endian)
@@ -296,24 +509,33 @@ class StructTemplate(_Template):
 
     # TODO: Cleanup setting the parent to constructor of message -elements
     def _get_struct(self, name, parent):
-        struct = Struct(name or self.name, self.type, align=self._align)
+        struct = Struct(name or self.name, self.type, align=self._align, index=self.name_index)
         struct._parent = parent
         return struct
 
-    def validate(self, parent, message_fields, name=None):
-        self._add_struct_params(message_fields)
-        errors = []
+    def validate(self, parent, message_fields, name=None, fail_fast=False):
+        message_fields = self._add_struct_params(message_fields)
         name = name or self.name
         message = parent[name]
+        params = self._get_params_sub_tree(message_fields, name)
+        errors = self._validate_length(message)
+        if errors and fail_fast:
+            return errors
+        return errors + _Template.validate(self, message, params, fail_fast=fail_fast)
+
+    def _validate_length(self, message):
         if self.has_length:
-            length = self.length.decode(message)
+            length = self.length.decode(message._parent)
             if len(message) != length:
-                errors.append('Length of struct %s does not match defined length. defined length:%s struct length:%s' % (message._name, length, len(message)))
-        return errors + _Template.validate(self, message, self._get_params_sub_tree(message_fields, name))
+                return ['Length of struct %s does not match defined length. defined length:%s struct length:%s' % (message._name, length, len(message))]
+        return []
 
     def _add_struct_params(self, params):
+        params = as_parameters(params)
         for key in self._parameters.keys():
-            params[key] = self._parameters.pop(key) if key not in params else params[key]
+            if not params.has(key):
+                params.set(key, self._parameters[key])
+        return params
 
 
 class UnionTemplate(_Template):
@@ -326,15 +548,19 @@ class UnionTemplate(_Template):
 
     def add(self, field):
         field.get_static_length()
+        self._precompute_default(field)
         self._fields[field.name] = field
 
     def get_static_length(self):
         return max(field.get_static_length() for field in self._fields.values())
 
-    def decode(self, data, parent=None, name=None, little_endian=False):
+    def decode(self, data, parent=None, name=None, little_endian=False, expected=None):
         union = self._get_struct(name, parent)
+        if expected is not None:
+            expected = self._get_params_sub_tree(expected, name)
         for field in self._fields.values():
-            union[field.name] = field.decode(data, union, little_endian=little_endian)
+            self._decode_field(field, data, union, little_endian, expected)
+        self._check_expected_empty(expected)
         return union
 
     def encode(self, union_params, parent=None, name=None, little_endian=False):
@@ -352,14 +578,14 @@ class UnionTemplate(_Template):
         return union
 
     def _get_struct(self, name, parent):
-        union = Union(name or self.name, self.get_static_length())
+        union = Union(name or self.name, self.get_static_length(), self.name_index)
         union._parent = parent
         return union
 
-    def validate(self, parent, message_fields, name=None):
+    def validate(self, parent, message_fields, name=None, fail_fast=False):
         name = name or self.name
         message = parent[name]
-        return _Template.validate(self, message, self._get_params_sub_tree(message_fields, name))
+        return _Template.validate(self, message, self._get_params_sub_tree(message_fields, name), fail_fast=fail_fast)
 
 
 class BagTemplate(_Template):
@@ -369,24 +595,35 @@ class BagTemplate(_Template):
 
     def __init__(self, name, parent):
         _Template.__init__(self, name, parent)
+        self._case_index = None
 
     def add(self, field):
         if field.type != 'Case':
             raise AssertionError('Field of type %s added to bag. Has to be of type Case.' % field.type)
         self._fields[field.name] = field
+        self._case_index = None
+
+    def build_index(self):
+        """Indexes the cases by the fixed value of their leading field so that
+        decoding tries only the cases that can match."""
+        self._case_index = _CaseIndex(self._fields.values())
 
     def encode(self, set_params, parent=None, name=None, little_endian=False):
         raise AssertionError("Set can not be encoded.")
 
-    def decode(self, data, parent=None, name=None, little_endian=False):
+    def decode(self, data, parent=None, name=None, little_endian=False, expected=None):
         bag = self._get_struct(name, parent)
         while data:
             match = self._decode_one(data, bag, little_endian=little_endian)
             data = data[len(match['0']):]
+        if expected is not None:
+            raise_if_failed(self._validate_bag(bag, self._get_params_sub_tree(expected, name)))
         return bag
 
     def _decode_one(self, data, bag, little_endian=False):
-        for case in self._fields.values():
+        if self._case_index is None:
+            self.build_index()
+        for case in self._case_index.candidates(data, little_endian):
             try:
                 match = case.decode(data, bag, little_endian=little_endian)
                 logger.trace("'%s' matches in bag '%s'. value: %r" % (case.name, self.name, match[match.len - 1]))
@@ -396,21 +633,243 @@ class BagTemplate(_Template):
         raise AssertionError("Unable to decode bag value.")
 
     def _get_struct(self, name, parent):
-        bag = Bag(name or self.name)
+        bag = Bag(name or self.name, self.name_index)
         bag._parent = parent
         for case in self._fields.values():
             bag[case.name] = case.get_message_object(bag)
         return bag
 
-    def validate(self, parent, message_fields, name=None):
+    def validate(self, parent, message_fields, name=None, fail_fast=False):
         name = name or self.name
-        params_subtree = self._get_params_sub_tree(message_fields, name)
-        bag = parent[name]
+        return self._validate_bag(parent[name], self._get_params_sub_tree(message_fields, name), fail_fast)
+
+    def _validate_bag(self, bag, params_subtree, fail_fast=False):
         errors = []
         for field in self._fields.values():
-            errors += field.validate(bag, params_subtree)
+            errors += field.validate(bag, params_subtree, fail_fast=fail_fast)
+            if errors and fail_fast:
+                return errors
+        return errors
+
+
+class _CaseIndex(object):
+    """Cases of a bag indexed by the encoded value of their leading field.
+
+    Cases are grouped by the length of their leading field. The cases whose
+    leading field has no fixed value are candidates for any data.
+    """
+
+    def __init__(self, cases):
+        self._cases = cases
+        self._unindexed = []
+        self._tables = {}
+        for position, case in enumerate(cases):
+            discriminator = case.get_discriminator()
+            if discriminator is None:
+                self._unindexed.append(position)
+            else:
+                length, can_be_little_endian, value = discriminator
+                table = self._tables.setdefault((length, can_be_little_endian), {})
+                table.setdefault(value, []).append(position)
+
+    def candidates(self, data, little_endian=False):
+        """Returns the cases that can match `data` in the order of the bag."""
+        positions = list(self._unindexed)
+        for (length, can_be_little_endian), table in self._tables.items():
+            value = data[:length]
+            if little_endian and can_be_little_endian:
+                value = value[::-1]
+            positions.extend(table.get(value, ()))
+        return [self._cases[position] for position in sorted(positions)]
+
+
+class TLVTemplate(_Template):
+    """Type-length-value container with a registry of element templates.
+
+    Each element starts with a tag of `tag_width` bytes and a length of
+    `length_width` bytes. The length includes the tag and length fields if
+    `inclusive` is true. Elements are padded to `align` bytes and the
+    padding is not included in the length.
+    """
+
+    has_length = False
+    type = 'TLV'
+
+    def __init__(self, name, parent, tag_width=1, length_width=1,
+                 inclusive=True, align=None):
+        _Template.__init__(self, name, parent)
+        self.tag_width = int(tag_width)
+        self.length_width = int(length_width)
+        self.header_length = self.tag_width + self.length_width
+        self.inclusive = inclusive
+        self._align = int(align or 1)
+        self._templates = {}
+        self._tags = {}
+
+    def add(self, field):
+        if field.type != 'TLVElement':
+            raise AssertionError('Field of type %s added to TLV. Has to be of type TLVElement.' % field.type)
+        if field.tag in self._templates:
+            raise AssertionError("Duplicate tag %s in TLV '%s'" % (field.tag, self._get_recursive_name()))
+        if self._get_field(field.name):
+            raise AssertionError("Duplicate field '%s' in '%s'" % (field.name, self._get_recursive_name()))
+        value = field.field
+        self._precompute_default(value)
+        self._fields[value.name] = value
+        self._templates[field.tag] = value
+        self._tags[value.name] = field.tag
+
+    def get_static_length(self):
+        raise IndexError('Length of TLV %s is dynamic.' % self.name)
+
+    def encode(self, message_params, parent=None, name=None, little_endian=False):
+        name = name or self.name
+        tlv = self._get_struct(name, parent, little_endian=little_endian)
+        selection = message_params.pop(name, None)
+        params = self._get_params_sub_tree(message_params, name)
+        repeated = self._get_repeated_params(params)
+        for element_name in self._get_encoded_elements(selection):
+            if element_name not in self._fields:
+                raise AssertionError("Unknown TLV element '%s' in '%s'" % (element_name, self._get_recursive_name()))
+            child_name = self._get_child_name(tlv, element_name)
+            tlv.add(self._tags[element_name], child_name,
+                    self._fields[element_name].encode(repeated.pop(child_name, params), tlv,
+                                                      name=child_name, little_endian=little_endian))
+        for element_params in [params] + repeated.values():
+            self._check_params_empty(element_params, name)
+        return tlv
+
+    def _get_encoded_elements(self, selection):
+        if selection is None:
+            return self._fields.keys()
+        return [element.strip() for element in selection.split(',') if element.strip()]
+
+    def _get_child_name(self, tlv, name):
+        """Repeated elements are named `name[1]`, `name[2]` and so on."""
+        child_name, index = name, 0
+        while child_name in tlv:
+            index += 1
+            child_name = '%s[%d]' % (name, index)
+        return child_name
+
+    def _get_repeated_params(self, params):
+        """Takes the values of repeated elements given with `name[index]`
+        from `params`. The values are returned by the child names."""
+        repeated = {}
+        for name in self._fields:
+            for index in params.indices(name):
+                child_name = '%s[%s]' % (name, index)
+                repeated[child_name] = params.extract((name, index), child_name)
+        return repeated
+
+    def decode(self, data, parent=None, name=None, little_endian=False, expected=None):
+        name = name or self.name
+        tlv = self._get_struct(name, parent, little_endian=little_endian)
+        repeated = None
+        if expected is not None:
+            expected.pop(name, None)
+            expected = self._get_params_sub_tree(expected, name)
+            repeated = self._get_repeated_params(expected)
+        index = 0
+        while index < len(data):
+            value = self._decode_element(data[index:], tlv, little_endian, expected, repeated)
+            index += tlv._element_length(value)
+        if expected is not None:
+            raise_if_failed(self._missing_elements(tlv, expected, repeated))
+            self._check_expected_empty(expected, name)
+        return tlv
+
+    def _decode_element(self, data, tlv, little_endian, expected, repeated):
+        if len(data) < self.header_length:
+            raise AssertionError("Not enough data for TLV header in '%s'. Needs %s bytes, given %s"
+                                 % (self._get_recursive_name(), self.header_length, len(data)))
+        tag = bin_to_int(data[:self.tag_width], little_endian)
+        length = bin_to_int(data[self.tag_width:self.header_length], little_endian)
+        value_length = length - self.header_length if self.inclusive else length
+        if value_length < 0 or len(data) < self.header_length + value_length:
+            raise AssertionError("Invalid length %s of TLV element %s in '%s'"
+                                 % (length, tag, self._get_recursive_name()))
+        data = data[self.header_length:self.header_length + value_length]
+        template = self._templates.get(tag)
+        if template is None:
+            value = Field('bytes', str(tag), data)
+            tlv.add(tag, self._get_child_name(tlv, str(tag)), value)
+            return value
+        child_name = self._get_child_name(tlv, template.name)
+        element_expected = expected
+        if expected is not None:
+            element_expected = repeated.pop(child_name, expected)
+        if expected is None or isinstance(template, _TemplateField):
+            value = template.decode(data, tlv, name=child_name, little_endian=little_endian)
+        else:
+            value = template.decode(data, tlv, name=child_name, little_endian=little_endian,
+                                    expected=element_expected)
+        if len(value) != value_length:
+            raise AssertionError("Length of TLV element '%s' does not match its length field. Length field: %s, element: %s"
+                                 % (child_name, value_length, len(value)))
+        tlv.add(tag, child_name, value)
+        if expected is not None and isinstance(template, _TemplateField):
+            raise_if_failed(template.validate(tlv, element_expected, child_name))
+        if element_expected is not expected:
+            self._check_expected_empty(element_expected, self.name)
+        return value
+
+    def validate(self, parent, message_fields, name=None, fail_fast=False):
+        name = name or self.name
+        tlv = parent[name]
+        message_fields.pop(name, None)
+        params = self._get_params_sub_tree(message_fields, name)
+        repeated = self._get_repeated_params(params)
+        errors = []
+        for child_name, tag in zip(tlv._index.names, tlv.tags):
+            template = self._templates.get(tag)
+            if template is not None:
+                element_params = repeated.pop(child_name, params)
+                errors += template.validate(tlv, element_params, name=child_name, fail_fast=fail_fast)
+                if element_params is not params:
+                    self._check_params_empty(element_params, name)
+            if errors and fail_fast:
+                return errors
+        errors += self._missing_elements(tlv, params, repeated)
+        self._check_params_empty(params, name)
         return errors
 
+    def _missing_elements(self, tlv, params, repeated):
+        errors = []
+        for child_name in sorted(repeated) + params.names:
+            if child_name in repeated or (child_name in self._fields and child_name not in tlv):
+                params.subtree(child_name)
+                errors.append("TLV element '%s' not found in '%s'" % (child_name, tlv._name))
+        return errors
+
+    def _get_struct(self, name, parent, little_endian=False):
+        tlv = TLV(name or self.name, self.tag_width, self.length_width,
+                  self.inclusive, self._align, little_endian)
+        tlv._parent = parent
+        return tlv
+
+
+class TLVElementTemplate(_Template):
+
+    has_length = False
+    type = 'TLVElement'
+
+    def __init__(self, tag, parent):
+        self.tag = to_int(str(tag))
+        _Template.__init__(self, None, parent)
+
+    @property
+    def field(self):
+        if not self._fields:
+            raise AssertionError('TLV element %s has no value.' % self.tag)
+        return self._fields.values()[0]
+
+    def add(self, field):
+        if self._fields:
+            raise AssertionError('TLV element %s can only have one value.' % self.tag)
+        self.name = field.name
+        _Template.add(self, field)
+
 
 class CaseTemplate(_Template):
 
@@ -429,6 +888,18 @@ class CaseTemplate(_Template):
         self.name = field.name
         _Template.add(self, field)
 
+    def get_discriminator(self):
+        """Returns the discriminator of the leading primitive field of this
+        case or None if the case can not be indexed."""
+        field = self.field
+        while isinstance(field, StructTemplate):
+            if field._parameters or not field._fields:
+                return None
+            field = field._fields.values()[0]
+        if isinstance(field, _TemplateField):
+            return field.get_discriminator()
+        return None
+
     def decode(self, data, parent, name=None, little_endian=False):
         case = parent[self.name]
         # TODO: Cleanup
@@ -442,7 +913,7 @@ class CaseTemplate(_Template):
         return case
 
     # FIXME: now validating only number of entries
-    def validate(self, parent, message_fields, name=None):
+    def validate(self, parent, message_fields, name=None, fail_fast=False):
         errors = []
         case = parent[name or self.name]
         if case.len < self.size.min or case.len > self.size.max:
@@ -463,7 +934,6 @@ class CaseTemplate(_Template):
 # TODO: list field could be overriden
 class ListTemplate(_Template):
 
-    param_pattern = re.compile(r'([^.]*?)\[(.*?)\](.*)')
     has_length = True
     type = 'List'
 
@@ -480,7 +950,7 @@ class ListTemplate(_Template):
         list = self._get_struct(name, parent)
         for index in range(self.length.decode(parent)):
             list[str(index)] = self.field.encode(params_subtree,
-                                                 parent,
+                                                 list,
                                                  name=str(index),
                                                  little_endian=little_endian)
         self._check_params_empty(params_subtree, name)
@@ -495,58 +965,43 @@ class ListTemplate(_Template):
         ls._parent = parent
         return ls
 
-    def decode(self, data, parent, name=None, little_endian=False):
+    def decode(self, data, parent, name=None, little_endian=False, expected=None):
         name = name or self.name
         message = self._get_struct(name, parent)
+        if expected is not None:
+            expected = self._get_params_sub_tree(expected, name)
         data_index = 0
         # maximum_length is given for free length (*) to limit the absolute maximum number of entries
         for index in range(0, self.length.decode(parent, maximum_length=len(data))):
-            message[str(index)] = self.field.decode(data[data_index:], message, name=str(index), little_endian=little_endian)
-            data_index += len(message[index])
+            decoded = self._decode_field(self.field, data[data_index:], message, little_endian, expected, name=str(index))
+            data_index += len(decoded)
             if self.length.free and data_index == len(data):
                 break
+        self._check_expected_empty(expected, name)
         return message
 
-    def validate(self, parent, message_fields, name=None):
+    def validate(self, parent, message_fields, name=None, fail_fast=False):
         name = name or self.name
         params_subtree = self._get_params_sub_tree(message_fields, name)
         list = parent[name]
         errors = []
         for index in range(list.len):
-            errors += self.field.validate(list, params_subtree, name=str(index))
+            errors += self.field.validate(list, params_subtree, name=str(index), fail_fast=fail_fast)
+            if errors and fail_fast:
+                return errors
         self._check_params_empty(params_subtree, name)
         return errors
 
-    def _get_params_sub_tree(self, params, name=None):
-        result = OrderedDict({'*': params['*']} if '*' in params else {})
-        name = name or self.name
-        for key in params.keys():
-            self._consume_params_with_brackets(name, params, result, key)
-            self._consume_dot_syntax(name, params, result, key)
-        return result
-
-    def _consume_params_with_brackets(self, name, params, result, key):
-        match = self.param_pattern.match(key)
-        if match:
-            prefix, child_name, ending = match.groups()
-            if prefix == name:
-                result[child_name + ending] = params.pop(key)
-            elif prefix == '*':
-                result[child_name + ending] = params[key]
-
-    def _consume_dot_syntax(self, name, params, result, key):
-        prefix, _, ending = key.partition('.')
-        if prefix == name:
-            result[ending] = params.pop(key)
-        elif prefix == '*' and ending:
-            result[ending] = params[key]
-
 
 class BinaryContainerTemplate(_Template):
 
     has_length = False
     type = 'BinaryContainer'
 
+    def __init__(self, name, parent):
+        _Template.__init__(self, name, parent)
+        self._layout = []
+
     def get_static_length(self):
         return self.binlength / 8
 
@@ -554,6 +1009,17 @@ class BinaryContainerTemplate(_Template):
         if not isinstance(field, Binary):
             raise AssertionError('Binary container can only have binary fields.')
         _Template.add(self, field)
+        self._layout = self._get_bit_layout()
+
+    def _get_bit_layout(self):
+        """Returns (field, shift, mask) for each field so that the value of the
+        field is `(container_value >> shift) & mask`."""
+        layout = []
+        shift = self.binlength
+        for field in self._fields.values():
+            shift -= field.length.value
+            layout.append((field, shift, (1 << field.length.value) - 1))
+        return layout
 
     @property
     def binlength(self):
@@ -568,34 +1034,31 @@ class BinaryContainerTemplate(_Template):
         self._encode_fields(container, self._get_params_sub_tree(message_params, name))
         return container
 
-    def decode(self, data, parent=None, name=None, little_endian=False):
+    def decode(self, data, parent=None, name=None, little_endian=False, expected=None):
         container = self._get_struct(name, parent, little_endian=little_endian)
+        if expected is not None:
+            expected = self._get_params_sub_tree(expected, name)
+        data = data[:self.binlength / 8]
         if little_endian:
             data = data[::-1]
-        bin_str = to_binary_string_of_length(self.binlength, data[:self.binlength / 8])
-        data_index = 2
-        for field in self._fields.values():
-            container[field.name] = self._create_field(bin_str, data_index,
-                                                       field)
-            data_index += field.length.value
+        value = bin_to_int(data)
+        for field, shift, mask in self._layout:
+            container[field.name] = self._create_field(value, field, shift, mask)
+            if expected is not None:
+                raise_if_failed(field.validate(container, expected))
+        self._check_expected_empty(expected)
         return container
 
-    def _create_field(self, bin_str, data_index, field):
-        return BinaryField(field.length.value, field.name,
-                           self._binary_substring(bin_str, data_index, field))
-
-    def _binary_substring(self, bin_str, data_index, field):
-        return to_bin(
-            "0b" + bin_str[data_index:data_index + field.length.value])
+    def _create_field(self, value, field, shift, mask):
+        return BinaryField(field.length.value, field.name, (value >> shift) & mask)
 
-    def validate(self, parent, message_fields, name=None):
+    def validate(self, parent, message_fields, name=None, fail_fast=False):
         name = name or self.name
-        errors = []
         message = parent[name]
-        return errors + _Template.validate(self, message, self._get_params_sub_tree(message_fields, name))
+        return _Template.validate(self, message, self._get_params_sub_tree(message_fields, name), fail_fast=fail_fast)
 
     def _get_struct(self, name, parent, little_endian=False):
-        cont = BinaryContainer(name or self.name, little_endian=little_endian)
+        cont = BinaryContainer(name or self.name, little_endian=little_endian, index=self.name_index)
         cont._parent = parent
         return cont
 
@@ -623,21 +1086,38 @@ class TBCDContainerTemplate(_Template):
         self._encode_fields(container, self._get_params_sub_tree(message_params, name))
         return container
 
-    def decode(self, data, parent=None, name=None, little_endian=False):
+    def decode(self, data, parent=None, name=None, little_endian=False, expected=None):
         self._verify_not_little_endian(little_endian)
         container = self._get_struct(name, parent)
-        a = to_tbcd_value(data)
+        if expected is not None:
+            expected = self._get_params_sub_tree(expected, name)
+        digits = None
         index = 0
         for field in self._fields.values():
             field_length = field.length.decode(container, len(data) * 2 - index)
-            container[field.name] = Field(field.type, field.name, to_tbcd_binary(a[index:index + field_length]))
+            if index % 2 == 0:
+                value = self._slice_aligned(data, index, field_length)
+            else:
+                # Field starts from the middle of a byte, so the digits have
+                # to be shifted by one nibble.
+                digits = digits or to_tbcd_value(data)
+                value = to_tbcd_binary(digits[index:index + field_length])
+            container[field.name] = Field(field.type, field.name, value)
+            if expected is not None:
+                raise_if_failed(field.validate(container, expected))
             index += field_length
+        self._check_expected_empty(expected)
         return container
 
-    def validate(self, parent, message_fields, name=None):
+    def _slice_aligned(self, data, index, field_length):
+        value = data[index / 2:(index + field_length + 1) / 2]
+        if field_length % 2:
+            return with_tbcd_filler(value)
+        return value
+
+    def validate(self, parent, message_fields, name=None, fail_fast=False):
         name = name or self.name
-        errors = []
-        return errors + _Template.validate(self, parent[name], self._get_params_sub_tree(message_fields, name))
+        return _Template.validate(self, parent[name], self._get_params_sub_tree(message_fields, name), fail_fast=fail_fast)
 
     @property
     def binlength(self):
@@ -645,7 +1125,7 @@ class TBCDContainerTemplate(_Template):
         return int(ceil(length / 2.0) * 8)
 
     def _get_struct(self, name, parent):
-        tbcd = TBCDContainer(name or self.name)
+        tbcd = TBCDContainer(name or self.name, index=self.name_index)
         tbcd._parent = parent
         return tbcd
 
@@ -658,6 +1138,17 @@ class ConditionalTemplate(_Template):
     def __init__(self, condition, name, parent):
         self.condition = ConditionParser(condition)
         _Template.__init__(self, name, parent)
+        self._mark_condition_fields()
+
+    def _mark_condition_fields(self):
+        # Conditions are evaluated against the parent, so only its fields
+        # defined before this template can be referenced.
+        if self.parent is None:
+            return
+        for path in self.condition.paths:
+            slots = self.parent._get_slots(path)
+            if slots and isinstance(slots[-1][2], _TemplateField):
+                slots[-1][2].referenced_by_condition = True
 
     def encode(self, message_params, parent=None, name=None, little_endian=False):
         conditional = self._get_struct(name, parent)
@@ -667,21 +1158,23 @@ class ConditionalTemplate(_Template):
                                 little_endian=little_endian)
         return conditional
 
-    def decode(self, data, parent=None, name=None, little_endian=False):
-        if self.condition.evaluate(parent):
-            return _Template.decode(self, data, parent, name, little_endian)
-        else:
-            return self._get_struct(name, parent)
+    def decode(self, data, parent=None, name=None, little_endian=False, expected=None):
+        conditional = self._get_struct(name, parent)
+        if conditional.exists:
+            if expected is not None:
+                expected = self._get_params_sub_tree(expected, name)
+            self._decode_fields(conditional, data, little_endian, expected)
+        return conditional
 
-    def validate(self, parent, message_fields, name=None):
+    def validate(self, parent, message_fields, name=None, fail_fast=False):
         name = name or self.name
         message = parent[name]
         if message.exists:
-            return _Template.validate(self, message, self._get_params_sub_tree(message_fields, name))
+            return _Template.validate(self, message, self._get_params_sub_tree(message_fields, name), fail_fast=fail_fast)
         return []
 
     def _get_struct(self, name, parent):
-        conditional = Conditional(name or self.name)
+        conditional = Conditional(name or self.name, index=self.name_index)
         conditional._parent = parent
         conditional.exists = self.condition.evaluate(parent)
         return conditional
@@ -11,6 +11,7 @@
 #  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
+import socket
 import time
 import threading
 import traceback
@@ -21,12 +22,67 @@ from Rammbock.binary_tools import to_bin, to_int
 from Rammbock.synchronization import LOCK
 
 
+class Framer(object):
+    """Splits the data buffered in a stream to the messages of a protocol.
+
+    The framer is either awaiting a header or, after the header has been
+    decoded, awaiting the body of the message. The decoded header is kept
+    between calls, and data is consumed from the stream only when the whole
+    message has been received, so nothing is ever returned to the stream.
+
+    Messages of protocols with a terminator are framed by the terminator
+    instead. The buffered data is scanned from where the previous scan
+    ended, so a partially received frame is not scanned again.
+    """
+
+    def __init__(self, protocol):
+        self._protocol = protocol
+        self.reset()
+
+    def reset(self):
+        self._header = None
+        self._header_length = 0
+        self._body_length = None
+        self._scanned = 0
+
+    def next(self, stream):
+        """Returns the next `(header, pdu bytes)` from the data buffered in
+        `stream`, or None if the message has not been completely received."""
+        if self._protocol.terminator:
+            return self._next_terminated(stream)
+        data = stream.buffered
+        if self._header is None:
+            self._header, self._header_length = self._protocol.decode_header(data)
+            if self._header is None:
+                return None
+            self._body_length = self._protocol.pdu_bytes_length(self._header)
+        end = self._header_length + (self._body_length or 0)
+        if len(data) < end:
+            return None
+        header, body_length = self._header, self._body_length
+        stream.consume(end)
+        self.reset()
+        return header, data[end - body_length:end] if body_length is not None else None
+
+    def _next_terminated(self, stream):
+        data = stream.buffered
+        terminator = self._protocol.terminator
+        end = data.find(terminator, self._scanned)
+        if end == -1:
+            self._scanned = max(len(data) - len(terminator) + 1, 0)
+            return None
+        stream.consume(end + len(terminator))
+        self.reset()
+        return self._protocol.decode_frame(data[:end])
+
+
 class MessageStream(object):
 
     def __init__(self, stream, protocol):
         self._cache = []
         self._stream = stream
         self._protocol = protocol
+        self._framer = Framer(protocol)
         self._handlers = []
         self._handler_thread = None
         self._running = True
@@ -45,25 +101,31 @@ class MessageStream(object):
             self._handler_thread.daemon = True
             self._handler_thread.start()
 
-    def get(self, message_template, timeout=None, header_filter=None, latest=None):
+    def get(self, message_template, timeout=None, header_filter=None, latest=None, expectations=None):
         header_fields = message_template.header_parameters
         logger.trace("Get message with params %s" % header_fields)
         if latest:
             self._fill_cache()
-        msg = self._get_from_cache(message_template, header_fields, header_filter, latest)
+        msg = self._get_from_cache(message_template, header_fields, header_filter, latest, expectations)
         if msg:
             logger.trace("Cache hit. Cache currently has %s messages" % len(self._cache))
             return msg
         cutoff = time.time() + float(timeout if timeout else 0)
         while not timeout or time.time() < cutoff:
             with LOCK:
-                header, pdu_bytes = self._protocol.read(self._stream, timeout=timeout)
+                header, pdu_bytes = self._read(timeout)
                 if self._matches(header, header_fields, header_filter):
-                    return self._to_msg(message_template, header, pdu_bytes)
+                    return self._to_msg(message_template, header, pdu_bytes, expectations)
                 else:
                     self._match_or_cache(header, pdu_bytes)
         raise AssertionError('Timeout %fs exceeded in message stream.' % float(timeout))
 
+    def _read(self, timeout):
+        message = self._stream.read_frame(self._framer, timeout=timeout)
+        if message is None:
+            raise socket.timeout('timed out')
+        return message
+
     def _match_or_cache(self, header, pdu_bytes):
         for template, func, handler_filter in self._handlers:
             if self._matches(header, template.header_parameters, handler_filter):
@@ -78,16 +140,18 @@ class MessageStream(object):
         mod = __import__(module)
         return getattr(mod, function)
 
-    def _get_from_cache(self, template, fields, header_filter, latest):
+    def _get_from_cache(self, template, fields, header_filter, latest, expectations=None):
         indexes = range(len(self._cache))
         for index in indexes if not latest else reversed(indexes):
             header, pdu = self._cache[index]
             if self._matches(header, fields, header_filter):
                 self._cache.pop(index)
-                return self._to_msg(template, header, pdu)
+                return self._to_msg(template, header, pdu, expectations)
         return None
 
-    def _to_msg(self, template, header, pdu_bytes):
+    def _to_msg(self, template, header, pdu_bytes, expectations=None):
+        if expectations is not None:
+            return template.decode_and_validate(pdu_bytes, header, expectations)
         if template.only_header:
             return header
         msg = template.decode(pdu_bytes, parent=header)
@@ -115,8 +179,10 @@ class MessageStream(object):
         return True
 
     def empty(self):
-        self._cache = []
-        self._stream.empty()
+        with LOCK:
+            self._cache = []
+            self._stream.empty()
+            self._framer.reset()
 
     def get_messages_count_in_cache(self):
         self._fill_cache()
@@ -125,12 +191,13 @@ class MessageStream(object):
         return len(self._cache)
 
     def _fill_cache(self):
-        try:
-            while True:
-                header, pdu_bytes = self._protocol.read(self._stream, timeout=0.2)
-                self._cache.append((header, pdu_bytes))
-        except:
-            pass
+        # The framer keeps a partially received message between reads, so it
+        # must not be shared with the handler thread in the middle of a read.
+        with LOCK:
+            message = self._stream.read_frame(self._framer, timeout=0.2)
+            while message is not None:
+                self._cache.append(message)
+                message = self._stream.read_frame(self._framer, timeout=0.2)
 
     def match_handlers_periodically(self):
         while self._running:
@@ -142,8 +209,10 @@ class MessageStream(object):
             while True:
                 with LOCK:
                     self._try_matching_cached_to_templates()
-                    header, pdu_bytes = self._protocol.read(self._stream, timeout=0.01)
-                    self._match_or_cache(header, pdu_bytes)
+                    message = self._stream.read_frame(self._framer, timeout=0.01)
+                    if message is None:
+                        return
+                    self._match_or_cache(*message)
         except Exception:
             logger.debug("failure in matching cache %s" % traceback.format_exc())
 
@@ -0,0 +1,133 @@
+#  Copyright 2014 Nokia Siemens Networks Oyj
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+def split_name(name):
+    """Splits a field name like `pair.first` or `list[3].x` to its parts."""
+    return name.replace('[', '.').replace(']', '').split('.')
+
+
+class Parameters(dict):
+    """Field values given with dotted names parsed to a trie.
+
+    The values of the fields on this level are the items of the dict. Values
+    of nested fields are in the `Parameters` of the child with the same
+    name, which containers take with `subtree`. Values given with the
+    wildcard `*` as a part of the name apply to all children on that level.
+    Values of nested fields can also be given as dicts, for example
+    `{'pair': {'first': 1}}` equals `{'pair.first': 1}`.
+    """
+
+    def __init__(self, values=None):
+        dict.__init__(self)
+        self._children = {}
+        if isinstance(values, Parameters):
+            self._update_missing(values)
+            return
+        for name, value in (values or {}).items():
+            self.set(name, value)
+
+    def set(self, name, value):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                self.set('%s.%s' % (name, key), item)
+            return
+        parts = split_name(name)
+        node = self
+        for part in parts[:-1]:
+            node = node._child(part)
+        dict.__setitem__(node, parts[-1], value)
+
+    def has(self, name):
+        parts = split_name(name)
+        node = self
+        for part in parts[:-1]:
+            node = node._children.get(part)
+            if node is None:
+                return False
+        return parts[-1] in node
+
+    def _child(self, name):
+        child = self._children.get(name)
+        if child is None:
+            child = self._children[name] = Parameters()
+        return child
+
+    def subtree(self, name):
+        """Removes and returns the values of the children of `name`."""
+        result = self._children.pop(name, None)
+        if result is None:
+            result = Parameters()
+        wildcard = self._children.get('*')
+        if wildcard is not None:
+            result._update_missing(wildcard)
+        if '*' in self and '*' not in result:
+            dict.__setitem__(result, '*', self['*'])
+        if name in self:
+            dict.__setitem__(result, '', self.pop(name))
+        return result
+
+    def extract(self, parts, name):
+        """Removes the values at path `parts` and returns them as values of
+        `name` in new parameters with the wildcards of this level."""
+        result = Parameters()
+        node = self
+        for part in parts[:-1]:
+            node = node._children.get(part)
+            if node is None:
+                break
+        else:
+            if parts[-1] in node:
+                dict.__setitem__(result, name, node.pop(parts[-1]))
+            if parts[-1] in node._children:
+                result._children[name] = node._children.pop(parts[-1])
+        if '*' in self:
+            dict.__setitem__(result, '*', self['*'])
+        if '*' in self._children:
+            result._children['*'] = self._children['*']
+        return result
+
+    def indices(self, name):
+        """Returns the indices given to `name` with `name[index]`."""
+        child = self._children.get(name)
+        if child is None:
+            return []
+        return sorted(set(key for key in child.keys() + child._children.keys()
+                          if key.isdigit()))
+
+    def _update_missing(self, other):
+        for key, value in other.items():
+            if key not in self:
+                dict.__setitem__(self, key, value)
+        for name, child in other._children.items():
+            self._child(name)._update_missing(child)
+
+    @property
+    def names(self):
+        """Names of the fields and children having values on this level."""
+        return self.keys() + [name for name, child in self._children.items()
+                              if child.unused()]
+
+    def unused(self, prefix=''):
+        """Returns the remaining values as `(dotted name, value)` pairs."""
+        result = [(prefix + key, value) for key, value in self.items()]
+        for name, child in self._children.items():
+            result.extend(child.unused(prefix + name + '.'))
+        return result
+
+
+def as_parameters(values):
+    if isinstance(values, Parameters):
+        return values
+    return Parameters(values)
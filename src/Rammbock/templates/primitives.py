@@ -19,7 +19,9 @@ import re
 
 from Rammbock.message import Field, BinaryField
 from Rammbock.binary_tools import to_bin_of_length, to_0xhex, to_tbcd_binary, \
-    to_tbcd_value, to_bin, to_twos_comp, to_int
+    to_tbcd_value, to_bin, to_integer, int_to_bin_of_length, bin_to_int
+from Rammbock.templates.validators import NO_VALIDATION, ExactValidator, \
+    PatternValidator, RegexpValidator, UnsupportedRegexpValidator
 
 
 class _TemplateField(object):
@@ -27,10 +29,13 @@ class _TemplateField(object):
     def __init__(self, name, default_value):
         self._set_default_value(default_value)
         self.name = name
+        self._encoded_values = {}
+        self._validators = {}
 
     has_length = True
     can_be_little_endian = False
     referenced_later = False
+    referenced_by_condition = False
 
     def get_static_length(self):
         if not self.length.static:
@@ -48,13 +53,57 @@ class _TemplateField(object):
     def encode(self, paramdict, parent, name=None, little_endian=False):
         value = self._get_element_value_and_remove_from_params(paramdict, name)
         if not value and self.referenced_later:
-            return PlaceHolderField(self)
+            return ReservedField(self, self._get_name(name), parent, little_endian)
         return self._to_field(name, value, parent, little_endian=little_endian)
 
     def _to_field(self, name, value, parent, little_endian=False):
-        field_name, field_value = self._encode_value(value, parent, little_endian=little_endian)
+        field_name, field_value = self._encode_precomputed(value, parent, little_endian=little_endian)
         return Field(self.type, self._get_name(name), field_name, field_value, little_endian=little_endian)
 
+    def precompute_value(self, value):
+        """Encodes `value` and compiles its validator beforehand so that
+        encoding and validating it does not convert it again. Values of
+        fields whose length refers to other fields depend on the message and
+        are not encoded beforehand."""
+        if not isinstance(value, basestring):
+            return
+        self._precompile_validator(value)
+        if self.length.has_references:
+            return
+        for little_endian in (False, True) if self.can_be_little_endian else (False,):
+            try:
+                self._encoded_values[value, little_endian] = \
+                    self._encode_value(value, None, little_endian=little_endian)
+            except Exception:
+                # Not a value that can be sent, e.g. a validation pattern.
+                # Errors are reported when the value is actually used.
+                pass
+
+    def get_discriminator(self):
+        """Returns `(length, can_be_little_endian, binary)` if received
+        values of this field are valid only when they equal the encoded
+        default value `binary`. Otherwise returns None."""
+        value = self.default_value
+        if not self._is_fixed_value(value) or not self.length.static:
+            return None
+        try:
+            binary = self._encode_precomputed(value, None)[0]
+        except Exception:
+            return None
+        if len(binary) != self.length.value:
+            return None
+        return self.length.value, self.can_be_little_endian, binary
+
+    def _is_fixed_value(self, value):
+        return isinstance(value, basestring) and value not in ('', 'None') \
+            and not value.startswith(('(', 'REGEXP'))
+
+    def _encode_precomputed(self, value, message, little_endian=False):
+        try:
+            return self._encoded_values[value, little_endian]
+        except (KeyError, TypeError):
+            return self._encode_value(value, message, little_endian=little_endian)
+
     def decode(self, data, message, name=None, little_endian=False):
         data = self._prepare_data(data)
         length, aligned_length = self.length.decode_lengths(message, len(data))
@@ -69,66 +118,55 @@ class _TemplateField(object):
     def _prepare_data(self, data):
         return data
 
-    def validate(self, parent, paramdict, name=None):
+    def is_complete(self, data):
+        """Returns False if the value of this field at the beginning of
+        `data` has not yet been completely received."""
+        return True
+
+    def validate(self, parent, paramdict, name=None, fail_fast=False):
         name = name or self.name
         field = parent[name]
-        value = field.bytes
         forced_value = self._get_element_value_and_remove_from_params(paramdict, name)
+        return self._get_validator(forced_value).validate(field)
+
+    def _precompile_validator(self, value):
+        if value in self._validators:
+            return
+        try:
+            self._validators[value] = self._compile_validator(value)
+        except Exception:
+            # Errors are reported when the value is actually validated.
+            pass
+
+    def _get_validator(self, forced_value):
+        """Returns the validator compiled for `forced_value`. Validators of
+        template level values are compiled beforehand with
+        `precompute_value`. Other values, e.g. given to a single receive,
+        are compiled when used and not kept."""
         try:
-            if not forced_value or forced_value == 'None':
-                return []
-            elif forced_value.startswith('('):
-                return self._validate_pattern(forced_value, value, field)
-        except AttributeError as e:
-            e.args = ('Validating {}:{} failed. {}.\n    Did you set default value as numeric object instead of string?'
-                      .format(name, forced_value, e.args[0]),)
-            raise e
+            return self._validators[forced_value]
+        except (KeyError, TypeError):
+            return self._compile_validator(forced_value)
+
+    def _compile_validator(self, forced_value):
+        if forced_value in (None, '', 'None'):
+            return NO_VALIDATION
+        if not isinstance(forced_value, basestring):
+            return ExactValidator(self, forced_value)
+        if forced_value.startswith('('):
+            return PatternValidator(self, forced_value)
         if forced_value.startswith('REGEXP'):
-            return self._validate_regexp(forced_value, value, field)
-        return self._validate_exact_match(forced_value, value, field)
-
-    def _validate_regexp(self, forced_pattern, value, field):
-        return ["Value of field '%s' can not be matched to regular expression pattern '%s'" %
-                (field._get_recursive_name(), forced_pattern)]
-
-    def _validate_pattern(self, forced_pattern, value, field):
-        if self._validate_or(forced_pattern, value, field):
-            return []
-        if self._validate_masked(forced_pattern, value):
-            return []
-        return ["Value of field '%s' does not match pattern '%s!=%s'" %
-                (field._get_recursive_name(), to_0xhex(value), forced_pattern)]
-
-    def _validate_or(self, forced_pattern, value, field):
-        if forced_pattern.find('|') != -1:
-            patterns = forced_pattern[1:-1].split('|')
-            for pattern in patterns:
-                if self._is_match(pattern, value, field._parent):
-                    return True
-            return False
-
-    def _validate_masked(self, forced_pattern, value):
-        if forced_pattern.find('&') != -1:
-            masked_val, masked_field = self._apply_mask_to_values(forced_pattern, value)
-            if masked_val == masked_field:
-                return True
-            return False
-
-    def _apply_mask_to_values(self, forced_pattern, value):
-        val = forced_pattern[1:-1].split('&')[0].strip()
-        mask = forced_pattern[1:-1].split('&')[1].strip()
-        return to_int(val) & to_int(mask), to_int(to_0xhex(value)) & to_int(mask)
-
-    def _is_match(self, forced_value, value, parent):
-        # TODO: Should pass msg
-        forced_binary_val, _ = self._encode_value(forced_value, parent)
-        return forced_binary_val == value
-
-    def _validate_exact_match(self, forced_value, value, field):
-        if not self._is_match(forced_value, value, field._parent):
-            return ['Value of field %s does not match %s!=%s' %
-                    (field._get_recursive_name(), self._default_presentation_format(value), forced_value)]
-        return []
+            return self._compile_regexp(forced_value)
+        return ExactValidator(self, forced_value)
+
+    def _compile_regexp(self, forced_pattern):
+        return UnsupportedRegexpValidator(forced_pattern)
+
+    def _expected_key(self, forced_value, parent):
+        return self._encode_precomputed(forced_value, parent)[0]
+
+    def _value_key(self, value):
+        return value
 
     def _default_presentation_format(self, value):
         return to_0xhex(value)
@@ -149,13 +187,34 @@ class _TemplateField(object):
         self.default_value = str(value) if value and value != '""' else None
 
 
-class PlaceHolderField(object):
+class ReservedField(Field):
+    """Zero filled slot of a length field whose value is known only after the
+    fields referring to it have been encoded. The value is patched in place."""
 
-    _type = 'referenced_later'
-    _parent = None
+    __slots__ = ('template', 'patched')
 
-    def __init__(self, template):
+    def __init__(self, template, name, parent, little_endian=False):
+        length, aligned_length = template.length.decode_lengths(parent)
+        Field.__init__(self, template.type, name, '\x00' * length,
+                       aligned_len=aligned_length, little_endian=little_endian)
         self.template = template
+        self.patched = False
+
+    def patch(self, value):
+        binary, _ = self.template._encode_value(str(value), self._parent,
+                                                little_endian=self._little_endian)
+        if len(binary) != len(self._original_value):
+            raise AssertionError('Length value %s does not fit in %s'
+                                 % (value, self._get_recursive_name()))
+        self._original_value = binary
+        self._value = binary[::-1] if self._little_endian else binary
+        self._int_value = None
+        self.patched = True
+
+    def _write(self, buffer, offset):
+        if not self.patched:
+            raise AssertionError('Value of %s not set' % self._get_recursive_name())
+        Field._write(self, buffer, offset)
 
 
 class UInt(_TemplateField):
@@ -170,10 +229,12 @@ class UInt(_TemplateField):
     def _encode_value(self, value, message, little_endian=False):
         self._raise_error_if_no_value(value, message)
         length, aligned_length = self.length.decode_lengths(message)
-        binary = to_bin_of_length(length, value)
-        binary = binary[::-1] if little_endian else binary
+        binary = int_to_bin_of_length(length, self._get_int_value(length, value), little_endian)
         return binary, aligned_length
 
+    def _get_int_value(self, length, value):
+        return to_integer(value)
+
 
 class Int(UInt):
 
@@ -183,19 +244,15 @@ class Int(UInt):
     def __init__(self, length, name, default_value=None, align=None):
         UInt.__init__(self, length, name, default_value, align)
 
-    def _get_int_value(self, message, value):
-        bin_len = self.length.decode_lengths(message)[0] * 8
-        min = pow(-2, (bin_len - 1))
-        max = pow(2, (bin_len - 1)) - 1
-        if not min <= to_int(value) <= max:
+    def _get_int_value(self, length, value):
+        bits = length * 8
+        int_value = to_integer(value)
+        min = -(1 << (bits - 1))
+        max = (1 << (bits - 1)) - 1
+        if not min <= int_value <= max:
             raise AssertionError('Value %s out of range (%d..%d)'
                                  % (value, min, max))
-        return to_twos_comp(value, bin_len)
-
-    def _encode_value(self, value, message, little_endian=False):
-        self._raise_error_if_no_value(value, message)
-        value = self._get_int_value(message, value)
-        return UInt._encode_value(self, value, message, little_endian)
+        return int_value + (1 << bits) if int_value < 0 else int_value
 
 
 class Char(_TemplateField):
@@ -216,21 +273,21 @@ class Char(_TemplateField):
         length, aligned_length = self.length.find_length_and_set_if_necessary(message, len(value))
         return value.ljust(length, '\x00'), aligned_length
 
+    def get_discriminator(self):
+        if self._terminator:
+            return None
+        return _TemplateField.get_discriminator(self)
+
     def _prepare_data(self, data):
         if self._terminator:
             return data[0:data.index(self._terminator) + len(self._terminator)]
         return data
 
-    def _validate_regexp(self, forced_pattern, value, field):
-        try:
-            regexp = forced_pattern.split(':')[1].strip()
-            if bool(re.match(regexp, field.ascii)):
-                return []
-            else:
-                return ['Value of field %s does not match the RegEx %s!=%s' %
-                        (field._get_recursive_name(), self._default_presentation_format(value), forced_pattern)]
-        except re.error as e:
-            raise Exception("Invalid RegEx Error : " + str(e))
+    def is_complete(self, data):
+        return not self._terminator or self._terminator in data
+
+    def _compile_regexp(self, forced_pattern):
+        return RegexpValidator(self, forced_pattern)
 
 
 class Binary(_TemplateField):
@@ -251,15 +308,20 @@ class Binary(_TemplateField):
         return binary, self._byte_length(aligned)
 
     def _to_field(self, name, value, parent, little_endian=False):
-        field_name, field_value = self._encode_value(value, parent, little_endian=little_endian)
+        field_name, field_value = self._encode_precomputed(value, parent, little_endian=little_endian)
         return BinaryField(self.length.value, self._get_name(name), field_name, field_value, little_endian=little_endian)
 
     def _byte_length(self, length):
         return int(ceil(length / 8.0))
 
-    def _is_match(self, forced_value, value, message):
-        forced_binary_val, _ = self._encode_value(forced_value, message)   # TODO: Should pass msg
-        return int(to_0xhex(forced_binary_val), 16) == int(to_0xhex(value), 16)
+    def get_discriminator(self):
+        return None
+
+    def _expected_key(self, forced_value, parent):
+        return bin_to_int(self._encode_precomputed(forced_value, parent)[0])
+
+    def _value_key(self, value):
+        return bin_to_int(value)
 
 
 class TBCD(_TemplateField):
@@ -287,6 +349,7 @@ class PDU(_TemplateField):
 
     type = 'pdu'
     name = '__pdu__'
+    default_value = None
 
     def __init__(self, length):
         self.length = Length(length)
@@ -294,7 +357,7 @@ class PDU(_TemplateField):
     def encode(self, params, parent, little_endian=False):
         return None
 
-    def validate(self, parent, paramdict, name=None):
+    def validate(self, parent, paramdict, name=None, fail_fast=False):
         return []
 
 
@@ -346,7 +409,7 @@ class _StaticLength(_Length):
     def decode_lengths(self, message, max_length=None):
         return self._get_aligned_lengths(self.value)
 
-    def find_length_and_set_if_necessary(self, message, min_length, little_endian=False):
+    def find_length_and_set_if_necessary(self, message, min_length):
         return self._get_aligned_lengths(self.value)
 
 
@@ -375,6 +438,14 @@ class _DynamicLength(_Length):
         self.field, self.value_calculator = parse_field_and_calculator(value)
         self.field_parts = self.field.split('.')
         self.align = int(align)
+        self._depth = None
+        self._slots = ()
+
+    def resolve(self, depth, slots):
+        """Sets the reference to be found `depth` levels up from the parent
+        and from there by the positions of the `(name, position)` slots."""
+        self._depth = depth
+        self._slots = slots
 
     def calc_value(self, param):
         return self.value_calculator.calc_value(param)
@@ -389,12 +460,34 @@ class _DynamicLength(_Length):
         return self._get_aligned_lengths(self.calc_value(reference.int))
 
     def _find_reference(self, parent):
+        if self._depth is not None:
+            field = self._get_resolved_field(parent)
+            if field is not None:
+                return field
+        return self._search_reference(parent)
+
+    def _get_resolved_field(self, elem):
+        for _ in range(self._depth):
+            if elem is None:
+                return None
+            elem = elem._parent
+        for name, position in self._slots:
+            children = getattr(elem, '_children', None)
+            # Positions differ from the template if, for example, a header
+            # has been added to a message. Then the reference is searched.
+            if children is None or position >= len(children) or \
+                    elem._index.names[position] != name:
+                return None
+            elem = children[position]
+        return elem
+
+    def _search_reference(self, parent):
         field = self._get_field(parent)
         if field:
             return field
         else:
             parent = parent._parent
-            return self._find_reference(parent) if parent else None
+            return self._search_reference(parent) if parent else None
 
     def _get_field(self, elem):
         for part in self.field_parts:
@@ -404,26 +497,19 @@ class _DynamicLength(_Length):
         return elem
 
     def _has_been_set(self, reference):
-        return reference._type != 'referenced_later'
+        return not isinstance(reference, ReservedField) or reference.patched
 
-    def _set_length(self, reference, min_length, little_endian=False):
+    def _set_length(self, reference, min_length):
         value_len, aligned_len = self._get_aligned_lengths(min_length)
-        reference._parent[self.field_parts[-1]] = \
-            self._encode_ref_length(self.solve_parameter(aligned_len),
-                                    reference,
-                                    little_endian=little_endian)
+        reference.patch(self.solve_parameter(aligned_len))
         return value_len, aligned_len
 
-    def _encode_ref_length(self, aligned_len, reference, little_endian=False):
-        return reference.template.encode({self.field_parts[-1]: str(aligned_len)},
-                                         reference._parent, little_endian=little_endian)
-
-    def find_length_and_set_if_necessary(self, parent, min_length, little_endian=False):
+    def find_length_and_set_if_necessary(self, parent, min_length):
         reference = self._find_reference(parent)
         if self._has_been_set(reference):
             self._raise_error_if_not_enough_space(reference, self.solve_parameter(min_length))
             return self._get_aligned_lengths(self.calc_value(reference.int))
-        return self._set_length(reference, min_length, little_endian=little_endian)
+        return self._set_length(reference, min_length)
 
     def _raise_error_if_not_enough_space(self, reference, min_length):
         if reference.int < min_length:
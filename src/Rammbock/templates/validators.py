@@ -0,0 +1,173 @@
+#  Copyright 2014 Nokia Siemens Networks Oyj
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import re
+
+from Rammbock.binary_tools import to_0xhex, to_int, bin_to_int
+
+
+class NoValidation(object):
+
+    def validate(self, field):
+        return []
+
+
+NO_VALIDATION = NoValidation()
+
+
+class ExpectedValue(object):
+    """Expected value of a field compared in the form returned by the
+    `_value_key` of the field template. The value is encoded only once unless
+    its encoding depends on the received message."""
+
+    def __init__(self, template, value):
+        self._template = template
+        self.value = value
+        self.key = self._compile(template, value)
+
+    def _compile(self, template, value):
+        if template.length.has_references:
+            return None
+        try:
+            return template._expected_key(value, None)
+        except Exception:
+            # Errors are reported when the value is actually validated.
+            return None
+
+    def get_key(self, parent):
+        if self.key is None:
+            return self._template._expected_key(self.value, parent)
+        return self.key
+
+
+class ExactValidator(object):
+
+    def __init__(self, template, expected):
+        self._template = template
+        self._expected = ExpectedValue(template, expected)
+
+    def validate(self, field):
+        value = field.bytes
+        if self._expected.get_key(field._parent) == self._template._value_key(value):
+            return []
+        return ['Value of field %s does not match %s!=%s' %
+                (field._get_recursive_name(),
+                 self._template._default_presentation_format(value),
+                 self._expected.value)]
+
+
+class PatternValidator(object):
+    """Validator for patterns `(value1|value2|...)` and `(value & mask)`."""
+
+    def __init__(self, template, pattern):
+        self._template = template
+        self._pattern = pattern
+        self._alternatives = self._compile_alternatives(template, pattern)
+        self._alternative_keys = self._get_alternative_keys()
+        self._mask = self._compile_mask(pattern)
+
+    def _compile_alternatives(self, template, pattern):
+        if '|' not in pattern:
+            return []
+        return [ExpectedValue(template, alternative)
+                for alternative in pattern[1:-1].split('|')]
+
+    def _get_alternative_keys(self):
+        if any(alternative.key is None for alternative in self._alternatives):
+            return None
+        return frozenset(alternative.key for alternative in self._alternatives)
+
+    def _compile_mask(self, pattern):
+        if '&' not in pattern:
+            return None
+        value, mask = (part.strip() for part in pattern[1:-1].split('&')[:2])
+        mask = to_int(mask)
+        return to_int(value) & mask, mask
+
+    def validate(self, field):
+        value = field.bytes
+        if self._matches_alternative(value, field._parent) or \
+                self._matches_mask(value):
+            return []
+        return ["Value of field '%s' does not match pattern '%s!=%s'" %
+                (field._get_recursive_name(), to_0xhex(value), self._pattern)]
+
+    def _matches_alternative(self, value, parent):
+        value_key = self._template._value_key(value)
+        if self._alternative_keys is not None:
+            return value_key in self._alternative_keys
+        return any(alternative.get_key(parent) == value_key
+                   for alternative in self._alternatives)
+
+    def _matches_mask(self, value):
+        if self._mask is None:
+            return False
+        masked_value, mask = self._mask
+        return bin_to_int(value) & mask == masked_value
+
+
+class UnsupportedRegexpValidator(object):
+
+    def __init__(self, pattern):
+        self._pattern = pattern
+
+    def validate(self, field):
+        return ["Value of field '%s' can not be matched to regular expression pattern '%s'" %
+                (field._get_recursive_name(), self._pattern)]
+
+
+class RegexpValidator(object):
+
+    def __init__(self, template, pattern):
+        self._template = template
+        self._pattern = pattern
+        try:
+            self._regexp = re.compile(pattern.split(':')[1].strip())
+        except re.error as e:
+            raise Exception("Invalid RegEx Error : " + str(e))
+
+    def __deepcopy__(self, memo):
+        # Compiled regular expressions can not be copied. Validators are
+        # never modified, so copies of templates can share them.
+        return self
+
+    def validate(self, field):
+        if self._regexp.match(field.ascii):
+            return []
+        return ['Value of field %s does not match the RegEx %s!=%s' %
+                (field._get_recursive_name(),
+                 self._template._default_presentation_format(field.bytes),
+                 self._pattern)]
+
+
+class Expectations(object):
+    """Expected field values of a received message checked while the message
+    is decoded. Errors found are collected to `errors`."""
+
+    def __init__(self, message_fields, header_fields):
+        self.message_fields = message_fields
+        self.header_fields = header_fields
+        self.errors = []
+
+
+class ValidationFailed(Exception):
+
+    def __init__(self, errors):
+        Exception.__init__(self, errors[0])
+        self.errors = errors
+
+
+def raise_if_failed(errors):
+    if errors:
+        raise ValidationFailed(errors)
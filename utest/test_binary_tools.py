@@ -1,7 +1,8 @@
 from unittest import TestCase, main
 from Rammbock.binary_tools import to_bin, to_bin_of_length, to_hex, to_0xhex, \
     to_binary_string_of_length, to_tbcd_value, to_bin_str_from_int_string, \
-    to_tbcd_binary, to_twos_comp, from_twos_comp
+    to_tbcd_binary, to_twos_comp, from_twos_comp, bin_to_int, \
+    int_to_bin_of_length, with_tbcd_filler, tbcd_length, to_integer
 
 
 class TestBinaryConversions(TestCase):
@@ -53,6 +54,48 @@ class TestBinaryConversions(TestCase):
         self.assertEquals(to_bin_of_length(3, 256), '\x00\x01\x00')
         self.assertRaises(AssertionError, to_bin_of_length, 1, 256)
 
+    def test_bin_to_int(self):
+        self.assertEquals(bin_to_int(''), 0)
+        self.assertEquals(bin_to_int('\x00'), 0)
+        self.assertEquals(bin_to_int('\x01\x00'), 256)
+        self.assertEquals(bin_to_int('\xff' * 9), 2 ** 72 - 1)
+
+    def test_bin_to_int_odd_widths(self):
+        self.assertEquals(bin_to_int('\x01\x02\x03'), 0x010203)
+        self.assertEquals(bin_to_int('\x01\x02\x03\x04\x05'), 0x0102030405)
+        self.assertEquals(bin_to_int('\xff' * 7), 2 ** 56 - 1)
+
+    def test_bin_to_int_little_endian(self):
+        self.assertEquals(bin_to_int('\x01\x00', little_endian=True), 1)
+        self.assertEquals(bin_to_int('\x01\x02\x03', little_endian=True), 0x030201)
+        self.assertEquals(bin_to_int('\x01' + '\x00' * 8, little_endian=True), 1)
+
+    def test_int_to_bin_of_length(self):
+        self.assertEquals(int_to_bin_of_length(1, 0), '\x00')
+        self.assertEquals(int_to_bin_of_length(3, 256), '\x00\x01\x00')
+        self.assertEquals(int_to_bin_of_length(9, 2 ** 72 - 1), '\xff' * 9)
+        self.assertRaises(AssertionError, int_to_bin_of_length, 1, 256)
+        self.assertRaises(AssertionError, int_to_bin_of_length, 1, -1)
+
+    def test_int_to_bin_of_odd_length(self):
+        self.assertEquals(int_to_bin_of_length(3, 0x010203), '\x01\x02\x03')
+        self.assertEquals(int_to_bin_of_length(5, 1), '\x00\x00\x00\x00\x01')
+        self.assertRaises(AssertionError, int_to_bin_of_length, 3, 2 ** 24)
+
+    def test_int_to_bin_of_length_little_endian(self):
+        self.assertEquals(int_to_bin_of_length(2, 1, little_endian=True), '\x01\x00')
+        self.assertEquals(int_to_bin_of_length(3, 0x010203, little_endian=True), '\x03\x02\x01')
+        self.assertEquals(int_to_bin_of_length(9, 1, little_endian=True), '\x01' + '\x00' * 8)
+
+    def test_to_integer(self):
+        self.assertEquals(to_integer(42), 42)
+        self.assertEquals(to_integer('42'), 42)
+        self.assertEquals(to_integer('-42'), -42)
+        self.assertEquals(to_integer('0xcafe'), 0xcafe)
+        self.assertEquals(to_integer('0xca fe'), 0xcafe)
+        self.assertEquals(to_integer('0b1 0000'), 16)
+        self.assertEquals(to_integer(hex(2 ** 64)), 2 ** 64)
+
     def test_to_hex(self):
         self.assertEquals(to_hex('\x00'), '00')
         self.assertEquals(to_hex('\x00\x00'), '0000')
@@ -86,6 +129,26 @@ class TestBinaryConversions(TestCase):
         self.assertEquals(to_bin('0b0010000111110011'), to_tbcd_binary('123'))
         self.assertEquals(to_bin('0b0110001000010010000000100000000000000000000000000000000011110001'), to_tbcd_binary('262120000000001'))
 
+    def test_to_tbcd_binary_keeps_leading_zeros(self):
+        self.assertEquals('\x00\x21', to_tbcd_binary('0012'))
+        self.assertEquals('\x00\xf0', to_tbcd_binary('000'))
+
+    def test_to_tbcd_binary_with_illegal_value(self):
+        self.assertRaises(ValueError, to_tbcd_binary, '12a')
+
+    def test_to_tbcd_value_stops_at_filler(self):
+        self.assertEquals('123', to_tbcd_value(to_bin('0x21f3 6510')))
+
+    def test_with_tbcd_filler(self):
+        self.assertEquals(to_bin('0x21f3'), with_tbcd_filler(to_bin('0x2163')))
+        self.assertEquals('', with_tbcd_filler(''))
+
+    def test_tbcd_length(self):
+        self.assertEquals(0, tbcd_length(''))
+        self.assertEquals(1, tbcd_length(to_tbcd_binary('1')))
+        self.assertEquals(4, tbcd_length(to_tbcd_binary('1234')))
+        self.assertEquals(15, tbcd_length(to_tbcd_binary('262120000000001')))
+
     def test_to_bin_str_from_int_string(self):
         self.assertEquals('00000001', to_bin_str_from_int_string(8, '1'))
         self.assertEquals('00000010', to_bin_str_from_int_string(8, '2'))
@@ -45,7 +45,9 @@ class TestConditionParser(TestCase):
         self.condition('mycondition!=1 ', {'mycondition': 1}, False)
 
     def test_evaluate_unsupported_operator(self):
-        self.condition_exception('mycondition >= 1')
+        self.condition_exception('mycondition <> 1')
+        self.condition_exception('mycondition')
+        self.condition_exception('mycondition in ()')
         self.condition_exception('mycondition == foo')
         self.condition_exception('mycondition == ')
         self.condition_exception(' == 1')
@@ -68,7 +70,44 @@ class TestConditionParser(TestCase):
         self.condition('foo == 3 && bar != 1', values, False)
         self.condition('foo == 1 && bar == 0', values, False)
 
+    def test_evaluate_comparisons(self):
+        values = {'foo': 2}
+        self.condition('foo < 3', values, True)
+        self.condition('foo < 2', values, False)
+        self.condition('foo > 1', values, True)
+        self.condition('foo <= 2', values, True)
+        self.condition('foo >= 3', values, False)
+        self.condition('foo>=0x02', values, True)
+
+    def test_evaluate_bit_mask(self):
+        values = {'flags': '0x81'}
+        self.condition('flags & 0x80', values, True)
+        self.condition('flags & 0x02', values, False)
+        self.condition('flags & 0x0f == 1', values, True)
+        self.condition('flags & 0xf0 != 0x80', values, False)
+
+    def test_evaluate_set_membership(self):
+        values = {'foo': 2}
+        self.condition('foo in (1, 2, 5)', values, True)
+        self.condition('foo in (1,5)', values, False)
+        self.condition('foo & 0x0e in (0x02)', values, True)
+
+    def test_evaluation_is_short_circuited(self):
+        values = {'foo': 2}
+        self.condition('foo == 2 || bar == 1', values, True)
+        self.condition('foo == 1 && bar == 1', values, False)
+        self.condition_evaluate_exception('foo == 2 && bar == 1', values)
+
+    def test_evaluate_nested_field(self):
+        parent = create_message({'foo': 1})
+        parent['child'] = create_message({'bar': 3})
+        self.assertTrue(ConditionParser('child.bar == 3 && foo == 1').evaluate(parent))
+
     def test_evaluate_multiple_and_conditions(self):
         values = {'foo': 2, 'bar': 3}
         self.condition('foo == 2 && bar == 3 && foo == 2', values, True)
         self.condition('foo == 1 || bar == 2 || foo == 4', values, False)
+
+    def test_paths_of_referenced_fields(self):
+        self.assertEquals(ConditionParser('foo == 2 || pair.bar & 0x01').paths,
+                          [('foo',), ('pair', 'bar')])
@@ -0,0 +1,101 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main
+from Rammbock import Rammbock
+from Rammbock.binary_tools import to_0xhex, to_bin
+from Rammbock.definitions import DefinitionLoader
+
+
+PROTOCOL = {'name': 'Example',
+            'fields': [{'type': 'u8', 'name': 'msgId'},
+                       {'type': 'u8', 'name': 'length'},
+                       {'type': 'pdu', 'length': 'length-2'}]}
+
+
+class TestDefinitions(TestCase):
+
+    def setUp(self):
+        self.rammbock = Rammbock()
+
+    def _define(self, *messages):
+        DefinitionLoader(self.rammbock).define({'protocols': [PROTOCOL], 'messages': list(messages)})
+
+    def _encode(self, template, *parameters):
+        self.rammbock.load_template(template)
+        return to_0xhex(self.rammbock.get_message(*parameters)._raw)
+
+    def test_primitives(self):
+        self._define({'name': 'Request', 'protocol': 'Example', 'header': {'msgId': 5},
+                      'fields': [{'type': 'uint', 'length': 2, 'name': 'foo', 'value': 42},
+                                 {'type': 'i8', 'name': 'bar', 'value': -1},
+                                 {'type': 'chars', 'length': '*', 'name': 'text'}],
+                      'values': {'text': 'ab'}})
+        self.assertEquals(self._encode('Request'), '0x0507002aff6162')
+
+    def test_containers(self):
+        self._define({'name': 'Request', 'protocol': 'Example', 'header': {'msgId': 5}, 'template': 'request',
+                      'fields': [{'type': 'u8', 'name': 'count', 'value': 2},
+                                 {'type': 'array', 'size': 'count', 'name': 'items',
+                                  'field': {'type': 'u8', 'value': 1}},
+                                 {'type': 'struct', 'type_name': 'Pair', 'name': 'pair', 'values': {'first': 3},
+                                  'fields': [{'type': 'u8', 'name': 'first'},
+                                             {'type': 'u8', 'name': 'second', 'value': 4}]},
+                                 {'type': 'conditional', 'condition': 'count == 2', 'name': 'extra',
+                                  'fields': [{'type': 'u8', 'name': 'value', 'value': 5}]},
+                                 {'type': 'binary_container', 'name': 'flags',
+                                  'fields': [{'type': 'bin', 'size': 4, 'name': 'a', 'value': 1},
+                                             {'type': 'bin', 'size': 4, 'name': 'b', 'value': 2}]}]})
+        self.assertEquals(self._encode('request'), '0x050902010103040512')
+
+    def test_bag(self):
+        self._define({'name': 'Request', 'protocol': 'Example', 'header': {'msgId': 5},
+                      'fields': [{'type': 'bag', 'name': 'bag',
+                                  'cases': [{'size': '0-1', 'field': {'type': 'u8', 'name': 'foo', 'value': 42}},
+                                            {'size': '*', 'field': {'type': 'u8', 'name': 'bar'}}]}]})
+        self.rammbock.load_template('Request')
+        decoded = self.rammbock._get_message_template().decode(to_bin('0x01 2a 02'))
+        self.assertEquals(decoded.bag.foo[0].int, 42)
+        self.assertEquals(decoded.bag.bar[0].int, 1)
+        self.assertEquals(decoded.bag.bar[1].int, 2)
+
+    def test_tlv(self):
+        self._define({'name': 'Request', 'protocol': 'Example', 'header': {'msgId': 5},
+                      'fields': [{'type': 'tlv', 'name': 'options', 'tag': 1, 'length': 1,
+                                  'elements': [{'tag': 12, 'field': {'type': 'chars', 'length': '*',
+                                                                     'name': 'hostName', 'value': 'foo'}}]}]})
+        self.assertEquals(self._encode('Request'), '0x05070c05666f6f')
+
+    def test_shared_types(self):
+        DefinitionLoader(self.rammbock).define(
+            {'protocols': [PROTOCOL],
+             'types': [{'type': 'struct', 'type_name': 'Pair', 'values': {'first': 1},
+                        'fields': [{'type': 'u8', 'name': 'first'}, {'type': 'u8', 'name': 'second'}]}],
+             'messages': [{'name': 'Request', 'protocol': 'Example', 'header': {'msgId': 5},
+                           'fields': [{'type': 'use', 'type_name': 'Pair', 'name': 'one', 'values': {'second': 2}},
+                                      {'type': 'use', 'type_name': 'Pair', 'name': 'two', 'values': {'second': 3}}]}]})
+        self.assertEquals(self._encode('Request'), '0x050601020103')
+
+    def test_unknown_field_type(self):
+        self.assertRaises(AssertionError, self._define,
+                          {'name': 'Request', 'protocol': 'Example', 'header': {'msgId': 5},
+                           'fields': [{'type': 'float', 'name': 'foo'}]})
+
+    def test_load_json_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'definitions.json')
+            with open(path, 'w') as definitions:
+                json.dump({'protocols': [PROTOCOL],
+                           'messages': [{'name': 'Request', 'protocol': 'Example', 'header': {'msgId': 5},
+                                         'fields': [{'type': 'u16', 'name': 'foo', 'value': 1}]}]},
+                          definitions)
+            self.rammbock.load_definitions(path)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEquals(self._encode('Request'), '0x05040001')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,7 @@
 from unittest import TestCase, main
-from Rammbock.message import Struct, Field, BinaryContainer, BinaryField
+import copy
+from Rammbock.message import Struct, Field, BinaryContainer, BinaryField, \
+    List, Message, Header, NameIndex, Union, TLV
 from Rammbock.binary_tools import to_bin
 
 
@@ -34,6 +36,152 @@ class TestMessages(TestCase):
         self.assertEquals(field.chars, 'ab')
         self.assertEquals(field.bin, '0b00000000' + '01100001' + '01100010' + '00000000')
 
+    def test_children_keep_order(self):
+        msg = Struct('foo', 'foo_type')
+        msg['b'] = uint_field('0x01')
+        msg['a'] = uint_field('0x02')
+        msg['b'] = uint_field('0x03')
+        self.assertEquals(msg._fields.keys(), ['b', 'a'])
+        self.assertEquals(msg._raw, to_bin('0x0302'))
+
+    def test_delete_child(self):
+        msg = Struct('foo', 'foo_type')
+        msg['a'] = uint_field()
+        msg['b'] = uint_field()
+        del msg['a']
+        self.assertFalse('a' in msg)
+        self.assertTrue('b' in msg)
+        self.assertRaises(KeyError, msg.__getitem__, 'a')
+
+    def test_delete_last_list_item_keeps_shared_index(self):
+        lst = List('foo', 'uint')
+        lst.add(uint_field())
+        lst.add(uint_field())
+        index = lst._index
+        del lst[1]
+        self.assertTrue(lst._index is index)
+        self.assertFalse(1 in lst)
+        lst.add(uint_field('0x02'))
+        self.assertTrue(lst._index is index)
+        self.assertEquals(lst[1].hex, '0x02')
+
+    def test_tlv_adds_names_to_own_index(self):
+        tlv = TLV('foo')
+        tlv.add(1, 'a', uint_field())
+        index = tlv._index
+        tlv.add(2, 'b', uint_field())
+        del tlv['b']
+        tlv.add(3, 'c', uint_field())
+        self.assertTrue(tlv._index is index)
+        self.assertEquals(index.names, ['a', 'c'])
+        self.assertFalse('b' in tlv)
+        self.assertEquals(tlv.tags, [1, 3])
+        self.assertFalse(TLV('bar')._index is index)
+
+    def test_tlv_assignment_keeps_tag_index(self):
+        tlv = TLV('foo')
+        tlv.add(1, 'a', uint_field('0x01'))
+        tlv.add(2, 'b', uint_field('0x02'))
+        tlv['b'] = uint_field('0x03')
+        self.assertEquals(tlv[2].hex, '0x03')
+        tlv[1] = uint_field('0x04')
+        self.assertEquals(tlv.a.hex, '0x04')
+        self.assertEquals([value.hex for value in tlv.all(1)], ['0x04'])
+        self.assertEquals(tlv.tags, [1, 2])
+        self.assertRaises(KeyError, tlv.__setitem__, 'c', uint_field())
+
+    def test_shared_name_index(self):
+        index = NameIndex(['a', 'b'])
+        first = Struct('first', 'foo_type', index=index)
+        second = Struct('second', 'foo_type', index=index)
+        first['a'] = uint_field()
+        first['b'] = uint_field()
+        second['a'] = uint_field()
+        self.assertTrue(first._index is second._index)
+        self.assertTrue('b' in first)
+        self.assertFalse('b' in second)
+        second['c'] = uint_field()
+        self.assertEquals(second._fields.keys(), ['a', 'c'])
+        self.assertEquals(index.names, ['a', 'b'])
+
+    def test_list_items_with_integer_keys(self):
+        lst = List('foo', 'uint')
+        for _ in range(100):
+            lst.add(uint_field())
+        self.assertEquals(lst.len, 100)
+        self.assertTrue(lst[99] is lst['99'])
+        self.assertTrue(99 in lst)
+
+    def test_message_header_is_first(self):
+        index = NameIndex(['a'])
+        msg = Message('foo', index)
+        msg['a'] = uint_field('0x01')
+        header = Header('proto')
+        header['h'] = uint_field('0x02')
+        msg._add_header(header)
+        self.assertEquals(msg._fields.keys(), ['_header', 'a'])
+        self.assertTrue(msg._header is header)
+        self.assertEquals(msg._raw, to_bin('0x0201'))
+        self.assertEquals(index.names, ['a'])
+
+    def test_elements_have_no_instance_dict(self):
+        self.assertFalse(hasattr(Struct('foo', 'foo_type'), '__dict__'))
+        self.assertFalse(hasattr(uint_field(), '__dict__'))
+        self.assertFalse(hasattr(BinaryField(1, 'bit', 1), '__dict__'))
+
+    def test_deepcopy(self):
+        msg = Struct('foo', 'foo_type')
+        msg['a'] = uint_field('0x01')
+        copied = copy.deepcopy(msg)
+        self.assertEquals(copied.a.int, 1)
+        self.assertFalse(copied.a is msg.a)
+
+    def test_length_is_cached(self):
+        msg = Struct('foo', 'foo_type')
+        msg['a'] = uint_field('0x0001')
+        self.assertEquals(len(msg), 2)
+        self.assertEquals(msg._cached_length, 2)
+
+    def test_cached_length_is_invalidated_in_ancestors(self):
+        msg = Struct('foo', 'foo_type')
+        child = Struct('child', 'child_type')
+        grandchild = Struct('grandchild', 'child_type')
+        grandchild['a'] = uint_field('0x01')
+        child['grandchild'] = grandchild
+        msg['child'] = child
+        msg['b'] = uint_field('0x01')
+        self.assertEquals(len(msg), 2)
+        grandchild['c'] = uint_field('0x0001')
+        self.assertEquals(len(msg), 4)
+        del child['grandchild']
+        self.assertEquals(len(msg), 1)
+
+    def test_field_length_covers_value(self):
+        field = Field('chars', 'name', 'toolong', aligned_len=4)
+        self.assertEquals(len(field), len(field._raw))
+
+    def test_raw_of_nested_structs_with_alignment(self):
+        msg = Message('foo')
+        child = Struct('child', 'child_type', align=8)
+        child['a'] = uint_field('0x01')
+        child['b'] = Field('uint', 'b', to_bin('0x0102'), aligned_len=3)
+        msg['child'] = child
+        msg['c'] = uint_field('0xff')
+        self.assertEquals(msg._raw, to_bin('0x0101 0200 0000 0000 ff'))
+        self.assertEquals(len(msg._raw), len(msg))
+
+    def test_raw_of_union_is_longest_alternative(self):
+        union = Union('foo', 4)
+        union['short'] = uint_field('0x01')
+        union['long'] = uint_field('0x010203')
+        self.assertEquals(union._raw, to_bin('0x0102 0300'))
+
+    def test_raw_of_union_with_too_long_alternative(self):
+        union = Union('foo', 1)
+        union['long'] = uint_field('0x0102')
+        self.assertEquals(len(union), 2)
+        self.assertEquals(union._raw, to_bin('0x0102'))
+
     def test_not_iterable(self):
         msg = Struct('foo', 'foo_type')
         msg['a'] = uint_field()
@@ -76,6 +224,13 @@ class TestBinaryContainer(TestCase):
         self.assertEquals(little.seven.bin, '0b0101010')
         self.assertEquals(little._raw, to_bin('0b0010 1010 1011 0101'))
 
+    def test_binary_field_from_integer(self):
+        field = BinaryField(12, 'twelve', 42)
+        self.assertEquals(field.int, 42)
+        self.assertEquals(field.bytes, to_bin(42))
+        self.assertEquals(field.bin, '0b000000101010')
+        self.assertEquals(len(field), 2)
+
     def test_pretty_print_container(self):
         expected = '''BinaryContainer foo
   three = 0b101 (0x05)
@@ -4,7 +4,8 @@ import time
 import socket
 from threading import Timer, Semaphore
 from Rammbock.networking import UDPServer, TCPServer, UDPClient, TCPClient, BufferedStream
-from Rammbock.templates.containers import Protocol
+from Rammbock.templates.containers import Protocol, MessageTemplate
+from Rammbock.templates.message_stream import Framer
 from Rammbock.templates.primitives import UInt, PDU
 from Rammbock import synchronization
 
@@ -200,6 +201,29 @@ class TestNetworking(_NetworkingTests):
         self._verify_emptying(server, client)
 
 
+class TestNativeMessages(_NetworkingTests):
+
+    def setUp(self):
+        _NetworkingTests.setUp(self)
+        protocol = _get_template()
+        self.template = MessageTemplate('Request', protocol, {'id': '5'})
+        self.template.add(UInt(2, 'value', None))
+        self.server = TCPServer(LOCAL_IP, ports['SERVER_PORT'], timeout=0.5, protocol=protocol)
+        self.client = TCPClient(timeout=0.5, protocol=protocol)
+        self.client.connect_to(LOCAL_IP, ports['SERVER_PORT'])
+        self.server.accept_connection()
+        self.sockets.extend([self.server, self.client])
+
+    def test_send_and_receive_message(self):
+        self.client.send_message(self.template, {'value': 258})
+        msg = self.server.receive_message(self.template, expect={'value': 258}, expect_header={'id': 5})
+        self.assertEquals(msg.value.hex, '0x0102')
+
+    def test_receive_validates_message(self):
+        self.server.send_message(self.template, {'value': 1})
+        self.assertRaises(AssertionError, self.client.receive_message, self.template, expect={'value': 2})
+
+
 class TestGetEndPoints(_NetworkingTests):
 
     def test_get_udp_endpoints(self):
@@ -235,23 +259,49 @@ class TestBufferedStream(TestCase):
     def setUp(self):
         self._buffered_stream = BufferedStream(MockConnection(self.DATA), 0.1)
 
-    def test_normal_read(self):
-        self.assertEquals(self.DATA, self._buffered_stream.read(len(self.DATA)))
+    def test_receive_to_buffer(self):
+        self.assertTrue(self._buffered_stream._receive(0.1))
+        self.assertEquals(self._buffered_stream.buffered, self.DATA)
+
+    def test_consume(self):
+        self._buffered_stream._receive(0.1)
+        self._buffered_stream.consume(len('foobar'))
+        self.assertEquals(self._buffered_stream.buffered, 'diibadaa')
 
     def test_empty(self):
-        self._buffered_stream.read(len('foobar'))
+        self._buffered_stream._receive(0.1)
         self._buffered_stream.empty()
-        self.assertRaises(AssertionError, self._buffered_stream.read, len(self.DATA) - len('foobar'))
+        self.assertEquals(self._buffered_stream.buffered, '')
+
+
+class TestReadFrame(TestCase):
 
-    def test_read_all(self):
-        data = self._buffered_stream.read(-1)
-        self.assertEquals(data, self.DATA)
+    def _stream(self, *chunks):
+        return BufferedStream(ChunkedConnection(chunks), 0.1)
 
-    def test_read_and_return(self):
-        self._buffered_stream.read(-1)
-        self._buffered_stream.return_data('badaa')
-        data = self._buffered_stream.read(-1)
-        self.assertEquals(data, 'badaa')
+    def test_message_received_in_chunks(self):
+        stream = self._stream('\xff\x00', '\x04\xca', '\xfe\xaa')
+        header, pdu = stream.read_frame(Framer(_get_template()))
+        self.assertEquals(header.id.int, 255)
+        self.assertEquals(pdu, '\xca\xfe')
+        self.assertEquals(stream.buffered, '\xaa')
+
+    def test_incomplete_message_is_not_consumed(self):
+        stream = self._stream('\xff\x00\x04\xca')
+        framer = Framer(_get_template())
+        self.assertEquals(stream.read_frame(framer, timeout=0.01), None)
+        self.assertEquals(stream.buffered, '\xff\x00\x04\xca')
+
+
+class ChunkedConnection(object):
+
+    def __init__(self, chunks):
+        self._chunks = list(chunks)
+
+    def receive(self, timeout):
+        if not self._chunks:
+            raise socket.timeout('timed out')
+        return self._chunks.pop(0)
 
 
 class MockConnection(object):
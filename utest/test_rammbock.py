@@ -1,5 +1,9 @@
+import os
+import shutil
+import tempfile
 from unittest import TestCase, main
-from Rammbock import Rammbock
+from Rammbock import Rammbock, core
+from Rammbock.binary_tools import to_0xhex, to_bin
 
 
 class TestParamParsing(TestCase):
@@ -27,6 +31,303 @@ class TestParamParsing(TestCase):
         self.assertEquals(pdus['header'], 'poo')
 
 
+class _ProtocolTestCase(TestCase):
+    """Creates `self.rammbock` with protocol `TestProtocol`. Its header has
+    uint fields given as `(length, name, default)` in `header`, and the PDU
+    follows them."""
+
+    header = [(2, 'length', None)]
+
+    def setUp(self):
+        self.rammbock = Rammbock()
+        self.rammbock.new_protocol('TestProtocol')
+        for length, name, default in self.header:
+            self.rammbock.uint(length, name, default)
+        self.rammbock.pdu('length-%d' % sum(length for length, _, _ in self.header))
+        self.rammbock.end_protocol()
+
+
+class TestLoadCopyOfTemplate(_ProtocolTestCase):
+
+    header = [(2, 'msgId', 5), (2, 'length', None)]
+
+    def setUp(self):
+        _ProtocolTestCase.setUp(self)
+        self.rammbock.new_message('FooRequest', 'TestProtocol')
+        self.rammbock.uint(2, 'foo', None)
+        self.rammbock.value('foo', '42')
+        self.rammbock.save_template('foo', unlocked=True)
+
+    def test_copy_records_only_changed_values(self):
+        self.rammbock.load_copy_of_template('foo')
+        self.assertEquals(self.rammbock.get_message('foo:43').foo.int, 43)
+        self.assertEquals(self.rammbock._field_values._values, {'foo': '43'})
+        self.rammbock.load_template('foo')
+        self.assertEquals(self.rammbock.get_message().foo.int, 42)
+
+    def test_fields_added_to_copy_are_not_added_to_saved_template(self):
+        self.rammbock.load_copy_of_template('foo')
+        self.rammbock.uint(1, 'bar', 1)
+        self.assertEquals(len(self.rammbock.get_message()), 7)
+        self.rammbock.load_template('foo')
+        self.assertEquals(len(self.rammbock.get_message()), 6)
+
+
+class TestGetTemplate(_ProtocolTestCase):
+
+    def setUp(self):
+        _ProtocolTestCase.setUp(self)
+        self.rammbock.new_message('FooRequest', 'TestProtocol')
+        self.rammbock.uint(1, 'foo', None)
+        self.rammbock.uint(1, 'bar', None)
+        self.rammbock.value('foo', '42')
+        self.rammbock.save_template('foo')
+
+    def test_template_uses_saved_values(self):
+        template = self.rammbock.get_template('foo')
+        self.assertEquals(to_0xhex(template.encode({'bar': 1})._raw), '0x00042a01')
+        self.assertEquals(template.validate(template.encode({'bar': 1}), {'bar': 1}), [])
+
+    def test_unknown_template(self):
+        self.assertRaises(AssertionError, self.rammbock.get_template, 'bar')
+
+
+class TestTypes(_ProtocolTestCase):
+
+    def setUp(self):
+        _ProtocolTestCase.setUp(self)
+        self.rammbock.new_struct_type('Header', 'code:1')
+        self.rammbock.u8('code')
+        self.rammbock.u8('length')
+        self.rammbock.chars('length-2', 'data')
+        self.rammbock.end_struct_type()
+
+    def test_type_is_shared_by_templates(self):
+        for name in ('foo', 'bar'):
+            self.rammbock.new_message(name, 'TestProtocol')
+            self.rammbock.use_type('Header', 'header', 'data:ab')
+            self.rammbock.save_template(name)
+        foo = self.rammbock._message_templates['foo'][0]._fields['header']
+        bar = self.rammbock._message_templates['bar'][0]._fields['header']
+        self.assertTrue(foo._fields is bar._fields)
+        self.rammbock.load_template('bar')
+        self.assertEquals(to_0xhex(self.rammbock.get_message('header.code:2')._raw), '0x000602046162')
+
+    def test_union_and_bag_types(self):
+        self.rammbock.new_union_type('IntOrChars')
+        self.rammbock.u16('int')
+        self.rammbock.chars(2, 'chars')
+        self.rammbock.end_union_type()
+        self.rammbock.start_bag_type('Options')
+        self.rammbock._start_bag_case('0-1')
+        self.rammbock.use_type('Header', 'header')
+        self.rammbock._end_bag_case()
+        self.rammbock.end_bag_type()
+        self.rammbock.new_message('foo', 'TestProtocol')
+        self.rammbock.use_type('IntOrChars', 'value')
+        self.rammbock.use_type('Options', 'options')
+        decoded = self.rammbock._get_message_template().decode(to_bin('0x0001 01046162'))
+        self.assertEquals(decoded.value.int.int, 1)
+        self.assertEquals(decoded.options.header[0].data.ascii, 'ab')
+
+    def test_undefined_type(self):
+        self.rammbock.new_message('foo', 'TestProtocol')
+        self.assertRaises(AssertionError, self.rammbock.use_type, 'Foo', 'foo')
+
+    def test_duplicate_type(self):
+        self.assertRaises(Exception, self.rammbock.new_struct_type, 'Header')
+
+
+class TestEncodedMessageCache(_ProtocolTestCase):
+
+    header = [(1, 'length', None)]
+
+    def setUp(self):
+        _ProtocolTestCase.setUp(self)
+        self.rammbock.new_message('FooRequest', 'TestProtocol')
+        self.rammbock.uint(1, 'foo', None)
+        self.sent = []
+
+    def _send(self, *parameters):
+        self.rammbock._send_message(self._callback, parameters)
+        return to_0xhex(self.sent[-1])
+
+    def _callback(self, raw, label=None):
+        self.sent.append(raw)
+
+    def test_identical_sends_are_encoded_once(self):
+        self.assertEquals(self._send('foo:1'), '0x0201')
+        self.assertEquals(self._send('foo:1'), '0x0201')
+        self.assertEquals(self._send('foo:2'), '0x0202')
+        self.assertEquals(self.rammbock.get_encoded_message_cache_statistics(),
+                          {'hits': 1, 'misses': 2, 'size': 2})
+
+    def test_fields_added_after_send_are_encoded(self):
+        self._send('foo:1')
+        self.rammbock.uint(1, 'bar', 3)
+        self.assertEquals(self._send('foo:1'), '0x030103')
+
+    def test_least_recently_used_message_is_dropped(self):
+        self.rammbock.set_encoded_message_cache_size(2)
+        for value in ('1', '2', '1', '3', '1', '2'):
+            self._send('foo:' + value)
+        self.assertEquals(self.rammbock.get_encoded_message_cache_statistics(),
+                          {'hits': 2, 'misses': 4, 'size': 2})
+
+    def test_cache_can_be_disabled(self):
+        self.rammbock.set_encoded_message_cache_size(0)
+        self._send('foo:1')
+        self._send('foo:1')
+        self.assertEquals(self.rammbock.get_encoded_message_cache_statistics(),
+                          {'hits': 0, 'misses': 0, 'size': 0})
+
+
+class TestPreparedMessage(_ProtocolTestCase):
+
+    header = [(1, 'length', None), (1, 'seq', None)]
+
+    def setUp(self):
+        _ProtocolTestCase.setUp(self)
+        self.rammbock.new_message('FooRequest', 'TestProtocol')
+        self.rammbock.chars('*', 'text', 'abc')
+        self.rammbock.new_struct('Pair', 'pair')
+        self.rammbock.uint(1, 'first', 1)
+        self.rammbock.uint(2, 'second', 2)
+        self.rammbock.end_struct()
+        self.sent = []
+
+    def _send(self, prepared, *parameters):
+        self.rammbock._send_prepared_message(self._callback, prepared, parameters)
+        return to_0xhex(self.sent[-1])
+
+    def _callback(self, raw, label=None, name=None):
+        self.sent.append(raw)
+
+    def test_send_with_variable_values(self):
+        prepared = self.rammbock.prepare_message('header:seq:7', 'variables=pair.second, header:seq')
+        self.assertEquals(self._send(prepared), '0x0807616263010002')
+        self.assertEquals(self._send(prepared, 'pair.second:0x0102', 'header:seq:8'), '0x0808616263010102')
+
+    def test_increment(self):
+        prepared = self.rammbock.prepare_message('header:seq:0xfe', 'increment=header:seq')
+        self.assertEquals([self._send(prepared)[4:6] for _ in range(3)], ['fe', 'ff', '00'])
+
+    def test_generator(self):
+        prepared = self.rammbock.prepare_message('header:seq:0')
+        values = iter(['5', '6'])
+        prepared.variable('pair.first', values.next)
+        self.assertEquals(self._send(prepared), '0x0800616263050002')
+        self.assertEquals(self._send(prepared), '0x0800616263060002')
+
+    def test_configs_are_used_in_every_send(self):
+        prepared = self.rammbock.prepare_message('header:seq:0', 'name=Client1')
+        self.assertEquals(prepared.configs, {'name': 'Client1'})
+
+    def test_other_fields_encode_message_again(self):
+        prepared = self.rammbock.prepare_message('header:seq:0', 'increment=header:seq')
+        self.assertEquals(self._send(prepared, 'text:abcd'), '0x090061626364010002')
+        self.assertEquals(self._send(prepared), '0x0801616263010002')
+
+    def test_prepared_expectation(self):
+        self.rammbock.value('text', 'abcd')
+        expected = self.rammbock.prepare_expectation('pair.first:1', 'header:seq:2', 'timeout=5')
+        self.rammbock.value('text', 'other')
+        self.assertEquals(expected.message_fields, {'text': 'abcd', 'pair.first': '1'})
+        self.assertEquals(expected.header_fields, {'seq': '2'})
+        self.assertEquals(expected.configs, {'timeout': '5'})
+
+    def test_value_must_fit_in_field(self):
+        self.rammbock.chars(2, 'code', 'ab')
+        prepared = self.rammbock.prepare_message('header:seq:0', 'variables=code')
+        self.assertRaises(AssertionError, self._send, prepared, 'code:abc')
+
+    def test_fields_with_dynamic_length_are_not_variable(self):
+        self.assertRaises(AssertionError, self.rammbock.prepare_message,
+                          'header:seq:0', 'variables=text')
+        self.assertRaises(AssertionError, self.rammbock.prepare_message,
+                          'header:seq:0', 'variables=header:length')
+
+    def test_fields_in_conditions_are_not_variable(self):
+        self.rammbock.uint(1, 'flag', '0')
+        self.rammbock.conditional('flag == 1', 'opt')
+        self.rammbock.uint(1, 'x', '5')
+        self.rammbock.end_conditional()
+        self.assertRaises(AssertionError, self.rammbock.prepare_message,
+                          'header:seq:0', 'variables=flag')
+
+
+class TestTemplateCache(_ProtocolTestCase):
+
+    header = [(2, 'msgId', 5), (2, 'length', None)]
+
+    def setUp(self):
+        _ProtocolTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+        self.cache = os.path.join(self.directory, 'templates.cache')
+        self.source = os.path.join(self.directory, 'protocols.robot')
+        self._write_source('definitions')
+        self.rammbock.new_message('FooRequest', 'TestProtocol')
+        self.rammbock.u8('flags', 1)
+        self.rammbock.u8('count', None)
+        self.rammbock._new_list('count', 'items')
+        self.rammbock.u8('')
+        self.rammbock._end_list()
+        self.rammbock.conditional('flags == 1', 'extra')
+        self.rammbock.u16('value', 7)
+        self.rammbock.end_conditional()
+        self.rammbock.value('items[0]', '3')
+        self.rammbock.value('count', '1')
+        self.rammbock.save_template('foo')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write_source(self, content):
+        with open(self.source, 'w') as source:
+            source.write(content)
+
+    def test_templates_are_loaded_from_cache(self):
+        self.rammbock.save_templates_to_cache(self.cache, self.source)
+        expected = self.rammbock.get_message()._raw
+        loaded = Rammbock()
+        self.assertTrue(loaded.load_templates_from_cache(self.cache, self.source))
+        self.assertTrue(loaded._protocols['TestProtocol'].library is loaded)
+        loaded.load_template('foo')
+        self.assertEquals(loaded.get_message()._raw, expected)
+        loaded.load_template('foo')
+        self.assertEquals(loaded.get_message('flags:0').extra.exists, False)
+
+    def test_changed_sources_are_not_loaded(self):
+        self.rammbock.save_templates_to_cache(self.cache, self.source)
+        self._write_source('changed definitions')
+        loaded = Rammbock()
+        self.assertFalse(loaded.load_templates_from_cache(self.cache, self.source))
+        self.assertEquals(loaded._message_templates, {})
+
+    def test_cache_of_other_library_sources_is_not_loaded(self):
+        self.rammbock.save_templates_to_cache(self.cache, self.source)
+        original, core._library_digest_value = core._library_digest(), 'other'
+        try:
+            self.assertFalse(Rammbock().load_templates_from_cache(self.cache, self.source))
+        finally:
+            core._library_digest_value = original
+
+    def test_missing_cache_is_not_loaded(self):
+        self.assertFalse(self.rammbock.load_templates_from_cache(self.cache, self.source))
+
+    def test_failed_save_removes_temporary_file(self):
+        self.assertRaises(IOError, self.rammbock.save_templates_to_cache,
+                          self.cache, os.path.join(self.directory, 'missing.robot'))
+        self.assertEquals(os.listdir(self.directory), ['protocols.robot'])
+
+    def test_existing_cache_is_replaced(self):
+        self.rammbock.save_templates_to_cache(self.cache)
+        self.rammbock.save_templates_to_cache(self.cache, self.source)
+        self.assertFalse(Rammbock().load_templates_from_cache(self.cache))
+        self.assertTrue(Rammbock().load_templates_from_cache(self.cache, self.source))
+        self.assertEquals(sorted(os.listdir(self.directory)), ['protocols.robot', 'templates.cache'])
+
+
 LOCAL_IP = '127.0.0.1'
 
 ports = {'SERVER_PORT': 12345,
@@ -1,5 +1,7 @@
 from unittest import TestCase
-from Rammbock.templates.primitives import BagSize
+from Rammbock.templates.containers import BagTemplate, CaseTemplate, StructTemplate
+from Rammbock.templates.primitives import BagSize, UInt
+from Rammbock.binary_tools import to_bin
 import sys
 
 
@@ -31,3 +33,53 @@ class TestBagSize(TestCase):
         s = BagSize(pattern)
         self.assertEquals(s.min, min)
         self.assertEquals(s.max, max)
+
+
+class TestBagDecoding(TestCase):
+
+    def setUp(self):
+        self.bag = BagTemplate('intBag', None)
+        self._add_case('0-1', UInt(1, 'foo', 42))
+        self._add_case('0-2', UInt(1, 'bar', 1))
+        self._add_case('0-1', UInt(4, 'dar', '0'))
+        struct = StructTemplate('FooType', 'any', None)
+        struct.add(UInt(1, 'first', None))
+        struct.add(UInt(1, 'second', 55))
+        self._add_case('*', struct)
+        self.bag.build_index()
+
+    def _add_case(self, size, field):
+        case = CaseTemplate(size, self.bag)
+        case.add(field)
+        self.bag.add(case)
+
+    def _candidates(self, data, little_endian=False):
+        return [case.name for case in self.bag._case_index.candidates(to_bin(data), little_endian)]
+
+    def test_cases_are_indexed_by_leading_value(self):
+        self.assertEquals(self._candidates('0x2a37'), ['foo', 'any'])
+        self.assertEquals(self._candidates('0x0137'), ['bar', 'any'])
+        self.assertEquals(self._candidates('0x00000000'), ['dar', 'any'])
+        self.assertEquals(self._candidates('0x1037'), ['any'])
+
+    def test_little_endian_values_are_indexed(self):
+        self.assertEquals(self._candidates('0x00000000', little_endian=True), ['dar', 'any'])
+
+    def test_index_keeps_case_order(self):
+        bag = BagTemplate('bag', None)
+        for name in ('second', 'first'):
+            case = CaseTemplate('*', bag)
+            case.add(UInt(1, name, 1))
+            bag.add(case)
+        bag.build_index()
+        self.assertEquals([case.name for case in bag._case_index.candidates('\x01')], ['second', 'first'])
+
+    def test_decode_bag(self):
+        bag = self.bag.decode(to_bin('0x01 2a 00000000 10 37 01'))
+        self.assertEquals(bag.bar.len, 2)
+        self.assertEquals(bag.foo[0].int, 42)
+        self.assertEquals(bag.dar.len, 1)
+        self.assertEquals(bag.any[0].first.int, 16)
+
+    def test_unmatched_value_fails(self):
+        self.assertRaises(AssertionError, self.bag.decode, to_bin('0x10 10'))
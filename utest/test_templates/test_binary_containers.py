@@ -51,6 +51,18 @@ class TestBinaryContainerTemplate(TestCase):
         self.assertEqual(1, encoded.twelveBits.int)
         self.assertEquals(encoded._raw, to_bin("0x0190"))
 
+    def test_decode_little_endian_container_followed_by_data(self):
+        container = self._2_byte_container()
+        decoded = container.decode(to_bin("0x0190 cafe"), little_endian=True)
+        self.assertEqual(1, decoded.oneBit.int)
+        self.assertEqual(1, decoded.threeBits.int)
+        self.assertEqual(1, decoded.twelveBits.int)
+
+    def test_encode_too_long_value_fails(self):
+        container = self._1_byte_container()
+        encoded = container.encode({'foo.spare': 0, 'foo.value': 16})
+        self.assertRaises(AssertionError, encoded._get_raw_bytes)
+
     def test_decode_longer_data_than_field(self):
         container = self._1_byte_container()
         decoded = container.decode(to_bin("0b0000 0001 1111 1111"))
@@ -31,6 +31,15 @@ class TestConditional(TestCase):
         decoded = cond.decode(to_bin('0x00004242'))
         self.assertEquals(decoded.mycondition.exists, False)
 
+    def test_condition_is_evaluated_once_per_decode(self):
+        cond = self._get_conditional()
+        condition = cond._fields['mycondition'].condition
+        evaluations = []
+        evaluate = condition.evaluate
+        condition.evaluate = lambda fields: evaluations.append(1) or evaluate(fields)
+        cond.decode(to_bin('0x0001 000a 0043'))
+        self.assertEquals(len(evaluations), 1)
+
     def test_conditional_decode_has_element(self):
         cond = self._get_conditional()
         decoded = cond.decode(to_bin('0x0001 000a 0043'))
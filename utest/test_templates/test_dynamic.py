@@ -53,6 +53,30 @@ class TestDynamicMessageTemplate(TestCase):
         self.assertEquals(encoded.chars.ascii, 'abcd')
         self.assertEquals(encoded.len.int, 4)
 
+    def test_length_is_patched_into_reserved_slot(self):
+        tmp = MessageTemplate('Dymagic', self._protocol, {})
+        tmp.add(UInt(2, 'len', None))
+        tmp.add(Char('len', 'chars', 'abc'))
+        encoded = tmp.encode({}, {})
+        self.assertEquals(encoded._raw, to_bin('0x0005 0009 0003 616263'))
+        self.assertEquals(encoded._header.length.int, 9)
+
+    def test_little_endian_length_is_patched(self):
+        tmp = MessageTemplate('Dymagic', self._protocol, {})
+        tmp.add(UInt(2, 'len', None))
+        tmp.add(Char('len', 'chars', 'abc'))
+        encoded = tmp.encode({}, {}, little_endian=True)
+        self.assertEquals(encoded.len._raw, to_bin('0x0300'))
+        self.assertEquals(encoded.len.int, 3)
+
+    def test_unpatched_length_is_not_sent(self):
+        tmp = MessageTemplate('Dymagic', self._protocol, {})
+        tmp.add(UInt(2, 'len', None))
+        lst = ListTemplate('len', 'foo', parent=None)
+        lst.add(UInt(1, 'bar', 1))
+        tmp.add(lst)
+        self.assertRaises(AssertionError, tmp.encode, {}, {})
+
     def test_decode_dynamic_list(self):
         tmp = MessageTemplate('Dymagic', self._protocol, {})
         tmp.add(UInt(2, 'len', None))
@@ -83,3 +107,32 @@ class TestDynamicMessageTemplate(TestCase):
         tmp.add(UInt(2, 'len', None))
         str = StructTemplate('FooType', 'foo', tmp)
         self.assertRaises(AssertionError, str.add, Char('notfound', "bar"))
+
+    def test_length_reference_is_resolved_when_added(self):
+        tmp = MessageTemplate('Dymagic', self._protocol, {})
+        tmp.add(UInt(1, 'first', None))
+        tmp.add(UInt(2, 'len', None))
+        struct = StructTemplate('FooType', 'foo', tmp)
+        field = Char('len', 'bar', None)
+        struct.add(field)
+        self.assertEquals((field.length._depth, field.length._slots), (1, (('len', 1),)))
+
+    def test_resolved_reference_in_parent_struct(self):
+        tmp = MessageTemplate('Dymagic', self._protocol, {})
+        tmp.add(UInt(1, 'len', None))
+        struct = StructTemplate('FooType', 'foo', tmp)
+        struct.add(UInt(1, 'other', None))
+        struct.add(Char('len', 'bar', None))
+        tmp.add(struct)
+        decoded = tmp.decode(to_bin('0x 02 ff 6162'))
+        self.assertEquals(decoded.foo.bar.ascii, 'ab')
+        encoded = tmp.encode({'foo.other': '1', 'foo.bar': 'xyz'}, {})
+        self.assertEquals(encoded.len.int, 3)
+
+    def test_reference_is_searched_when_positions_differ(self):
+        tmp = MessageTemplate('Dymagic', self._protocol, {})
+        tmp.add(UInt(1, 'len', None))
+        tmp.add(Char('len', 'chars', None))
+        decoded = tmp.decode(to_bin('0x 02 6162'))
+        decoded._add_header(self._protocol.encode(decoded, {}))
+        self.assertEquals(tmp.validate(decoded, {'chars': 'ab'}, {}), [])
@@ -22,6 +22,15 @@ class TestLittleEndian(TestCase):
         self.assertEquals(encoded.second.hex, '0x0002')
         self.assertEquals(encoded.second._raw, to_bin('0x0200'))
 
+    def test_little_endian_odd_width_encode_and_decode(self):
+        field = UInt(3, 'field', '0x010203')
+        encoded = field.encode({}, None, little_endian=True)
+        self.assertEquals(encoded._raw, to_bin('0x030201'))
+        self.assertEquals(encoded.int, 0x010203)
+        decoded = field.decode(to_bin('0x030201'), None, little_endian=True)
+        self.assertEquals(decoded.int, 0x010203)
+        self.assertEquals(decoded.hex, '0x010203')
+
     def test_little_endian_list_encode(self):
         struct_list = get_struct_list()
         encoded = struct_list.encode({}, None, little_endian=True)
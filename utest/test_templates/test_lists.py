@@ -43,23 +43,17 @@ class TestListTemplate(TestCase):
     def test_parse_params(self):
         list = get_list_of_three()
         params = list._get_params_sub_tree({'topthree[0]': 1, 'foo': 2, 'topthree[4][0]': 4})
-        self.assertEquals(params['0'], 1)
-        self.assertEquals(params['4[0]'], 4)
-        self.assertEquals(len(params), 2)
+        self.assertEquals(dict(params.unused()), {'0': 1, '4.0': 4})
 
     def test_parse_params_with_dot(self):
         list = get_list_of_three()
         params = list._get_params_sub_tree({'topthree.0': 1, 'foo': 2, 'topthree.4.0': 4})
-        self.assertEquals(params['0'], 1)
-        self.assertEquals(params['4.0'], 4)
-        self.assertEquals(len(params), 2)
+        self.assertEquals(dict(params.unused()), {'0': 1, '4.0': 4})
 
     def test_parse_params_with_dots_and_brackets(self):
         list = get_list_of_three()
         params = list._get_params_sub_tree({'topthree.0': 1, 'foo': 2, 'topthree.4[0]': 4})
-        self.assertEquals(params['0'], 1)
-        self.assertEquals(params['4[0]'], 4)
-        self.assertEquals(len(params), 2)
+        self.assertEquals(dict(params.unused()), {'0': 1, '4.0': 4})
 
     def test_set_list_values_with_defaults(self):
         pair_of_lists = get_struct_with_two_lists()
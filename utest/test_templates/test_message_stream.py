@@ -1,8 +1,9 @@
 from unittest import TestCase, main
 from .tools import MockStream
 import socket
-from Rammbock.templates.message_stream import MessageStream
-from Rammbock.templates import Protocol, MessageTemplate, UInt, PDU
+from Rammbock.templates.message_stream import MessageStream, Framer
+from Rammbock.templates.validators import Expectations
+from Rammbock.templates import Protocol, MessageTemplate, UInt, PDU, Char
 from Rammbock.binary_tools import to_bin
 
 
@@ -16,11 +17,113 @@ class TestProtocolMessageReceiving(TestCase):
 
     def test_read_header_and_pdu(self):
         stream = MockStream(to_bin('0xff0004cafe'))
-        header, data = self._protocol.read(stream)
+        header, data = Framer(self._protocol).next(stream)
         self.assertEquals(header.id.hex, '0xff')
         self.assertEquals(data, '\xca\xfe')
 
 
+class TestFramer(TestCase):
+
+    def setUp(self):
+        self._protocol = Protocol('Test')
+        self._protocol.add(UInt(1, 'id', 1))
+        self._protocol.add(UInt(2, 'length', None))
+        self._protocol.add(PDU('length-2'))
+        self._stream = MockStream('')
+        self._framer = Framer(self._protocol)
+
+    def _receive(self, hex):
+        self._stream.data += to_bin(hex)
+        return self._framer.next(self._stream)
+
+    def test_incomplete_header(self):
+        self.assertEquals(self._receive('0xff00'), None)
+        self.assertEquals(self._stream.data, to_bin('0xff00'))
+
+    def test_header_is_decoded_once_while_awaiting_body(self):
+        self.assertEquals(self._receive('0xff0004ca'), None)
+        header = self._framer._header
+        self.assertEquals(self._framer._body_length, 2)
+        self.assertEquals(self._stream.data, to_bin('0xff0004ca'))
+        received, pdu = self._receive('0xfe dd')
+        self.assertTrue(received is header)
+        self.assertEquals(pdu, '\xca\xfe')
+        self.assertEquals(self._stream.data, '\xdd')
+        self.assertEquals(self._framer._header, None)
+
+    def test_dynamic_header_length(self):
+        protocol = Protocol('Dynamic')
+        protocol.add(UInt(1, 'nameLength', None))
+        protocol.add(Char('nameLength', 'name', None))
+        protocol.add(UInt(1, 'length', None))
+        protocol.add(PDU('length'))
+        self._framer = Framer(protocol)
+        self.assertEquals(self._receive('0x03 666f'), None)
+        self.assertEquals(self._receive('0x6f'), None)
+        header, pdu = self._receive('0x01 ff')
+        self.assertEquals(header.name.ascii, 'foo')
+        self.assertEquals(pdu, '\xff')
+
+    def test_terminated_header_field(self):
+        protocol = Protocol('Terminated')
+        protocol.add(Char('*', 'name', None, terminator='0x00'))
+        protocol.add(UInt(1, 'length', None))
+        protocol.add(PDU('length'))
+        self._framer = Framer(protocol)
+        self.assertEquals(self._receive('0x666f'), None)
+        header, pdu = self._receive('0x6f00 01 ff')
+        self.assertEquals(header.name.ascii, 'foo')
+        self.assertEquals(pdu, '\xff')
+
+    def test_protocol_without_pdu(self):
+        protocol = Protocol('HeaderOnly')
+        protocol.add(UInt(1, 'id', None))
+        self._framer = Framer(protocol)
+        header, pdu = self._receive('0x01 02')
+        self.assertEquals(header.id.int, 1)
+        self.assertEquals(pdu, None)
+        self.assertEquals(self._stream.data, '\x02')
+
+
+class TestTerminatorFraming(TestCase):
+
+    def setUp(self):
+        self._protocol = Protocol('Lines', terminator='0x0d0a')
+        self._protocol.add(Char(4, 'command', None))
+        self._protocol.add(PDU('*'))
+        self._stream = MockStream('')
+        self._framer = Framer(self._protocol)
+
+    def _receive(self, data):
+        self._stream.data += data
+        return self._framer.next(self._stream)
+
+    def test_frames_are_split_at_terminator(self):
+        header, pdu = self._receive('USER foo\r\nQUIT\r\n')
+        self.assertEquals(header.command.ascii, 'USER')
+        self.assertEquals(pdu, ' foo')
+        header, pdu = self._framer.next(self._stream)
+        self.assertEquals(header.command.ascii, 'QUIT')
+        self.assertEquals(pdu, '')
+        self.assertEquals(self._stream.data, '')
+
+    def test_scanning_continues_from_previous_position(self):
+        self.assertEquals(self._receive('USER foo\r'), None)
+        self.assertEquals(self._framer._scanned, 8)
+        header, pdu = self._receive('\nPA')
+        self.assertEquals(pdu, ' foo')
+        self.assertEquals(self._stream.data, 'PA')
+        self.assertEquals(self._framer._scanned, 0)
+
+    def test_too_short_frame(self):
+        self.assertRaises(AssertionError, self._receive, 'NO\r\n')
+
+    def test_terminator_is_sent_after_message(self):
+        template = MessageTemplate('Request', self._protocol, {'command': 'USER'})
+        template.add(Char('*', 'name', None))
+        self.assertEquals(template.encode({'name': ' foo'}, {})._raw, 'USER foo\r\n')
+
+
 class TestMessageStream(TestCase):
 
     def setUp(self):
@@ -57,6 +160,24 @@ class TestMessageStream(TestCase):
         self._msg.header_parameters = {'id': '0x00'}
         self.assertRaises(socket.timeout, self._msg_stream.get, self._msg, timeout=0.1, header_filter='id')
 
+    def test_get_message_validated_on_decode(self):
+        expectations = Expectations({'field_1': '0xde', 'field_2': '0xad'}, {})
+        msg = self._msg_stream.get(self._msg, header_filter='id', expectations=expectations)
+        self.assertEquals(expectations.errors, [])
+        self.assertEquals(msg.field_2.hex, '0xad')
+        self.assertEquals(msg._header.id.hex, '0xaa')
+
+    def test_decoding_stops_at_first_mismatch(self):
+        expectations = Expectations({'field_1': '0xff', 'field_2': '0xff'}, {})
+        msg = self._msg_stream.get(self._msg, header_filter='id', expectations=expectations)
+        self.assertEquals(expectations.errors, ['Value of field field_1 does not match 0xde!=0xff'])
+        self.assertFalse('field_2' in msg)
+
+    def test_unknown_expected_fields_are_reported(self):
+        expectations = Expectations({'foo': '0xff'}, {})
+        self._msg_stream.get(self._msg, header_filter='id', expectations=expectations)
+        self.assertEquals(expectations.errors, ["Unknown fields in 'FooRequest': foo:0xff"])
+
     def test_get_messages_count_from_cache_two_messages(self):
         _ = self._msg_stream.get(self._msg, header_filter='id')
         self._msg.header_parameters = {'id': '0xdd'}
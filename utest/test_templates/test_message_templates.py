@@ -1,6 +1,7 @@
 from unittest import TestCase, main
 from Rammbock.templates.containers import Protocol, MessageTemplate, StructTemplate
 from Rammbock.templates.primitives import UInt, PDU, Char
+from Rammbock.templates.validators import Expectations
 from Rammbock.binary_tools import to_bin_of_length, to_bin
 from .tools import *
 
@@ -40,6 +41,20 @@ class TestMessageTemplate(TestCase):
         self.assertEquals(msg._header.msgId.int, 5)
         self.assertEquals(msg._header.length.int, 8)
 
+    def test_defaults_are_precomputed_when_added(self):
+        self.assertEquals(self.tmp._fields['field_1']._encoded_values[('1', False)],
+                          (to_bin('0x0001'), 2))
+        self.assertEquals(self._protocol._fields['msgId']._encoded_values[('5', False)],
+                          (to_bin('0x0005'), 2))
+
+    def test_precompute_template_values(self):
+        self.tmp.add(get_pair())
+        self.tmp.precompute_values({'field_2': '0xbabe', 'pair.first': '3',
+                                    'pair.unknown': '4', 'unknown.field': '5'})
+        self.assertTrue(('0xbabe', False) in self.tmp._fields['field_2']._encoded_values)
+        self.assertTrue(('3', False) in self.tmp._fields['pair']._fields['first']._encoded_values)
+        self.assertEquals(self.tmp.encode({}, {}).pair.first.int, 1)
+
     def test_encode_to_bytes(self):
         msg = self.tmp.encode({}, {})
         self.assertEquals(msg._header.msgId.int, 5)
@@ -65,6 +80,43 @@ class TestMessageTemplate(TestCase):
         msg = self.tmp.decode(to_bin('0xcafebabe'))
         self.assertEquals(msg.field_1.hex, '0xcafe')
 
+    def test_copy_shares_fields(self):
+        copy = self.tmp.copy()
+        self.assertTrue(copy._fields is self.tmp._fields)
+        self.assertEquals(copy.encode({}, {})._raw, self.tmp.encode({}, {})._raw)
+
+    def test_adding_field_to_copy_does_not_change_original(self):
+        pair = StructTemplate('Pair', 'pair', self.tmp)
+        pair.add(UInt(1, 'first', 1))
+        self.tmp.add(pair)
+        copy = self.tmp.copy()
+        copy.add(UInt(1, 'field_3', 3))
+        self.assertEquals(self.tmp._fields.keys(), ['field_1', 'field_2', 'pair'])
+        self.assertEquals(copy._fields.keys(), ['field_1', 'field_2', 'pair', 'field_3'])
+        self.assertTrue(copy._fields['pair'].parent is copy)
+        self.assertTrue(self.tmp._fields['pair'].parent is self.tmp)
+        self.assertTrue(copy._protocol is self._protocol)
+
+    def test_adding_field_to_original_does_not_change_copy(self):
+        copy = self.tmp.copy()
+        self.tmp.add(UInt(1, 'field_3', 3))
+        self.assertEquals(copy._fields.keys(), ['field_1', 'field_2'])
+        self.assertEquals(len(copy.encode({}, {})), 8)
+
+    def test_encode_native_values(self):
+        self.tmp.add(get_pair())
+        msg = self.tmp.encode({'field_1': bytearray('\x01\x02'), 'pair': {'first': 3}})
+        self.assertEquals(msg.field_1.hex, '0x0102')
+        self.assertEquals(msg.pair.first.int, 3)
+
+    def test_template_with_defaults(self):
+        template = self.tmp.with_defaults({'field_1': '7'})
+        self.assertEquals(template.encode().field_1.int, 7)
+        self.assertEquals(template.encode({'field_1': 8}).field_1.int, 8)
+        self.assertEquals(self.tmp.encode().field_1.int, 1)
+        self.assertEquals(template.validate(template.encode(), {'field_2': 2}), [])
+        self.assertEquals(len(template.validate(self.tmp.encode())), 1)
+
 
 class TestDefaultValues(TestCase):
 
@@ -113,6 +165,33 @@ class TestMessageTemplateValidation(TestCase):
         errors = self.tmp.validate(msg, {'field_2': '0xdead'}, {})
         self.assertEquals(len(errors), 2)
 
+    def test_validate_fail_fast(self):
+        msg = self._decode_and_set_fake_header('0xbeefbabe')
+        errors = self.tmp.validate(msg, {'field_2': '0xdead'}, {}, fail_fast=True)
+        self.assertEquals(errors, ['Value of field field_1 does not match 0xbeef!=0xcafe'])
+
+    def test_decode_and_validate_nested(self):
+        struct = StructTemplate('Pair', 'pair', self.tmp)
+        struct.add(UInt(1, 'first', 1))
+        struct.add(UInt(1, 'second', 2))
+        self.tmp.add(struct)
+        expectations = Expectations({'pair.second': '3'}, {})
+        msg = self.tmp.decode_and_validate(to_bin('0xcafebabe0102'), self.example._header, expectations)
+        self.assertEquals(expectations.errors, ['Value of field pair.second does not match 0x02!=3'])
+        self.assertEquals(msg.field_2.hex, '0xbabe')
+
+    def test_decode_and_validate_header_first(self):
+        expectations = Expectations({}, {'msgId': '6'})
+        msg = self.tmp.decode_and_validate(to_bin('0xcafebabe'), self.example._header, expectations)
+        self.assertEquals(expectations.errors, ['Value of field TestProtocol.msgId does not match 0x0005!=6'])
+        self.assertFalse('field_1' in msg)
+
+    def test_decode_and_validate_with_defaults(self):
+        template = self.tmp.with_defaults({'field_2': '0xdead'})
+        expectations = Expectations({}, {})
+        template.decode_and_validate(to_bin('0xcafebabe'), self.example._header, expectations)
+        self.assertEquals(expectations.errors, ['Value of field field_2 does not match 0xbabe!=0xdead'])
+
     def test_validate_pattern_pass(self):
         msg = self._decode_and_set_fake_header('0xcafe0002')
         errors = self.tmp.validate(msg, {'field_2': '(0|2)'}, {})
@@ -123,6 +202,11 @@ class TestMessageTemplateValidation(TestCase):
         errors = self.tmp.validate(msg, {'field_2': '(0|3)'}, {})
         self.assertEquals(len(errors), 1)
 
+    def test_validate_native_int(self):
+        msg = self._decode_and_set_fake_header('0xcafe0000')
+        self.assertEquals(self.tmp.validate(msg, {'field_2': 0}), [])
+        self.assertEquals(len(self.tmp.validate(msg, {'field_2': 1})), 1)
+
     def test_validate_passing_int(self):
         msg = self._decode_and_set_fake_header('0xcafe0200')
         errors = self.tmp.validate(msg, {'field_2': '512'}, {})
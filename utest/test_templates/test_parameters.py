@@ -0,0 +1,68 @@
+from unittest import TestCase, main
+from Rammbock.templates.parameters import Parameters
+
+
+class TestParameters(TestCase):
+
+    def test_values_of_level(self):
+        params = Parameters({'foo': 1, 'pair.first': 2})
+        self.assertEquals(params['foo'], 1)
+        self.assertFalse('pair.first' in params)
+        self.assertTrue(params.has('pair.first'))
+
+    def test_subtree(self):
+        params = Parameters({'pair.first': 1, 'pair.inner.x': 2, 'other.y': 3})
+        subtree = params.subtree('pair')
+        self.assertEquals(subtree['first'], 1)
+        self.assertEquals(subtree.subtree('inner')['x'], 2)
+        self.assertEquals(params.unused(), [('other.y', 3)])
+
+    def test_list_indices_with_brackets_and_dots(self):
+        params = Parameters({'list[0].x': 1, 'list.1.x': 2, 'list[2][3]': 4})
+        subtree = params.subtree('list')
+        self.assertEquals(subtree.subtree('0')['x'], 1)
+        self.assertEquals(subtree.subtree('1')['x'], 2)
+        self.assertEquals(subtree.subtree('2')['3'], 4)
+
+    def test_wildcard_applies_to_all_children(self):
+        params = Parameters({'*': 0, '*.x': 1, 'a.x': 2})
+        self.assertEquals(params.subtree('a')['x'], 2)
+        b = params.subtree('b')
+        self.assertEquals(b['x'], 1)
+        self.assertEquals(b['*'], 0)
+        self.assertEquals(params.subtree('c')['x'], 1)
+
+    def test_nested_dicts(self):
+        params = Parameters({'pair': {'first': 1, 'inner': {'x': 2}}, 'pair.second': 3})
+        subtree = params.subtree('pair')
+        self.assertEquals(subtree['first'], 1)
+        self.assertEquals(subtree['second'], 3)
+        self.assertEquals(subtree.subtree('inner')['x'], 2)
+
+    def test_copy_keeps_nested_values(self):
+        params = Parameters({'foo': 1, 'pair.first': 2, 'pair.inner.x': 3})
+        copied = Parameters(params)
+        self.assertEquals(copied['foo'], 1)
+        subtree = copied.subtree('pair')
+        self.assertEquals(subtree['first'], 2)
+        self.assertEquals(subtree.subtree('inner')['x'], 3)
+        self.assertTrue(params.has('pair.inner.x'))
+
+    def test_unused_values(self):
+        params = Parameters({'a.b.c': 1, 'd': 2})
+        self.assertEquals(sorted(params.unused()), [('a.b.c', 1), ('d', 2)])
+        params.subtree('a')
+        params.pop('d')
+        self.assertEquals(params.unused(), [])
+
+    def test_extract(self):
+        params = Parameters({'address.1': 2, 'address': 1, '*': 0})
+        self.assertEquals(params.indices('address'), ['1'])
+        extracted = params.extract(('address', '1'), 'address[1]')
+        self.assertEquals(extracted['address[1]'], 2)
+        self.assertEquals(extracted['*'], 0)
+        self.assertEquals(params.indices('address'), [])
+
+
+if __name__ == '__main__':
+    main()
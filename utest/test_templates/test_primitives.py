@@ -1,6 +1,6 @@
 from unittest import TestCase, main
 from Rammbock.templates.primitives import Char, UInt, PDU, Binary, Int
-from Rammbock.message import Field
+from Rammbock.message import Field, BinaryField
 from Rammbock.binary_tools import to_bin
 
 
@@ -99,6 +99,33 @@ class TestTemplateFields(TestCase):
         self.assertEquals(len(decoded), 2)
 
 
+class TestPrecomputedValues(TestCase):
+
+    def test_precomputed_value_is_used_in_encoding(self):
+        field = UInt(2, 'field', '0xcafe')
+        field.precompute_value('0xcafe')
+        field._encode_value = None
+        self.assertEquals(field.encode({}, None)._raw, to_bin('0xcafe'))
+        self.assertEquals(field.encode({}, None, little_endian=True)._raw, to_bin('0xfeca'))
+
+    def test_precomputed_value_is_used_in_validation(self):
+        template = UInt(2, 'field', '42')
+        template.precompute_value('42')
+        template._encode_value = None
+        field = Field('uint', 'field', to_bin('0x002a'))
+        self.assertEquals(template.validate({'field': field}, {}), [])
+
+    def test_values_not_sendable_are_not_precomputed(self):
+        field = UInt(2, 'field', '(1|2)')
+        field.precompute_value('(1|2)')
+        self.assertEquals(field._encoded_values, {})
+
+    def test_dynamic_length_values_are_not_precomputed(self):
+        field = Char('len', 'field', 'foo')
+        field.precompute_value('foo')
+        self.assertEquals(field._encoded_values, {})
+
+
 class TestLittleEndian(TestCase):
 
     def test_little_endian_uint_decode(self):
@@ -178,6 +205,36 @@ class TestTemplateFieldValidation(TestCase):
         field = Field('uint', 'field', to_bin('0x0004'))
         self._should_fail(template.validate({'field': field}, {'field': '42'}), 1)
 
+    def test_validate_masked(self):
+        field = Field('uint', 'field', to_bin('0x00f4'))
+        self._should_pass(UInt(2, 'field', '(0x04 & 0x0f)').validate({'field': field}, {}))
+        self._should_fail(UInt(2, 'field', '(0x05 & 0x0f)').validate({'field': field}, {}), 1)
+
+    def test_validate_binary_alternatives(self):
+        field = BinaryField(3, 'field', 5)
+        self._should_pass(Binary(3, 'field', '(1|5)').validate({'field': field}, {}))
+        self._should_fail(Binary(3, 'field', '(1|4)').validate({'field': field}, {}), 1)
+
+    def test_validator_is_compiled_once(self):
+        template = UInt(2, 'field', '(1|2|4)')
+        template.precompute_value(template.default_value)
+        field = Field('uint', 'field', to_bin('0x0004'))
+        self._should_pass(template.validate({'field': field}, {}))
+        template._encode_value = None
+        self._should_pass(template.validate({'field': field}, {}))
+        self.assertEquals(template._validators.keys(), ['(1|2|4)'])
+
+    def test_validators_of_received_values_are_not_kept(self):
+        template = UInt(2, 'field', None)
+        field = Field('uint', 'field', to_bin('0x0004'))
+        for value in range(1, 5):
+            template.validate({'field': field}, {'field': str(value)})
+        self.assertEquals(template._validators, {})
+
+    def test_invalid_regexp(self):
+        field = Field('chars', 'field', 'foo')
+        self.assertRaises(Exception, Char(3, 'field', 'REGEXP:(').validate, {'field': field}, {})
+
 
 class TestAlignment(TestCase):
 
@@ -1,7 +1,7 @@
 from unittest import TestCase
 from Rammbock.templates.containers import Protocol, MessageTemplate
 from Rammbock.templates.primitives import UInt, PDU
-from Rammbock.binary_tools import to_bin
+from Rammbock.binary_tools import to_bin, to_0xhex
 from .tools import *
 
 
@@ -37,12 +37,37 @@ class TestStructs(TestCase):
         encoded = str_str.encode({}, {})
         self.assertEquals(encoded.pair.first.int, 1)
 
+    def test_struct_parameters_are_used_on_every_encode(self):
+        struct = StructTemplate('Pair', 'pair', None, parameters={'pair.first': '7'})
+        struct.add(UInt(1, 'first', None))
+        self.assertEquals(struct.encode({}).first.int, 7)
+        self.assertEquals(struct.encode({}).first.int, 7)
+
+    def test_struct_type_used_with_other_names(self):
+        pair = StructTemplate('Pair', 'Pair', None, parameters={'first': '7'})
+        pair.add(UInt(1, 'first', None))
+        pair.add(UInt(1, 'second', 2))
+        struct = StructTemplate('TwoPairs', 'pairs', None)
+        struct.add(pair.use_as('one', struct))
+        struct.add(pair.use_as('two', struct, {'second': '3'}))
+        encoded = struct.encode({'pairs.one.first': '1'})
+        self.assertEquals(to_0xhex(encoded._raw), '0x01020703')
+        self.assertTrue(struct._fields['one']._fields is struct._fields['two']._fields)
+        self.assertEquals(struct._fields['two'].name, 'two')
+
+    def test_struct_type_with_length(self):
+        pair = StructTemplate('Pair', 'Pair', None)
+        pair.add(UInt(1, 'first', 1))
+        struct = StructTemplate('Container', 'container', None)
+        struct.add(UInt(1, 'length', None))
+        struct.add(pair.use_as('pair', struct, length='length'))
+        self.assertEquals(to_0xhex(struct.encode({})._raw), '0x0101')
+        self.assertFalse(pair.has_length)
+
     def test_get_recursive_names(self):
         pair = get_pair()
         names = pair._get_params_sub_tree({'pair.foo': 0, 'pairnotyourname.ploo': 2, 'pair.goo.doo': 3})
-        self.assertEquals(len(names), 2)
-        self.assertEquals(names['foo'], 0)
-        self.assertEquals(names['goo.doo'], 3)
+        self.assertEquals(dict(names.unused()), {'foo': 0, 'goo.doo': 3})
 
     def test_set_recursive(self):
         str_str = get_recursive_struct()
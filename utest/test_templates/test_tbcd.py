@@ -1,6 +1,6 @@
 from unittest import TestCase
 from Rammbock.templates.primitives import UInt, PDU
-from Rammbock.binary_tools import to_bin
+from Rammbock.binary_tools import to_bin, to_tbcd_binary
 from .tools import *
 
 
@@ -90,3 +90,23 @@ class TestTBCDContainerTemplate(TestCase):
         container.add(TBCD('4', 'second', '1234'))
         encoded = container.encode({})
         self.assertEquals(4, len(encoded))
+
+    def test_decode_fields_starting_from_middle_of_byte(self):
+        container = TBCDContainerTemplate('tbcd', None)
+        container.add(TBCD('3', 'first', None))
+        container.add(TBCD('3', 'second', None))
+        container.add(TBCD('2', 'third', None))
+        decoded = container.decode(to_tbcd_binary('12345678'))
+        self.assertEquals('123', decoded.first.tbcd)
+        self.assertEquals('456', decoded.second.tbcd)
+        self.assertEquals('78', decoded.third.tbcd)
+        self.assertEquals(to_tbcd_binary('123'), decoded.first.bytes)
+        self.assertEquals(to_tbcd_binary('12345678'), decoded._raw)
+
+    def test_encode_even_fields_with_leading_zeros(self):
+        container = TBCDContainerTemplate('tbcd', None)
+        container.add(TBCD('2', 'first', '00'))
+        container.add(TBCD('3', 'second', '123'))
+        encoded = container.encode({})
+        self.assertEquals(to_bin('0x0021f3'), encoded._raw)
+        self.assertEquals(3, len(encoded))
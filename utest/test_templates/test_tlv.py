@@ -0,0 +1,125 @@
+from unittest import TestCase, main
+from Rammbock.templates.containers import TLVTemplate, TLVElementTemplate, \
+    StructTemplate
+from Rammbock.templates.primitives import UInt, Char
+from Rammbock.templates.validators import ValidationFailed
+from Rammbock.binary_tools import to_bin, to_0xhex
+
+
+class TestTLV(TestCase):
+
+    def setUp(self):
+        self.tlv = self._tlv()
+
+    def _tlv(self, **config):
+        tlv = TLVTemplate('options', None, **config)
+        self._add_element(tlv, 12, Char('*', 'hostName', None))
+        self._add_element(tlv, 50, UInt(4, 'address', None))
+        return tlv
+
+    def _add_element(self, tlv, tag, field):
+        element = TLVElementTemplate(tag, tlv)
+        element.add(field)
+        tlv.add(element)
+
+    def test_decode(self):
+        decoded = self.tlv.decode(to_bin('0x0c 05 666f6f 32 06 c0a80001'))
+        self.assertEquals(decoded.hostName.ascii, 'foo')
+        self.assertEquals(decoded.address.hex, '0xc0a80001')
+        self.assertEquals(decoded.tags, [12, 50])
+        self.assertEquals(len(decoded), 11)
+
+    def test_lookup_by_tag(self):
+        decoded = self.tlv.decode(to_bin('0x32 06 c0a80001 0c 05 666f6f'))
+        self.assertEquals(decoded[12].ascii, 'foo')
+        self.assertEquals(decoded[50].hex, '0xc0a80001')
+        self.assertTrue(12 in decoded)
+        self.assertFalse(13 in decoded)
+        self.assertRaises(KeyError, lambda: decoded[13])
+
+    def test_repeated_elements(self):
+        decoded = self.tlv.decode(to_bin('0x32 06 00000001 32 06 00000002'))
+        self.assertEquals([address.int for address in decoded.all(50)], [1, 2])
+        self.assertEquals(decoded['address[1]'].int, 2)
+
+    def test_unknown_tag_is_decoded_as_bytes(self):
+        decoded = self.tlv.decode(to_bin('0x07 03 ff'))
+        self.assertEquals(decoded[7].bytes, '\xff')
+
+    def test_exclusive_length_and_padding(self):
+        tlv = self._tlv(tag_width=2, length_width=2, inclusive=False, align=4)
+        decoded = tlv.decode(to_bin('0x000c 0003 666f6f 00 0032 0004 c0a80001'))
+        self.assertEquals(decoded.hostName.ascii, 'foo')
+        self.assertEquals(decoded.address.hex, '0xc0a80001')
+        self.assertEquals(len(decoded), 16)
+
+    def test_little_endian_header(self):
+        tlv = self._tlv(tag_width=2, length_width=2)
+        decoded = tlv.decode(to_bin('0x0c00 0700 666f6f'), little_endian=True)
+        self.assertEquals(decoded.hostName.ascii, 'foo')
+
+    def test_invalid_length(self):
+        self.assertRaises(AssertionError, self.tlv.decode, to_bin('0x0c 01'))
+        self.assertRaises(AssertionError, self.tlv.decode, to_bin('0x0c 09 666f6f'))
+        self.assertRaises(Exception, self.tlv.decode, to_bin('0x32 05 c0a800'))
+
+    def test_encode(self):
+        encoded = self.tlv.encode({'options.hostName': 'foo', 'options.address': '1'})
+        self.assertEquals(to_0xhex(encoded._raw), '0x0c05666f6f320600000001')
+
+    def test_encode_selected_elements(self):
+        encoded = self.tlv.encode({'options': 'address, address',
+                                   'options.address': '1', 'options.address[1]': '2'})
+        self.assertEquals(to_0xhex(encoded._raw), '0x320600000001320600000002')
+        self.assertEquals(encoded.tags, [50, 50])
+
+    def test_encode_with_padding(self):
+        tlv = self._tlv(tag_width=2, length_width=2, inclusive=False, align=4)
+        encoded = tlv.encode({'options': 'hostName', 'options.hostName': 'foo'})
+        self.assertEquals(to_0xhex(encoded._raw), '0x000c0003666f6f00')
+
+    def test_encode_unknown_element(self):
+        self.assertRaises(AssertionError, self.tlv.encode, {'options': 'foo'})
+
+    def test_struct_value(self):
+        tlv = TLVTemplate('ies', None, tag_width=1, length_width=2, inclusive=False)
+        struct = StructTemplate('Cause', 'cause', None)
+        struct.add(UInt(1, 'value', None))
+        struct.add(UInt(1, 'flags', None))
+        self._add_element(tlv, 2, struct)
+        decoded = tlv.decode(to_bin('0x02 0002 1001'))
+        self.assertEquals(decoded[2].value.int, 16)
+        self.assertEquals(decoded.cause.flags.int, 1)
+
+    def test_validate(self):
+        decoded = self.tlv.decode(to_bin('0x0c 05 666f6f 32 06 c0a80001'))
+        self.assertEquals(self.tlv.validate({'options': decoded}, {'options.hostName': 'foo'}), [])
+        self.assertEquals(len(self.tlv.validate({'options': decoded}, {'options.address': '1'})), 1)
+
+    def test_validate_missing_element(self):
+        decoded = self.tlv.decode(to_bin('0x0c 05 666f6f'))
+        self.assertEquals(self.tlv.validate({'options': decoded}, {'options.address': '1'}),
+                          ["TLV element 'address' not found in 'options'"])
+
+    def test_validate_while_decoding(self):
+        self.assertRaises(ValidationFailed, self.tlv.decode,
+                          to_bin('0x0c 05 666f6f 32 06 c0a80001'),
+                          expected={'options.address': '1'})
+        decoded = self.tlv.decode(to_bin('0x0c 05 666f6f'), expected={'options.hostName': 'foo'})
+        self.assertEquals(decoded.hostName.ascii, 'foo')
+
+    def test_validate_repeated_elements(self):
+        decoded = self.tlv.decode(to_bin('0x32 06 00000001 32 06 00000002'))
+        self.assertEquals(self.tlv.validate({'options': decoded},
+                                            {'options.address': '1', 'options.address[1]': '2'}), [])
+        self.assertEquals(self.tlv.validate({'options': decoded}, {'options.address[2]': '3'}),
+                          ["TLV element 'address[2]' not found in 'options'"])
+        self.assertRaises(ValidationFailed, self.tlv.decode, to_bin('0x32 06 00000001 32 06 00000002'),
+                          expected={'options.address[1]': '1'})
+
+    def test_duplicate_tag(self):
+        self.assertRaises(AssertionError, self._add_element, self.tlv, 12, UInt(1, 'other', None))
+
+
+if __name__ == '__main__':
+    main()
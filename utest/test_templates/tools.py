@@ -1,4 +1,3 @@
-import socket
 from contextlib import contextmanager
 from Rammbock.templates.containers import Protocol, MessageTemplate, StructTemplate, ListTemplate, UnionTemplate, BinaryContainerTemplate, TBCDContainerTemplate, ConditionalTemplate
 from Rammbock.templates.primitives import UInt, PDU, Char, Binary, TBCD
@@ -75,18 +74,15 @@ class MockStream(object):
     def __init__(self, data):
         self.data = data
 
-    def read(self, length, timeout=None):
-        if length > len(self.data):
-            if timeout:
-                raise socket.timeout('timeout')
-            else:
-                raise AssertionError('No timeout, but out of data.')
-        result = self.data[:length]
-        self.data = self.data[length:]
-        return result
-
-    def return_data(self, data):
-        self.data = data + self.data
+    @property
+    def buffered(self):
+        return self.data
+
+    def consume(self, size):
+        self.data = self.data[size:]
+
+    def read_frame(self, framer, timeout=None):
+        return framer.next(self)
 
     def empty(self):
         self.data = ''